@@ -6,11 +6,15 @@ from flask import render_template
 from flask_assets import Environment
 
 
-engine = get_sql_alchemy_oracle_engine()
+# one connection per worker thread, app.db gives each request its own session. with a ":pooled" (drcp) login the
+# connections come from an oracledb pool of pool_max connections instead
+worker_threads = int(os.getenv("worker_threads", 5))
+engine = get_sql_alchemy_oracle_engine(pool_size=worker_threads, pool_max=worker_threads)
 tables = {tables}
 
+# health_probes serves /health/live for the Dockerfile's HEALTHCHECK
 app = SecureFlaskApp(
-    __name__, "{app_name}", engine, tables
+    __name__, "{app_name}", engine, tables, health_probes=True
 )
 
 for config_key in ["app_name", "app_port", "instance", "service", "app_url"]:
@@ -21,18 +25,9 @@ for config_key in ["app_name", "app_port", "instance", "service", "app_url"]:
 app.logger.handlers.extend(logging.getLogger("gunicorn.error").handlers)
 app.logger.setLevel(logging.DEBUG)
 
-# configure asset management
+# configure asset management. the app already gives static urls (including bundles) content hashes
 assets = Environment(app)
-
-
-@app.teardown_appcontext
-def shutdown_user_session(response_or_error):
-    """
-    Necessary for database cleanup on session close. If not here, 
-    it is possible for the connection to stay open with a bad transaction.
-    """
-    app.db.rollback()
-    return response_or_error
+assets.url_expire = False
 
 
 @app.route("/")
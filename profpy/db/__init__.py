@@ -1,2 +1,11 @@
 from .general.connections import *
 from .general.functions import execute_query, execute_statement, sql_file_to_statements
+from .general.encoding import ColumnEncoder
+from .general.external import external_sort, external_group_by
+from .general.joins import hash_join
+from .general.batch import BatchJob, FileCheckpoint, TableCheckpoint
+from .general.routing import ReplicaRouter, RoutingSession, create_replica_router, with_routed_connection, \
+    with_routed_session
+from .general.mirror import ReferenceMirror, MirrorTable
+from .general.profiling import enable_memory_profiling, disable_memory_profiling, get_memory_report, \
+    reset_memory_report, sql_fingerprint, MemoryBudgetWarning
@@ -0,0 +1,311 @@
+"""
+Checkpointed, resumable batch jobs for large DML workloads.
+
+Rather than pushing millions of row changes through a single transaction, a BatchJob processes keyed work in chunks,
+commits every N rows or T seconds, and records the key of the last committed item. If the job dies, running it again
+resumes after that key.
+"""
+import os
+import json
+import time
+import logging
+from decimal import Decimal
+from datetime import date, datetime
+
+DEFAULT_COMMIT_EVERY = 1000
+DEFAULT_CHECKPOINT_TABLE = "profpy_job_checkpoints"
+
+_logger = logging.getLogger("profpy.db.batch")
+
+
+def _encode_key(key):
+    """
+    Converts a checkpoint key to json, tagging the types json would lose (e.g. a tuple would come back as a list,
+    which can't be compared with the live keys on resume)
+    :param key: A checkpoint key: None, str, int, float, Decimal, date, datetime, or a tuple/list of those
+    :return:    the json-serializable key
+    """
+    if key is None or isinstance(key, (str, bool, int, float)):
+        return key
+    if isinstance(key, tuple):
+        return {"tuple": [_encode_key(k) for k in key]}
+    if isinstance(key, list):
+        return [_encode_key(k) for k in key]
+    if isinstance(key, datetime):
+        return {"datetime": key.isoformat()}
+    if isinstance(key, date):
+        return {"date": key.isoformat()}
+    if isinstance(key, Decimal):
+        return {"decimal": str(key)}
+    raise TypeError(f"Checkpoint keys must be str, int, float, Decimal, date, datetime or tuples of those, not "
+                    f"{type(key).__name__}.")
+
+
+def _decode_key(value):
+    """
+    :param value: A key encoded with _encode_key
+    :return:      the original checkpoint key
+    """
+    if isinstance(value, list):
+        return [_decode_key(v) for v in value]
+    if isinstance(value, dict):
+        (tag, tagged), = value.items()
+        if tag == "tuple":
+            return tuple(_decode_key(v) for v in tagged)
+        if tag == "datetime":
+            return datetime.fromisoformat(tagged)
+        if tag == "date":
+            return date.fromisoformat(tagged)
+        if tag == "decimal":
+            return Decimal(tagged)
+        raise ValueError(f"Unknown checkpoint key type: {tag}")
+    return value
+
+
+class FileCheckpoint(object):
+    """
+    Stores job checkpoints in a local json file. The file is replaced atomically on every save. Keys can be str, int,
+    float, Decimal, date, datetime or tuples of those.
+    """
+    in_transaction = False
+
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: Path to the state file (str)
+        """
+        self.path = path
+
+    def __read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, "r") as state_file:
+            return json.load(state_file)
+
+    def __write(self, state):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as state_file:
+            json.dump(state, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, self.path)
+
+    def load(self, connection, job_name):
+        """
+        :return: (last committed key, rows processed so far), or (None, 0) if the job has no checkpoint
+        """
+        state = self.__read().get(job_name)
+        return (_decode_key(state["key"]), state["rows"]) if state else (None, 0)
+
+    def save(self, connection, job_name, key, rows):
+        state = self.__read()
+        state[job_name] = dict(key=_encode_key(key), rows=rows, updated=time.time())
+        self.__write(state)
+
+    def clear(self, connection, job_name):
+        state = self.__read()
+        if state.pop(job_name, None) is not None:
+            self.__write(state)
+
+
+class TableCheckpoint(object):
+    """
+    Stores job checkpoints in a database table. The checkpoint is written in the same transaction as the chunk it
+    belongs to, so the two can never disagree. Keys can be str, int, float, Decimal, date, datetime or tuples of those.
+    See create_table_sql for the ddl.
+    """
+    in_transaction = True
+
+    def __init__(self, table=DEFAULT_CHECKPOINT_TABLE):
+        """
+        Constructor
+        :param table: The (optionally schema-qualified) checkpoint table (str)
+        """
+        self.table = table
+
+    @property
+    def create_table_sql(self):
+        """
+        :return: DDL for the checkpoint table (str)
+        """
+        return f"""create table {self.table} (
+            job_name       varchar2(200) primary key,
+            checkpoint_key varchar2(4000),
+            rows_processed number,
+            updated_at     date
+        )"""
+
+    def load(self, connection, job_name):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"select checkpoint_key, rows_processed from {self.table} where job_name=:job_name",
+                           dict(job_name=job_name))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return (_decode_key(json.loads(row[0])), int(row[1] or 0)) if row else (None, 0)
+
+    def save(self, connection, job_name, key, rows):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f"""merge into {self.table} t
+                    using (select :job_name job_name from dual) s on (t.job_name = s.job_name)
+                    when matched then update set t.checkpoint_key=:checkpoint_key, t.rows_processed=:rows_processed,
+                                                 t.updated_at=sysdate
+                    when not matched then insert (job_name, checkpoint_key, rows_processed, updated_at)
+                                          values (:job_name, :checkpoint_key, :rows_processed, sysdate)""",
+                dict(job_name=job_name, checkpoint_key=json.dumps(_encode_key(key)), rows_processed=rows)
+            )
+        finally:
+            cursor.close()
+
+    def clear(self, connection, job_name):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"delete from {self.table} where job_name=:job_name", dict(job_name=job_name))
+        finally:
+            cursor.close()
+        connection.commit()
+
+
+class BatchJob(object):
+    """
+    Runs keyed work through a processing function in committed chunks, checkpointing as it goes.
+
+    The work must come in ascending key order. It can be an iterable (items at or before the checkpoint are skipped
+    on resume) or a function that takes the last committed key (None on a fresh run) and returns the remaining work,
+    which lets the query itself pick up where the job left off.
+    """
+    def __init__(self, connection, name, work, process, key=None, commit_every=DEFAULT_COMMIT_EVERY,
+                 commit_seconds=None, checkpoint=None, total=None, report_seconds=30, clear_on_success=True):
+        """
+        Constructor
+        :param connection:       A cx_Oracle connection                                                     (Connection)
+        :param name:             A unique name for the job, used as the checkpoint id                       (str)
+        :param work:             The work items, or a function(last_key) returning them           (iterable/callable)
+        :param process:          Function(cursor, chunk) that applies the changes for a list of work items  (callable)
+        :param key:              Function computing the checkpoint key of an item, defaults to the item     (callable)
+        :param commit_every:     Commit after this many items                                               (int)
+        :param commit_seconds:   Also commit once this many seconds have passed since the last commit       (float)
+        :param checkpoint:       A FileCheckpoint or TableCheckpoint, None to run without resume support
+        :param total:            Total number of items (including already processed ones), used for the ETA (int)
+        :param report_seconds:   Minimum seconds between progress log messages                              (float)
+        :param clear_on_success: Remove the checkpoint once the job finishes                                (bool)
+        """
+        if commit_every < 1:
+            raise ValueError("commit_every must be at least 1.")
+        self.connection = connection
+        self.name = name
+        self.work = work
+        self.process = process
+        self.key = key or (lambda item: item)
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+        self.checkpoint = checkpoint
+        self.total = total
+        self.report_seconds = report_seconds
+        self.clear_on_success = clear_on_success
+
+        self.rows = 0
+        self.commits = 0
+        self.last_key = None
+        self.__started = None
+        self.__resumed_rows = 0
+        self.__last_report = 0
+
+    def run(self):
+        """
+        Runs (or resumes) the job. If processing fails, the current chunk is rolled back and the exception is raised;
+        everything up to the last checkpoint stays committed.
+        :return: A summary of the run (dict)
+        """
+        self.__started = time.monotonic()
+        if self.checkpoint:
+            self.last_key, self.rows = self.checkpoint.load(self.connection, self.name)
+            if self.last_key is not None:
+                _logger.info(f"{self.name}: resuming after key {self.last_key!r} ({self.rows} rows already processed)")
+        self.__resumed_rows = self.rows
+
+        if callable(self.work):
+            items = self.work(self.last_key)
+            resume_after = None
+        else:
+            items = self.work
+            resume_after = self.last_key
+
+        cursor = self.connection.cursor()
+        chunk = []
+        last_commit = time.monotonic()
+        try:
+            for item in items:
+                if resume_after is not None:
+                    if self.key(item) <= resume_after:
+                        continue
+                    resume_after = None
+                chunk.append(item)
+                if len(chunk) >= self.commit_every or \
+                        (self.commit_seconds and time.monotonic() - last_commit >= self.commit_seconds):
+                    self.__commit_chunk(cursor, chunk)
+                    chunk = []
+                    last_commit = time.monotonic()
+            if chunk:
+                self.__commit_chunk(cursor, chunk)
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        if self.checkpoint and self.clear_on_success:
+            self.checkpoint.clear(self.connection, self.name)
+        summary = self.progress()
+        _logger.info(f"{self.name}: finished {summary['rows']} rows in {summary['elapsed']:.1f}s "
+                     f"({summary['rows_per_second']:.1f} rows/s)")
+        return summary
+
+    def __commit_chunk(self, cursor, chunk):
+        last_key = self.key(chunk[-1])
+        if self.checkpoint:
+            # fail before the chunk is applied if its key can't be checkpointed
+            _encode_key(last_key)
+        self.process(cursor, chunk)
+        rows = self.rows + len(chunk)
+
+        if self.checkpoint and self.checkpoint.in_transaction:
+            self.checkpoint.save(self.connection, self.name, last_key, rows)
+        self.connection.commit()
+        if self.checkpoint and not self.checkpoint.in_transaction:
+            self.checkpoint.save(self.connection, self.name, last_key, rows)
+
+        self.last_key = last_key
+        self.rows = rows
+        self.commits += 1
+        self.__report()
+
+    def progress(self):
+        """
+        :return: dict with rows, commits, last_key, elapsed seconds, rows_per_second and eta_seconds (None when the
+                 total is unknown)
+        """
+        elapsed = time.monotonic() - self.__started if self.__started else 0.0
+        done_this_run = self.rows - self.__resumed_rows
+        rate = done_this_run / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - self.rows, 0) / rate
+        return dict(rows=self.rows, commits=self.commits, last_key=self.last_key, elapsed=elapsed,
+                    rows_per_second=rate, eta_seconds=eta)
+
+    def __report(self):
+        now = time.monotonic()
+        if now - self.__last_report < self.report_seconds:
+            return
+        self.__last_report = now
+        p = self.progress()
+        message = f"{self.name}: {p['rows']} rows, {p['rows_per_second']:.1f} rows/s"
+        if self.total:
+            message += f", {100.0 * p['rows'] / self.total:.1f}% of {self.total}"
+        if p["eta_seconds"] is not None:
+            message += f", eta {p['eta_seconds']:.0f}s"
+        _logger.info(message)
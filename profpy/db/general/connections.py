@@ -4,9 +4,19 @@ import re
 import functools
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool
 
 short_form_regex = re.compile(r"^[a-zA-Z]+[a-zA-Z0-9_]*@[a-zA-Z_]+$")
 
+# drcp
+_pooled_suffix = ":pooled"
+_cclass_var = "db_cclass"
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 4
+DEFAULT_POOL_INCREMENT = 1
+# create_engine options only a QueuePool accepts, which the NullPool used with drcp would reject
+_queue_pool_options = ("pool_size", "max_overflow", "pool_timeout", "pool_use_lifo")
+
 DatabaseError = cx_Oracle.DatabaseError
 
 class OracleConnectionHelper(object):
@@ -14,20 +24,38 @@ class OracleConnectionHelper(object):
     Oracle connection string handling/parsing class. This class handles all of the common logic for connecting to
     Oracle databases with both cx_Oracle and sqlalchemy
     """
-    def __init__(self, login, password):
+    def __init__(self, login, password, drcp=False, cclass=None, purity=None, pool_min=DEFAULT_POOL_MIN,
+                 pool_max=DEFAULT_POOL_MAX, pool_increment=DEFAULT_POOL_INCREMENT):
         """
         Constructor, chops up login string into individual parts to be used to create connections.
-        :param login:    the database login string
-        :param password: the database password
+        :param login:          the database login string. Ending an easy connect login with ":pooled" turns on
+                               drcp, a tnsnames alias needs (SERVER=POOLED) in its descriptor and drcp=True
+        :param password:       the database password
+        :param drcp:           whether or not to use database resident connection pooling
+        :param cclass:         the drcp connection class, sessions are only shared between connections of one class
+        :param purity:         the drcp session purity: "self" (reuse sessions) , "new" or "default"
+        :param pool_min:       minimum connections in the client-side pool that fronts drcp for sqlalchemy engines
+        :param pool_max:       maximum connections in the client-side pool that fronts drcp for sqlalchemy engines
+        :param pool_increment: how many connections the client-side pool opens at once
         """
 
         # Run oracledb using thick mode. (Requires the oracle instant client to be installed)
         d = None
         cx_Oracle.init_oracle_client(lib_dir=d)
-        
+
+        pooled_suffix = login.endswith(_pooled_suffix)
+        if pooled_suffix:
+            login = login[:-len(_pooled_suffix)]
+            drcp = True
+
         login_parts = login.split("@")
 
         if re.match(short_form_regex, login):
+            if pooled_suffix:
+                # a tnsnames alias can't ask for a pooled server, only its descriptor can
+                raise ValueError(f"Invalid login string. \"{_pooled_suffix}\" only works with easy connect logins "
+                                 f"(user@//host:port/service{_pooled_suffix}). For a tnsnames alias, add "
+                                 f"(SERVER=POOLED) to its descriptor and pass drcp=True instead.")
             username = login_parts[0]
             dsn = login_parts[1]
         else:
@@ -40,7 +68,11 @@ class OracleConnectionHelper(object):
                 port_and_service = server_parts[1].split("/")
                 port = port_and_service[0]
                 service = port_and_service[1]
-                dsn = cx_Oracle.makedsn(host, port, service_name=service)
+                if drcp:
+                    # easy connect syntax for a pooled server
+                    dsn = f"{host}:{port}/{service}{_pooled_suffix}"
+                else:
+                    dsn = cx_Oracle.makedsn(host, port, service_name=service)
             except IndexError:
                 raise Exception("Invalid login string.")
 
@@ -49,17 +81,69 @@ class OracleConnectionHelper(object):
         self.__dsn = dsn
         self.__engine_string = f"oracle+oracledb://{username}:{password}@{dsn}"
 
+        self.__drcp = drcp
+        self.__cclass = cclass if cclass else (os.environ.get(_cclass_var) if drcp else None)
+        self.__purity = _get_purity(purity) if purity else None
+        self.__pool_min = pool_min
+        self.__pool_max = pool_max
+        self.__pool_increment = pool_increment
+
+    @property
+    def drcp(self):
+        """
+        :return: whether or not this helper connects through drcp
+        """
+        return self.__drcp
+
+    def __drcp_args(self):
+        """
+        :return: the drcp-specific keyword arguments for oracledb connections/pools
+        """
+        args = dict()
+        if self.__cclass:
+            args["cclass"] = self.__cclass
+        if self.__purity is not None:
+            args["purity"] = self.__purity
+        return args
+
     def get_cx_oracle_connection(self):
         """
         :return: A cx_Oracle connection object
         """
+        if self.__drcp:
+            return cx_Oracle.connect(user=self.__username, password=self.__password, dsn=self.__dsn,
+                                     **self.__drcp_args())
         return cx_Oracle.connect(user=self.__username, password=self.__password, dsn=self.__dsn)
 
-    def get_sql_alchemy_engine(self):
+    def get_cx_oracle_pool(self, pool_max=None):
         """
-        :return: A sqlalchemy engine object
+        :param pool_max: the most connections in the pool, defaults to the helper's pool_max
+        :return:         An oracledb connection pool. With drcp, connections released back to this pool also release
+                         their pooled server on the database
         """
-        return create_engine(self.__engine_string)
+        return cx_Oracle.create_pool(user=self.__username, password=self.__password, dsn=self.__dsn,
+                                     min=self.__pool_min, max=pool_max or self.__pool_max,
+                                     increment=self.__pool_increment, **self.__drcp_args())
+
+    def get_sql_alchemy_engine(self, **engine_options):
+        """
+        :param engine_options: any additional create_engine arguments (pool_size, pool_recycle, etc.). With drcp,
+                               pool_size and max_overflow size the oracledb pool instead, and the other QueuePool-only
+                               options are ignored
+        :return:               A sqlalchemy engine object
+        """
+        if self.__drcp:
+            # sqlalchemy's own pool would hold connections (and their pooled servers) open while idle. Instead let
+            # the oracledb pool hand out connections, and have sqlalchemy close them as soon as they are returned
+            pool_max = self.__pool_max
+            if engine_options.setdefault("poolclass", NullPool) is NullPool:
+                queue_pool_options = {o: engine_options.pop(o) for o in _queue_pool_options if o in engine_options}
+                if queue_pool_options.get("pool_size"):
+                    overflow = max(queue_pool_options.get("max_overflow") or 0, 0)
+                    pool_max = max(pool_max, queue_pool_options["pool_size"] + overflow)
+            pool = self.get_cx_oracle_pool(pool_max=pool_max)
+            return create_engine("oracle+oracledb://", creator=pool.acquire, **engine_options)
+        return create_engine(self.__engine_string, **engine_options)
 
     def get_sql_alchemy_session(self, scoped=False, bind=None):
         """
@@ -71,6 +155,20 @@ class OracleConnectionHelper(object):
         return scoped_session(session)() if scoped else session()
 
 
+def _get_purity(purity):
+    """
+    Translates a purity name into the oracledb constant
+    :param purity: "self", "new" or "default" (or an oracledb purity constant)
+    :return:       the oracledb purity constant
+    """
+    if not isinstance(purity, str):
+        return purity
+    try:
+        return getattr(cx_Oracle, f"PURITY_{purity.upper()}")
+    except AttributeError:
+        raise ValueError(f"Invalid drcp purity: {purity}. Must be one of: self, new, default")
+
+
 def _cx_oracle_wrapper_logic(f, login, password, auto_commit, *args, **kwargs):
     """
     Common logic between Oracle connection decorators. This was made to avoid duplicate code and to avoid making
@@ -288,36 +386,54 @@ def get_sql_alchemy_oracle_model(engine, object_owner, object_name, return_relat
 
 
 def get_sql_alchemy_oracle_session(login=os.environ.get("full_login"), password=os.environ.get("db_password"),
-                                   scoped=False, bind=None):
+                                   scoped=False, bind=None, **drcp_options):
     """
     Returns an Oracle sqlalchemy Session object
-    :param login:    the database login string
-    :param password: the database password
-    :param scoped:   whether or not to return a scoped session
-    :param bind:        the engine to bind to, a new one gets created if this is left null
-    :return:         a Session object
+    :param login:        the database login string
+    :param password:     the database password
+    :param scoped:       whether or not to return a scoped session
+    :param bind:         the engine to bind to, a new one gets created if this is left null
+    :param drcp_options: drcp, cclass, purity, pool_min, pool_max, pool_increment (see OracleConnectionHelper)
+    :return:             a Session object
     """
-    return OracleConnectionHelper(login, password).get_sql_alchemy_session(scoped=scoped, bind=bind)
+    return OracleConnectionHelper(login, password, **drcp_options).get_sql_alchemy_session(scoped=scoped, bind=bind)
 
 
-def get_sql_alchemy_oracle_engine(login=os.environ.get("full_login"), password=os.environ.get("db_password")):
+def get_sql_alchemy_oracle_engine(login=os.environ.get("full_login"), password=os.environ.get("db_password"),
+                                  drcp=False, cclass=None, purity=None, pool_min=DEFAULT_POOL_MIN,
+                                  pool_max=DEFAULT_POOL_MAX, pool_increment=DEFAULT_POOL_INCREMENT, **engine_options):
     """
     Returns an Oracle sqlalchemy engine
-    :param login:    the database login string
-    :param password: the database password
-    :return:         a sqlalchemy engine
+    :param login:          the database login string
+    :param password:       the database password
+    :param drcp:           whether or not to use database resident connection pooling
+    :param cclass:         the drcp connection class
+    :param purity:         the drcp session purity ("self", "new" or "default")
+    :param pool_min:       minimum connections in the client-side pool (drcp only)
+    :param pool_max:       maximum connections in the client-side pool (drcp only)
+    :param pool_increment: connections opened at once by the client-side pool (drcp only)
+    :param engine_options: any additional create_engine arguments
+    :return:               a sqlalchemy engine
     """
-    return OracleConnectionHelper(login, password).get_sql_alchemy_engine()
+    return OracleConnectionHelper(
+        login, password, drcp=drcp, cclass=cclass, purity=purity, pool_min=pool_min, pool_max=pool_max,
+        pool_increment=pool_increment
+    ).get_sql_alchemy_engine(**engine_options)
 
 
-def get_cx_oracle_connection(login=os.environ.get("full_login"), password=os.environ.get("db_password")):
+def get_cx_oracle_connection(login=os.environ.get("full_login"), password=os.environ.get("db_password"),
+                             drcp=False, cclass=None, purity=None):
     """
     Returns a cx_Oracle connection object
     :param login:    the database login string
     :param password: the database password
+    :param drcp:     whether or not to use database resident connection pooling
+    :param cclass:   the drcp connection class
+    :param purity:   the drcp session purity ("self", "new" or "default")
     :return:         a cx_Oracle connection object
     """
-    return OracleConnectionHelper(login, password).get_cx_oracle_connection()
+    return OracleConnectionHelper(login, password, drcp=drcp, cclass=cclass,
+                                  purity=purity).get_cx_oracle_connection()
 
 
 def get_connection(login_var, password_var):
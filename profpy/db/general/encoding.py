@@ -0,0 +1,134 @@
+"""
+Dictionary encoding for low-cardinality string columns in large result sets.
+
+Oracle hands back a brand new str object for every value in every row, so a column like a term code repeated across
+millions of rows costs millions of separate strings. The ColumnEncoder swaps those values for one shared str object
+per distinct value (interning), or for small integer codes plus a lookup dictionary.
+"""
+import sys
+
+DEFAULT_SAMPLE_SIZE = 1000
+DEFAULT_MAX_CARDINALITY = 0.2
+
+
+class ColumnEncoder(object):
+    """
+    Encodes chosen (or auto-detected) string columns of query results. Pass an instance to execute_query via the
+    column_encoder argument, then use report() to see how much memory was saved.
+    """
+    def __init__(self, columns=None, codes=False, sample_size=DEFAULT_SAMPLE_SIZE,
+                 max_cardinality=DEFAULT_MAX_CARDINALITY):
+        """
+        Constructor
+        :param columns:         Column names to encode. If not specified, low-cardinality string columns are detected
+                                from the first rows of the result                                          (list)
+        :param codes:           Return integer codes instead of shared str objects, see dictionaries/decode (bool)
+        :param sample_size:     How many rows to look at when detecting columns                             (int)
+        :param max_cardinality: Largest distinct/non-null ratio for a column to be auto-detected            (float)
+        """
+        self.columns = [c.lower() for c in columns] if columns else None
+        self.codes = codes
+        self.sample_size = sample_size
+        self.max_cardinality = max_cardinality
+
+        self.__encoded = []             # (index, column name) pairs for the bound result set
+        self.__values = {}              # column -> {value: shared value or code}
+        self.__dictionaries = {}        # column -> [value, ...] (codes only)
+        self.__rows = {}                # column -> number of non-null values seen
+        self.__bytes_before = {}        # column -> bytes the values would have used as separate objects
+
+    @property
+    def encoded_columns(self):
+        """
+        :return: The columns being encoded for the current result set (list)
+        """
+        return [name for _, name in self.__encoded]
+
+    @property
+    def dictionaries(self):
+        """
+        :return: The code to value lookup for each encoded column, only populated when codes=True (dict)
+        """
+        return self.__dictionaries
+
+    def decode(self, column, code):
+        """
+        :param column: The column name  (str)
+        :param code:   An integer code  (int)
+        :return:       The original value for the code
+        """
+        return code if code is None else self.__dictionaries[column][code]
+
+    def bind(self, field_names, sample_rows):
+        """
+        Decides which columns of a result set get encoded. Called by execute_query/results_to_generator with the
+        first rows of the result before any rows are encoded.
+        :param field_names: The column names of the result set          (list)
+        :param sample_rows: The first rows of the result set as tuples (list)
+        """
+        sample = sample_rows[:self.sample_size]
+        if self.columns is not None:
+            wanted = set(self.columns)
+            self.__encoded = [(i, name) for i, name in enumerate(field_names) if name in wanted]
+        else:
+            self.__encoded = []
+            for i, name in enumerate(field_names):
+                values = [row[i] for row in sample if row[i] is not None]
+                if values and all(isinstance(v, str) for v in values) \
+                        and len(set(values)) / len(values) <= self.max_cardinality:
+                    self.__encoded.append((i, name))
+
+        for _, name in self.__encoded:
+            self.__values.setdefault(name, {})
+            self.__rows.setdefault(name, 0)
+            self.__bytes_before.setdefault(name, 0)
+            if self.codes:
+                self.__dictionaries.setdefault(name, [])
+
+    def encode(self, row):
+        """
+        Encodes a single result row
+        :param row: A row tuple from the cursor (tuple)
+        :return:    The row with encoded values (tuple or list)
+        """
+        if not self.__encoded:
+            return row
+        out = list(row)
+        for i, name in self.__encoded:
+            value = out[i]
+            if value is None:
+                continue
+            lookup = self.__values[name]
+            encoded = lookup.get(value)
+            if encoded is None:
+                if self.codes:
+                    dictionary = self.__dictionaries[name]
+                    encoded = len(dictionary)
+                    dictionary.append(value)
+                else:
+                    encoded = value
+                lookup[value] = encoded
+            self.__rows[name] += 1
+            self.__bytes_before[name] += sys.getsizeof(value)
+            out[i] = encoded
+        return out
+
+    def report(self):
+        """
+        Estimates the memory saved by encoding, per column and in total
+        :return: dict(columns=<column name -> stats dict>, total=<stats dict>), where each stats dict has rows,
+                 distinct, bytes_before, bytes_after and bytes_saved
+        """
+        columns = {}
+        total = dict(rows=0, distinct=0, bytes_before=0, bytes_after=0, bytes_saved=0)
+        for name, lookup in self.__values.items():
+            after = sum(sys.getsizeof(v) for v in lookup)
+            if self.codes:
+                after += sum(sys.getsizeof(c) for c in lookup.values())
+            before = self.__bytes_before[name]
+            column = dict(rows=self.__rows[name], distinct=len(lookup), bytes_before=before, bytes_after=after,
+                          bytes_saved=max(before - after, 0))
+            for k, v in column.items():
+                total[k] += v
+            columns[name] = column
+        return dict(columns=columns, total=total)
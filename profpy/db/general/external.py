@@ -0,0 +1,263 @@
+"""
+External-memory sort and group-by for streamed query results.
+
+These functions consume any iterable of rows (typically the generator from execute_query(..., use_generator=True))
+and keep at most roughly memory_budget bytes of rows in memory. Anything beyond that is spilled to compressed
+temporary files and streamed back out, so results far larger than RAM can be sorted or grouped by keys that have to
+be computed in python.
+"""
+import os
+import sys
+import gzip
+import heapq
+import pickle
+import tempfile
+from operator import itemgetter
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_FAN_IN = 16
+DEFAULT_PARTITIONS = 32
+
+# rows are pickled in chunks of this size, which is much faster than pickling rows one at a time
+_CHUNK_SIZE = 1000
+
+# re-estimate the average row size every this many rows
+_SAMPLE_EVERY = 100
+
+# partitions that are still too large get re-partitioned at most this many times before being grouped in memory
+_MAX_DEPTH = 3
+
+
+def _estimate_size(item):
+    """
+    Rough in-memory size of a row, counting the container and its values (dict keys are assumed shared)
+    :param item: A row (dict, tuple, list or scalar)
+    :return:     Size in bytes (int)
+    """
+    size = sys.getsizeof(item)
+    values = item.values() if isinstance(item, dict) else item if isinstance(item, (tuple, list)) else ()
+    for value in values:
+        size += sys.getsizeof(value)
+    return size
+
+
+class _Buffer(object):
+    """
+    An in-memory list of items that knows (approximately) when it has gone over its memory budget
+    """
+    def __init__(self, memory_budget):
+        self.items = []
+        self.__budget = memory_budget
+        self.__row_size = None
+
+    def append(self, item, row):
+        self.items.append(item)
+        if self.__row_size is None or len(self.items) % _SAMPLE_EVERY == 0:
+            # account for the (key, row) tuple and the key itself as well as the row
+            self.__row_size = _estimate_size(row) + sys.getsizeof(item) + sys.getsizeof(item[0])
+
+    def full(self):
+        return self.__row_size is not None and len(self.items) * self.__row_size >= self.__budget
+
+    def clear(self):
+        self.items = []
+
+
+class _SpillFile(object):
+    """
+    A compressed temporary file of pickled items
+    """
+    def __init__(self, directory, compress_level):
+        handle, self.path = tempfile.mkstemp(suffix=".run.gz", dir=directory)
+        os.close(handle)
+        self.__compress_level = compress_level
+        self.__file = None
+
+    def write(self, items):
+        if self.__file is None:
+            self.__file = gzip.open(self.path, "wb", compresslevel=self.__compress_level)
+        for start in range(0, len(items), _CHUNK_SIZE):
+            pickle.dump(items[start:start + _CHUNK_SIZE], self.__file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __iter__(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rb") as in_file:
+            while True:
+                try:
+                    chunk = pickle.load(in_file)
+                except EOFError:
+                    break
+                for item in chunk:
+                    yield item
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _merge_runs(runs, reverse):
+    return heapq.merge(*runs, key=itemgetter(0), reverse=reverse)
+
+
+def external_sort(rows, key, reverse=False, memory_budget=DEFAULT_MEMORY_BUDGET, fan_in=DEFAULT_FAN_IN,
+                  temp_dir=None, compress_level=1):
+    """
+    Sorts an iterable of rows by a python-computed key without holding more than memory_budget bytes of rows in
+    memory. Sorted runs are spilled to compressed temp files and merged back, fan_in runs at a time. The sort is stable.
+    :param rows:           The rows to sort, e.g. a results generator         (iterable)
+    :param key:            Function computing the sort key of a row           (callable)
+    :param reverse:        Sort descending                                    (bool)
+    :param memory_budget:  Approximate bytes of rows to hold in memory        (int)
+    :param fan_in:         Maximum number of runs to merge at once            (int)
+    :param temp_dir:       Directory for spill files, defaults to the system temp directory (str)
+    :param compress_level: gzip compression level for spill files (1-9)       (int)
+    :return:               The sorted rows                                    (generator)
+    """
+    if fan_in < 2:
+        raise ValueError("fan_in must be at least 2.")
+
+    with tempfile.TemporaryDirectory(prefix="profpy-sort-", dir=temp_dir) as directory:
+        runs = []
+        buffer = _Buffer(memory_budget)
+        try:
+            for row in rows:
+                buffer.append((key(row), row), row)
+                if buffer.full():
+                    buffer.items.sort(key=itemgetter(0), reverse=reverse)
+                    run = _SpillFile(directory, compress_level)
+                    run.write(buffer.items)
+                    run.close()
+                    runs.append(run)
+                    buffer.clear()
+
+            buffer.items.sort(key=itemgetter(0), reverse=reverse)
+
+            # everything fit in memory, no need to touch the disk
+            if not runs:
+                for _, row in buffer.items:
+                    yield row
+                return
+
+            # merge runs down until a single pass can merge whatever is left along with the in-memory buffer
+            while len(runs) + 1 > fan_in:
+                merged = []
+                for start in range(0, len(runs), fan_in):
+                    group = runs[start:start + fan_in]
+                    if len(group) == 1:
+                        merged.extend(group)
+                        continue
+                    run = _SpillFile(directory, compress_level)
+                    for chunk in _chunked(_merge_runs(group, reverse)):
+                        run.write(chunk)
+                    run.close()
+                    for old in group:
+                        old.remove()
+                    merged.append(run)
+                runs = merged
+
+            for _, row in _merge_runs(runs + [buffer.items], reverse):
+                yield row
+        finally:
+            for run in runs:
+                run.remove()
+
+
+def external_group_by(rows, key, memory_budget=DEFAULT_MEMORY_BUDGET, partitions=DEFAULT_PARTITIONS,
+                      temp_dir=None, compress_level=1):
+    """
+    Groups an iterable of rows by a python-computed key without holding more than memory_budget bytes of rows in
+    memory. If the rows fit, groups come back in order of first appearance. Otherwise the rows are hash-partitioned
+    into compressed temp files and each partition is grouped on its own, so group order is arbitrary.
+    :param rows:           The rows to group, e.g. a results generator        (iterable)
+    :param key:            Function computing the (hashable) group key of a row (callable)
+    :param memory_budget:  Approximate bytes of rows to hold in memory        (int)
+    :param partitions:     Number of spill partitions                         (int)
+    :param temp_dir:       Directory for spill files, defaults to the system temp directory (str)
+    :param compress_level: gzip compression level for spill files (1-9)       (int)
+    :return:               (key, list of rows) pairs                          (generator)
+    """
+    if partitions < 2:
+        raise ValueError("partitions must be at least 2.")
+
+    with tempfile.TemporaryDirectory(prefix="profpy-group-", dir=temp_dir) as directory:
+        items = ((key(row), row) for row in rows)
+        for group in _hash_group(items, memory_budget, partitions, directory, compress_level, 0):
+            yield group
+
+
+def _hash_group(items, memory_budget, partitions, directory, compress_level, depth):
+    """
+    Recursive worker for external_group_by
+    :param items: (key, row) pairs (iterable)
+    :param depth: How many times these items have already been partitioned
+    :return:      (key, list of rows) pairs (generator)
+    """
+    groups = {}
+    buffer = _Buffer(memory_budget)
+    spills = None
+    try:
+        for item in items:
+            buffer.append(item, item[1])
+            if buffer.full() and depth < _MAX_DEPTH:
+                if spills is None:
+                    spills = [_SpillFile(directory, compress_level) for _ in range(partitions)]
+                _spill_partitions(buffer.items, spills, partitions, depth)
+                buffer.clear()
+
+        # nothing was spilled, group in memory
+        if spills is None:
+            for k, row in buffer.items:
+                groups.setdefault(k, []).append(row)
+            buffer.clear()
+            for k, group_rows in groups.items():
+                yield k, group_rows
+            return
+
+        _spill_partitions(buffer.items, spills, partitions, depth)
+        buffer.clear()
+        for spill in spills:
+            spill.close()
+            for group in _hash_group(iter(spill), memory_budget, partitions, directory, compress_level, depth + 1):
+                yield group
+            spill.remove()
+    finally:
+        if spills:
+            for spill in spills:
+                spill.remove()
+
+
+def _spill_partitions(items, spills, partitions, depth):
+    """
+    Writes (key, row) pairs out to hash partitions. The depth is mixed into the hash so that a partition that has to
+    be split again doesn't land entirely in one sub-partition.
+    """
+    by_partition = [[] for _ in range(partitions)]
+    for item in items:
+        by_partition[hash((depth, item[0])) % partitions].append(item)
+    for spill, partition_items in zip(spills, by_partition):
+        if partition_items:
+            spill.write(partition_items)
+
+
+def _chunked(items):
+    """
+    Groups an iterable into lists of _CHUNK_SIZE
+    :param items: The iterable
+    :return:      lists of items (generator)
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == _CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
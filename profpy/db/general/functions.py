@@ -1,6 +1,8 @@
 import os
 import oracledb as cx_Oracle
 import re
+from .profiling import memory_profiler
+from .encoding import ColumnEncoder
 
 DEFAULT_ARRAY_SIZE = 1000
 
@@ -26,6 +28,7 @@ def execute_query(
     null_to_empty_string=False,
     prefix=None,
     use_generator=False,
+    column_encoder=None,
 ):
     """
      Executes a sql query, and outputs the results as a list of dictionaries, rather than a list of lists. This allows
@@ -50,26 +53,43 @@ def execute_query(
      :param use_generator:        whether or not to return data as
                                   a generator rather than a list    (bool)             -- optional
 
+     :param column_encoder:       share/encode repeated string
+                                  values. Keep the instance to      (ColumnEncoder)    -- optional
+                                  read its report() or decode codes
+
      :return:                     a list of dictionaries for the results of the sql query
      """
 
+    _check_column_encoder(column_encoder)
+
+    # only measure when profiling has been turned on with enable_memory_profiling
+    probe = memory_profiler.start(sql) if memory_profiler.enabled else None
+
     cursor.execute(sql, params if params else {})
     columns = [d[0].lower() for d in cursor.description]
     if prefix:
         columns = [c[c.startswith(prefix) and len(prefix) :] for c in columns]
 
     if use_generator:
-        output = results_to_generator(cursor, columns, null_to_empty_string, limit)
+        output = results_to_generator(cursor, columns, null_to_empty_string, limit, column_encoder=column_encoder)
+        if probe:
+            output = probe.track_generator(output)
     else:
-        data = cursor.fetchmany(limit) if limit else cursor.fetchall()
-
-        if not data:
-            output = []
-        else:
-            output = [
-                row_to_dict(columns, data_row, null_to_empty_string)
-                for data_row in data
-            ]
+        # fetch a chunk at a time and convert (and encode) it before fetching the next, so the raw rows are never all
+        # held alongside the output
+        array_size = getattr(cursor, "arraysize", None) or DEFAULT_ARRAY_SIZE
+        output = []
+        while not limit or len(output) < limit:
+            data = cursor.fetchmany(min(array_size, limit - len(output)) if limit else array_size)
+            if not data:
+                break
+            if column_encoder:
+                if not output:
+                    column_encoder.bind(columns, data)
+                data = [column_encoder.encode(data_row) for data_row in data]
+            output.extend(row_to_dict(columns, data_row, null_to_empty_string) for data_row in data)
+        if probe:
+            probe.finish(len(output))
 
     return output
 
@@ -80,6 +100,7 @@ def results_to_generator(
     null_to_empty_string=False,
     limit=None,
     array_size=DEFAULT_ARRAY_SIZE,
+    column_encoder=None,
 ):
     """
     Returns a generator as the result of a sql query. Each item yielded is a dictionary, with keys being the column
@@ -90,9 +111,13 @@ def results_to_generator(
     :param null_to_empty_string: Whether or not to convert nulls to empty strings (bool)
     :param limit:                A cap on the results returned                    (int)
     :param array_size:           An array size for the cursor fetch               (int)
+    :param column_encoder:       Encoder for repeated string values               (ColumnEncoder)
     :return:                     A result set from the sql query                  (generator)
     """
 
+    _check_column_encoder(column_encoder)
+    bound = False
+
     try:
         if limit:
             found_records = 0
@@ -101,6 +126,11 @@ def results_to_generator(
                 if not results:
                     break
                 else:
+                    if column_encoder:
+                        if not bound:
+                            column_encoder.bind(field_names, results)
+                            bound = True
+                        results = [column_encoder.encode(result) for result in results]
                     for result in results:
                         if found_records < limit:
                             yield row_to_dict(field_names, result, null_to_empty_string)
@@ -113,6 +143,11 @@ def results_to_generator(
                 if not results:
                     break
                 else:
+                    if column_encoder:
+                        if not bound:
+                            column_encoder.bind(field_names, results)
+                            bound = True
+                        results = [column_encoder.encode(result) for result in results]
                     for result in results:
                         yield row_to_dict(field_names, result, null_to_empty_string)
 
@@ -125,6 +160,15 @@ def results_to_generator(
         raise ge
 
 
+def _check_column_encoder(column_encoder):
+    """
+    Raises a ValueError unless column_encoder is None or a ColumnEncoder
+    """
+    if column_encoder is not None and not isinstance(column_encoder, ColumnEncoder):
+        raise ValueError("column_encoder must be a ColumnEncoder, e.g. column_encoder=ColumnEncoder(). Keep the "
+                         "instance to read its report() or decode its codes.")
+
+
 def row_to_dict(field_names, data, null_to_empty_string=False):
     """
     Converts a tuple result of a cx_Oracle cursor execution to a dict, with the keys being the column names
@@ -0,0 +1,118 @@
+"""
+Streaming hash joins between any two iterables of records, e.g. a query generator from execute_query and a list of
+records from one of the profpy.apis clients.
+"""
+import operator
+
+JOIN_INNER = "inner"
+JOIN_LEFT = "left"
+JOIN_ANTI = "anti"
+
+BUILD_AUTO = "auto"
+BUILD_LEFT = "left"
+BUILD_RIGHT = "right"
+
+_join_types = (JOIN_INNER, JOIN_LEFT, JOIN_ANTI)
+_build_sides = (BUILD_AUTO, BUILD_LEFT, BUILD_RIGHT)
+
+
+def _pair(left_row, right_row):
+    return left_row, right_row
+
+
+def _choose_build_side(left, right):
+    """
+    Picks the side to hash. Sides with a known length are already in memory, so the smaller known side is hashed.
+    When neither length is known the right side is hashed and the left side is streamed.
+    :return: "left" or "right"
+    """
+    left_size = operator.length_hint(left, -1)
+    right_size = operator.length_hint(right, -1)
+    if left_size >= 0 and (right_size < 0 or left_size < right_size):
+        return BUILD_LEFT
+    return BUILD_RIGHT
+
+
+def hash_join(left, right, left_key, right_key=None, how=JOIN_INNER, build=BUILD_AUTO, merge=None):
+    """
+    Joins two iterables of records on key functions in O(n + m) time, streaming the results. Records whose key is
+    None never match anything, like nulls in sql.
+
+    For inner and left joins each result is merge(left_row, right_row), where right_row is None for unmatched left
+    rows in a left join. Anti joins yield the left rows that have no match on the right.
+
+    :param left:      The left records, e.g. a query generator         (iterable)
+    :param right:     The right records, e.g. records from an api      (iterable)
+    :param left_key:  Function computing the join key of a left record  (callable)
+    :param right_key: Function computing the join key of a right record, defaults to left_key (callable)
+    :param how:       "inner", "left" or "anti"                         (str)
+    :param build:     Which side to hold in memory: "auto", "left" or "right" (str)
+    :param merge:     Function combining a left and right record, defaults to a (left, right) tuple (callable)
+    :return:          The joined records                                (generator)
+    """
+    if how not in _join_types:
+        raise ValueError(f"Invalid join type: {how}. Must be one of: {', '.join(_join_types)}")
+    if build not in _build_sides:
+        raise ValueError(f"Invalid build side: {build}. Must be one of: {', '.join(_build_sides)}")
+
+    right_key = right_key or left_key
+    merge = merge or _pair
+    if build == BUILD_AUTO:
+        build = _choose_build_side(left, right)
+
+    if build == BUILD_RIGHT:
+        return _probe_with_left(left, right, left_key, right_key, how, merge)
+    return _probe_with_right(left, right, left_key, right_key, how, merge)
+
+
+def _probe_with_left(left, right, left_key, right_key, how, merge):
+    """
+    Hashes the right side and streams the left side through it. Output follows the order of the left side.
+    """
+    table = {}
+    for right_row in right:
+        key = right_key(right_row)
+        if key is not None:
+            table.setdefault(key, []).append(right_row)
+
+    for left_row in left:
+        key = left_key(left_row)
+        matches = table.get(key) if key is not None else None
+        if how == JOIN_ANTI:
+            if not matches:
+                yield left_row
+        elif matches:
+            for right_row in matches:
+                yield merge(left_row, right_row)
+        elif how == JOIN_LEFT:
+            yield merge(left_row, None)
+
+
+def _probe_with_right(left, right, left_key, right_key, how, merge):
+    """
+    Hashes the left side and streams the right side through it. Matches follow the order of the right side, and any
+    unmatched left rows (left/anti joins) follow in their original order once the right side is exhausted.
+    """
+    table = {}
+    left_rows = []
+    for left_row in left:
+        key = left_key(left_row)
+        left_rows.append((key, left_row))
+        if key is not None:
+            table.setdefault(key, []).append(left_row)
+
+    matched = set()
+    for right_row in right:
+        key = right_key(right_row)
+        if key is None or key not in table:
+            continue
+        matched.add(key)
+        if how != JOIN_ANTI:
+            for left_row in table[key]:
+                yield merge(left_row, right_row)
+
+    if how == JOIN_INNER:
+        return
+    for key, left_row in left_rows:
+        if key is None or key not in matched:
+            yield left_row if how == JOIN_ANTI else merge(left_row, None)
@@ -0,0 +1,291 @@
+"""
+Local SQLite read-through mirror of small, hot reference tables.
+
+A ReferenceMirror copies named tables from a source engine into SQLite (in-memory by default), keeps them fresh on a
+schedule using a modified-timestamp column, and serves reads locally. Writes still go to the source database.
+"""
+import os
+import re
+import time
+import decimal
+import logging
+import sqlite3
+import threading
+from datetime import datetime, date
+from sqlalchemy import text
+
+DEFAULT_REFRESH_INTERVAL = 300
+
+_name_regex = re.compile(r"^[A-Za-z_][\w$#]*(\.[A-Za-z_][\w$#]*)?$")
+_logger = logging.getLogger("profpy.db.mirror")
+
+
+class MirrorTable(object):
+    """
+    Configuration for a single mirrored table
+    """
+    def __init__(self, name, key_columns=None, modified_column=None, alias=None):
+        """
+        Constructor
+        :param name:            The (optionally schema-qualified) source table/view name            (str)
+        :param key_columns:     The columns that uniquely identify a row, required for incremental refreshes (list)
+        :param modified_column: A column holding each row's last-modified timestamp. Without it, every refresh
+                                reloads the whole table                                              (str)
+        :param alias:           The local table name, defaults to the unqualified source name       (str)
+        """
+        if not re.match(_name_regex, name):
+            raise ValueError(f"Invalid table name: {name}")
+        self.name = name
+        self.key_columns = [c.lower() for c in key_columns] if key_columns else []
+        self.modified_column = modified_column.lower() if modified_column else None
+        self.alias = (alias or name.split(".")[-1]).lower()
+        if self.modified_column and not self.key_columns:
+            raise ValueError(f"key_columns are required to incrementally refresh {name}")
+
+    @property
+    def incremental(self):
+        return self.modified_column is not None
+
+
+def _to_sqlite(value):
+    """
+    Converts a python value to something sqlite can store. Converted types are restored by _from_sqlite.
+    """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _from_sqlite(python_type):
+    """
+    :param python_type: The type of a column's values in the source database
+    :return:            A function restoring that type from its sqlite representation, None if none is needed
+    """
+    if python_type is datetime:
+        return datetime.fromisoformat
+    if python_type is date:
+        return date.fromisoformat
+    if python_type is decimal.Decimal:
+        return decimal.Decimal
+    return None
+
+
+class ReferenceMirror(object):
+    """
+    Mirrors reference tables into a local SQLite database and serves queries against it
+    """
+    def __init__(self, engine, tables, path=":memory:", refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 max_staleness=None, full_refresh_interval=None, background=True):
+        """
+        Constructor
+        :param engine:                The source sqlalchemy engine
+        :param tables:                Table names or MirrorTable objects                                      (list)
+        :param path:                  The local sqlite file, or ":memory:"                                    (str)
+        :param refresh_interval:      Seconds between refreshes of each table                                 (float)
+        :param max_staleness:         Reads never see data older than this many seconds; stale tables are refreshed
+                                      before the read                                                         (float)
+        :param full_refresh_interval: Seconds between full reloads of incrementally refreshed tables, which picks up
+                                      deleted rows                                                            (float)
+        :param background:            Refresh on a background thread rather than only on stale reads          (bool)
+        """
+        self.engine = engine
+        self.tables = {}
+        for t in tables:
+            table = t if isinstance(t, MirrorTable) else MirrorTable(t)
+            self.tables[table.alias] = table
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.full_refresh_interval = full_refresh_interval
+        self.background = background
+
+        self.__lock = threading.RLock()
+        # one refresh of a table at a time, so an older read of the source can't be applied over a newer one
+        self.__refresh_locks = {alias: threading.Lock() for alias in self.tables}
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__converters = {}          # alias -> {column: converter}
+        self.__columns = {}             # alias -> [column, ...]
+        self.__high_water = {}          # alias -> max modified_column value loaded
+        self.__refreshed_at = {}        # alias -> monotonic time of the last refresh
+        self.__full_at = {}             # alias -> monotonic time of the last full reload
+        self.__thread = None
+        self.__thread_pid = None
+        self.__stop = threading.Event()
+
+    def start(self):
+        """
+        Loads every table and starts the background refresher (if enabled). Called automatically on first use.
+        """
+        for alias in self.tables:
+            self.__refresh_table(self.tables[alias], True, only_if_missing=True)
+        # threads don't survive a fork, so start one per process (e.g. per gunicorn worker)
+        if self.background and (self.__thread is None or self.__thread_pid != os.getpid()):
+            self.__stop.clear()
+            self.__thread_pid = os.getpid()
+            self.__thread = threading.Thread(target=self.__refresh_loop, name="profpy-mirror", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the background refresher
+        """
+        self.__stop.set()
+
+    def __refresh_loop(self):
+        while not self.__stop.wait(min(self.refresh_interval, 5)):
+            for alias in self.tables:
+                if self.staleness(alias) >= self.refresh_interval:
+                    try:
+                        self.refresh(alias)
+                    except Exception:
+                        _logger.exception(f"Failed to refresh mirrored table {alias}")
+
+    def staleness(self, alias):
+        """
+        :param alias: The local table name
+        :return:      Seconds since the table was last refreshed (inf if it never was)
+        """
+        refreshed = self.__refreshed_at.get(alias)
+        return float("inf") if refreshed is None else time.monotonic() - refreshed
+
+    def refresh(self, alias=None, full=False):
+        """
+        Refreshes one or all tables from the source database
+        :param alias: The local table name, all tables if not specified
+        :param full:  Reload the whole table even if it can be refreshed incrementally
+        """
+        for name in [alias] if alias else list(self.tables):
+            self.__refresh_table(self.tables[name], full)
+
+    def __refresh_table(self, table, full, only_if_missing=False):
+        with self.__refresh_locks[table.alias]:
+            if only_if_missing and table.alias in self.__refreshed_at:
+                return
+            self.__load(table, full)
+
+    def __load(self, table, full):
+        now = time.monotonic()
+        if not table.incremental or table.alias not in self.__high_water:
+            full = True
+        elif self.full_refresh_interval and now - self.__full_at.get(table.alias, 0) >= self.full_refresh_interval:
+            full = True
+
+        # read from the source outside of the lock so local reads aren't blocked by the network. the table's refresh
+        # lock is held from here until the rows are applied
+        sql = f"select * from {table.name}"
+        params = {}
+        if not full:
+            sql += f" where {table.modified_column} >= :since"
+            params["since"] = self.__high_water[table.alias]
+        with self.engine.connect() as connection:
+            result = connection.execute(text(sql), params)
+            columns = [c.lower() for c in result.keys()]
+            rows = [tuple(r) for r in result]
+
+        with self.__lock:
+            if full or table.alias not in self.__columns:
+                self.__create_table(table, columns, rows)
+            converters = self.__converters[table.alias]
+            for i, column in enumerate(columns):
+                if column not in converters:
+                    sample = next((r[i] for r in rows if r[i] is not None), None)
+                    if sample is not None:
+                        converters[column] = _from_sqlite(type(sample))
+
+            placeholders = ", ".join("?" for _ in columns)
+            verb = "insert or replace" if table.key_columns else "insert"
+            quoted = ", ".join(f'"{c}"' for c in columns)
+            with self.__connection:
+                if full:
+                    self.__connection.execute(f'delete from "{table.alias}"')
+                self.__connection.executemany(
+                    f'{verb} into "{table.alias}" ({quoted}) values ({placeholders})',
+                    [tuple(_to_sqlite(v) for v in r) for r in rows]
+                )
+
+            if table.incremental and rows:
+                index = columns.index(table.modified_column)
+                loaded = [r[index] for r in rows if r[index] is not None]
+                if loaded:
+                    newest = max(loaded)
+                    current = self.__high_water.get(table.alias)
+                    self.__high_water[table.alias] = newest if current is None or full else max(current, newest)
+            self.__refreshed_at[table.alias] = now
+            if full:
+                self.__full_at[table.alias] = now
+        _logger.debug(f"Refreshed mirrored table {table.alias} ({'full' if full else 'incremental'}, {len(rows)} rows)")
+
+    def __create_table(self, table, columns, rows):
+        quoted = ", ".join(f'"{c}"' for c in columns)
+        with self.__connection:
+            self.__connection.execute(f'drop table if exists "{table.alias}"')
+            self.__connection.execute(f'create table "{table.alias}" ({quoted})')
+            if table.key_columns:
+                keys = ", ".join(f'"{c}"' for c in table.key_columns)
+                self.__connection.execute(f'create unique index "{table.alias}_pk" on "{table.alias}" ({keys})')
+        self.__columns[table.alias] = columns
+        self.__converters[table.alias] = {}
+
+    def __ensure_fresh(self, aliases):
+        if not self.__refreshed_at or (self.background and self.__thread_pid != os.getpid()):
+            self.start()
+        if self.max_staleness is not None:
+            for alias in aliases:
+                if self.staleness(alias) > self.max_staleness:
+                    self.refresh(alias)
+
+    def query(self, sql, params=None, tables=None):
+        """
+        Runs a query against the local mirror. Use the local (alias) table names in the sql.
+        :param sql:    A sqlite query                                                                (str)
+        :param params: Parameters for the query, either a sequence or a dict for :named binds         (tuple/dict)
+        :param tables: The local tables the query reads, used for the staleness check (all if not given) (list)
+        :return:       The results as a list of dictionaries
+        """
+        self.__ensure_fresh(tables or list(self.tables))
+        converters = {}
+        for alias in tables or self.tables:
+            converters.update(self.__converters.get(alias, {}))
+        with self.__lock:
+            cursor = self.__connection.execute(sql, params if params else ())
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        convert = [(i, converters[c]) for i, c in enumerate(columns) if converters.get(c)]
+        out = []
+        for row in rows:
+            if convert:
+                row = list(row)
+                for i, converter in convert:
+                    if row[i] is not None:
+                        row[i] = converter(row[i])
+            out.append(dict(zip(columns, row)))
+        return out
+
+    def get(self, alias, **equals):
+        """
+        Convenience lookup of rows by column values, e.g. mirror.get("stvterm", stvterm_code="202440")
+        :param alias:  The local table name
+        :param equals: column=value filters
+        :return:       Matching rows as a list of dictionaries
+        """
+        if alias not in self.tables:
+            raise KeyError(f"Table {alias} is not mirrored.")
+        sql = f'select * from "{alias}"'
+        if equals:
+            sql += " where " + " and ".join(f'"{column.lower()}" = ?' for column in equals)
+        return self.query(sql, tuple(_to_sqlite(v) for v in equals.values()), tables=[alias])
+
+    def write(self, sql, params=None, tables=None):
+        """
+        Runs a statement against the source database (writes never go to the mirror), then refreshes the mirrored
+        tables it touched
+        :param sql:    The dml statement                              (str)
+        :param params: Parameters for the statement                   (dict)
+        :param tables: Local names of the tables to refresh afterwards, all if not given (list)
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text(sql), params if params else {})
+        for alias in tables if tables else self.tables:
+            self.refresh(alias)
@@ -0,0 +1,310 @@
+"""
+Optional memory profiling for profpy.db queries.
+
+When enabled, every call to execute_query is measured with tracemalloc (or the process RSS) and the results are
+attributed to a normalized fingerprint of the sql so that repeated calls with different literals roll up together.
+Both are process-wide, so a call that overlaps another call being measured (e.g. in another thread) is counted but
+not measured.
+"""
+import os
+import re
+import hashlib
+import threading
+import tracemalloc
+import warnings
+
+# patterns used to normalize sql into a fingerprint
+_string_literal_regex = re.compile(r"'(?:[^']|'')*'")
+_number_literal_regex = re.compile(r"\b\d+(?:\.\d+)?\b")
+_in_list_regex = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_whitespace_regex = re.compile(r"\s+")
+
+MODE_TRACEMALLOC = "tracemalloc"
+MODE_RSS = "rss"
+
+# what a measurement is: the highest traced memory during the call, or the growth between its start and end
+MEASUREMENT_PEAK = "peak"
+MEASUREMENT_GROWTH = "growth"
+
+# tracemalloc.reset_peak was added in python 3.9
+_can_reset_peak = hasattr(tracemalloc, "reset_peak")
+
+
+class MemoryBudgetWarning(ResourceWarning):
+    """
+    Raised (as a warning) when a materialized query result goes over the configured memory budget
+    """
+    pass
+
+
+def normalize_sql(sql):
+    """
+    Strips literals and extra whitespace out of a sql statement so that calls differing only by literal values
+    normalize to the same string. Bind variables are left as is.
+    :param sql: The sql statement (str)
+    :return:    The normalized sql (str)
+    """
+    normalized = _string_literal_regex.sub("?", sql)
+    normalized = _number_literal_regex.sub("?", normalized)
+    normalized = _whitespace_regex.sub(" ", normalized).strip().lower()
+    return _in_list_regex.sub("(?)", normalized)
+
+
+def sql_fingerprint(sql):
+    """
+    Returns a short, stable identifier for a sql statement, see normalize_sql
+    :param sql: The sql statement (str)
+    :return:    A 16-character hex digest (str)
+    """
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()[:16]
+
+
+def _current_rss():
+    """
+    :return: The resident set size of this process in bytes, or None if it can't be determined
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            # ru_maxrss is the high-water mark (kb on linux), the best we can do without /proc
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return None
+
+
+class QueryMemoryStats(object):
+    """
+    Running memory totals for all executions of a single sql fingerprint
+    """
+    def __init__(self, fingerprint, sql):
+        self.fingerprint = fingerprint
+        self.sql = normalize_sql(sql)[:500]
+        self.calls = 0
+        self.rows = 0
+        self.overlapped = 0
+        self.measured_rows = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.max_bytes_per_row = 0.0
+
+    @property
+    def bytes_per_row(self):
+        """
+        :return: Average bytes per row across all measured calls
+        """
+        return self.total_bytes / self.measured_rows if self.measured_rows else 0.0
+
+    def add(self, used_bytes, rows):
+        """
+        :param used_bytes: The memory the call used, None if it overlapped another measured call
+        :param rows:       The number of rows the call returned
+        """
+        self.calls += 1
+        self.rows += rows
+        if used_bytes is None:
+            self.overlapped += 1
+            return
+        self.measured_rows += rows
+        self.total_bytes += used_bytes
+        self.max_bytes = max(self.max_bytes, used_bytes)
+        if rows:
+            self.max_bytes_per_row = max(self.max_bytes_per_row, used_bytes / rows)
+
+    def as_dict(self):
+        return dict(fingerprint=self.fingerprint, sql=self.sql, calls=self.calls, rows=self.rows,
+                    overlapped=self.overlapped, max_bytes=self.max_bytes,
+                    bytes_per_row=round(self.bytes_per_row, 1), max_bytes_per_row=round(self.max_bytes_per_row, 1))
+
+
+class _QueryProbe(object):
+    """
+    Measures a single execute_query call. Created by MemoryProfiler.start
+    """
+    def __init__(self, profiler, sql, baseline, overlapped):
+        self.__profiler = profiler
+        self.__finished = False
+        self.sql = sql
+        self.baseline = baseline
+        # set when another probe was running at any point, since their measurements can't be told apart
+        self.overlapped = overlapped
+
+    def finish(self, rows, materialized=True):
+        """
+        Records the memory used since the probe was started
+        :param rows:         The number of rows returned
+        :param materialized: Whether or not the rows were held in memory all at once (list rather than generator)
+        """
+        if self.__finished:
+            return
+        self.__finished = True
+        self.__profiler.finish(self, rows, materialized)
+
+    def track_generator(self, generator):
+        """
+        Wraps a results generator so that the probe finishes once the generator is exhausted or closed
+        :param generator: The results generator
+        :return:          A generator yielding the same rows
+        """
+        rows = 0
+        try:
+            for row in generator:
+                rows += 1
+                yield row
+        finally:
+            self.finish(rows, materialized=False)
+
+
+class MemoryProfiler(object):
+    """
+    Process-wide memory accounting for execute_query. Use enable_memory_profiling rather than creating one of these.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.mode = MODE_TRACEMALLOC
+        self.budget_bytes = None
+        self.__stats = {}
+        self.__lock = threading.Lock()
+        self.__active = set()
+        self.__started_tracemalloc = False
+        self.__warned_no_reset_peak = False
+
+    def enable(self, mode=MODE_TRACEMALLOC, budget_bytes=None):
+        if mode not in (MODE_TRACEMALLOC, MODE_RSS):
+            raise ValueError(f"Invalid memory profiling mode: {mode}")
+        self.mode = mode
+        self.budget_bytes = budget_bytes
+        if mode == MODE_TRACEMALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracemalloc = True
+        if mode == MODE_TRACEMALLOC and not _can_reset_peak and not self.__warned_no_reset_peak:
+            self.__warned_no_reset_peak = True
+            warnings.warn(
+                "tracemalloc.reset_peak is unavailable before python 3.9, so query memory is measured as the growth in "
+                "current traced memory rather than its peak, and memory freed before a query finishes isn't counted. "
+                "Use python 3.9+ for peak measurements.",
+                RuntimeWarning,
+                stacklevel=3
+            )
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+
+    @property
+    def measurement(self):
+        """
+        :return: "peak" when each call's highest traced memory is measured (tracemalloc on python 3.9+), otherwise
+                 "growth", the difference between the memory in use at the start and end of the call
+        """
+        return MEASUREMENT_PEAK if self.mode == MODE_TRACEMALLOC and _can_reset_peak else MEASUREMENT_GROWTH
+
+    def measure(self, reset_peak=False):
+        """
+        :param reset_peak: Reset the tracemalloc peak before measuring, so the next measurement is a fresh peak
+        :return:           Current memory usage in bytes (tracemalloc peak or process RSS). Without
+                           tracemalloc.reset_peak the peak can't be reset, so current traced memory is used instead
+        """
+        if self.mode == MODE_TRACEMALLOC:
+            if not tracemalloc.is_tracing():
+                return 0
+            if not _can_reset_peak:
+                return tracemalloc.get_traced_memory()[0]
+            if reset_peak:
+                tracemalloc.reset_peak()
+                return tracemalloc.get_traced_memory()[0]
+            return tracemalloc.get_traced_memory()[1]
+        return _current_rss() or 0
+
+    def start(self, sql):
+        """
+        Starts measuring a call. The tracemalloc peak is process-wide, so it is only reset when no other call is being
+        measured, and calls that overlap are marked as such rather than given each other's memory
+        :param sql: The sql being executed
+        :return:    a probe, finish it when the call's results have been consumed
+        """
+        with self.__lock:
+            overlapped = bool(self.__active)
+            for probe in self.__active:
+                probe.overlapped = True
+            probe = _QueryProbe(self, sql, self.measure(reset_peak=not overlapped), overlapped)
+            self.__active.add(probe)
+        return probe
+
+    def finish(self, probe, rows, materialized=True):
+        """
+        Records a probe's measurement, see _QueryProbe.finish
+        """
+        with self.__lock:
+            used = max(self.measure() - probe.baseline, 0)
+            self.__active.discard(probe)
+        self.record(probe.sql, None if probe.overlapped else used, rows, materialized)
+
+    def record(self, sql, used_bytes, rows, materialized=True):
+        fingerprint = sql_fingerprint(sql)
+        with self.__lock:
+            stats = self.__stats.get(fingerprint)
+            if stats is None:
+                stats = self.__stats[fingerprint] = QueryMemoryStats(fingerprint, sql)
+            stats.add(used_bytes, rows)
+
+        if materialized and self.budget_bytes and used_bytes is not None and used_bytes > self.budget_bytes:
+            warnings.warn(
+                f"Query {fingerprint} materialized {rows} rows using {used_bytes} bytes, over the budget of "
+                f"{self.budget_bytes} bytes. Consider execute_query(..., use_generator=True) to stream the results. "
+                f"SQL: {stats.sql[:200]}",
+                MemoryBudgetWarning,
+                stacklevel=4
+            )
+
+    def report(self):
+        """
+        :return: Stats for every profiled fingerprint, largest call first (list of dicts). "measurement" says whether
+                 max_bytes and bytes_per_row are peaks or growth, see MemoryProfiler.measurement
+        """
+        with self.__lock:
+            stats = [dict(s.as_dict(), measurement=self.measurement) for s in self.__stats.values()]
+        return sorted(stats, key=lambda s: s["max_bytes"], reverse=True)
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
+
+
+# the process-wide profiler consulted by execute_query
+memory_profiler = MemoryProfiler()
+
+
+def enable_memory_profiling(budget_bytes=None, mode=MODE_TRACEMALLOC):
+    """
+    Turns on memory profiling for all execute_query calls in this process
+    :param budget_bytes: Warn when a materialized (list) result uses more than this many bytes     (int)
+    :param mode:         "tracemalloc" for python allocations or "rss" for the process resident size (str)
+    """
+    memory_profiler.enable(mode=mode, budget_bytes=budget_bytes)
+
+
+def disable_memory_profiling():
+    """
+    Turns off memory profiling. Collected stats are kept until reset_memory_report is called.
+    """
+    memory_profiler.disable()
+
+
+def get_memory_report():
+    """
+    :return: Memory stats per sql fingerprint, largest call first (list of dicts)
+    """
+    return memory_profiler.report()
+
+
+def reset_memory_report():
+    """
+    Clears any collected memory stats
+    """
+    memory_profiler.reset()
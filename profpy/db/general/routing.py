@@ -0,0 +1,291 @@
+"""
+Read-replica routing.
+
+A ReplicaRouter holds a primary engine plus one or more read-only (e.g. Active Data Guard standby) engines. Work that
+is marked read-only goes to a healthy replica whose apply lag is within bounds; everything else, and any read-only
+work when no replica is usable, goes to the primary.
+"""
+import os
+import re
+import time
+import logging
+import functools
+import itertools
+import threading
+from sqlalchemy import text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+from .connections import OracleConnectionHelper
+
+DEFAULT_LAG_CHECK_INTERVAL = 30
+DEFAULT_RETRY_AFTER = 30
+
+# apply lag on an Active Data Guard standby, reported as an interval string e.g. "+00 00:00:03"
+_oracle_lag_sql = "select value from v$dataguard_stats where name = 'apply lag'"
+_interval_regex = re.compile(r"^\+?(\d+) (\d+):(\d+):(\d+(?:\.\d+)?)$")
+_replica_logins_var = "replica_logins"
+
+_logger = logging.getLogger("profpy.db.routing")
+
+
+def _parse_interval(value):
+    """
+    :param value: An Oracle day to second interval string, e.g. "+00 00:00:03"
+    :return:      The interval in seconds (float), None if it couldn't be parsed
+    """
+    if value is None:
+        return None
+    match = re.match(_interval_regex, str(value).strip())
+    if not match:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return int(days) * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def oracle_apply_lag(connection):
+    """
+    Default lag check for Oracle replicas
+    :param connection: A sqlalchemy connection to the replica
+    :return:           The apply lag in seconds, None if unknown
+    """
+    row = connection.execute(text(_oracle_lag_sql)).first()
+    return _parse_interval(row[0]) if row else None
+
+
+class _ReplicaState(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        self.usable = True
+
+
+class ReplicaRouter(object):
+    """
+    Routes read-only work to replica engines and everything else to the primary
+    """
+    def __init__(self, primary, replicas=None, max_lag_seconds=None, lag_check=None,
+                 lag_check_interval=DEFAULT_LAG_CHECK_INTERVAL, retry_after=DEFAULT_RETRY_AFTER):
+        """
+        Constructor
+        :param primary:            The primary (read/write) sqlalchemy engine
+        :param replicas:           Read-only sqlalchemy engines                                             (list)
+        :param max_lag_seconds:    Don't read from a replica that is further behind than this              (float)
+        :param lag_check:          Function(connection) returning a replica's lag in seconds. Defaults to the Data
+                                   Guard apply lag for Oracle engines                                      (callable)
+        :param lag_check_interval: Seconds to trust a replica's health/lag check before checking again     (float)
+        :param retry_after:        Seconds to stop using a replica after it fails                          (float)
+        """
+        self.primary = primary
+        self.replicas = list(replicas) if replicas else []
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check = lag_check
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self.__states = [_ReplicaState(r) for r in self.replicas]
+        self.__next = itertools.count()
+        self.__lock = threading.Lock()
+
+    def __lag(self, state, connection):
+        check = self.lag_check
+        if check is None and state.engine.dialect.name == "oracle":
+            check = oracle_apply_lag
+        return check(connection) if check else None
+
+    def __check(self, state):
+        """
+        Connects to a replica and checks its lag, if the last check is stale
+        :return: whether or not the replica can be used
+        """
+        now = time.monotonic()
+        if now < state.down_until:
+            return False
+        if now - state.checked_at < self.lag_check_interval:
+            return state.usable
+        try:
+            with state.engine.connect() as connection:
+                lag = self.__lag(state, connection) if self.max_lag_seconds is not None else None
+        except Exception as e:
+            self.mark_down(state.engine, e)
+            return False
+        state.checked_at = now
+        state.usable = lag is None or lag <= self.max_lag_seconds
+        if not state.usable:
+            _logger.warning(f"Replica {state.engine.url.host or state.engine.url} is {lag:.1f}s behind, "
+                            f"reading from the primary.")
+        return state.usable
+
+    def __candidates(self):
+        """
+        :return: usable replica states, starting at the next one in round-robin order
+        """
+        if not self.__states:
+            return []
+        with self.__lock:
+            start = next(self.__next) % len(self.__states)
+        ordered = self.__states[start:] + self.__states[:start]
+        return [s for s in ordered if self.__check(s)]
+
+    def mark_down(self, engine, error=None):
+        """
+        Stops routing to a replica for retry_after seconds
+        :param engine: The replica engine
+        :param error:  The error that caused it, for logging
+        """
+        for state in self.__states:
+            if state.engine is engine:
+                state.down_until = time.monotonic() + self.retry_after
+                state.checked_at = 0.0
+                _logger.warning(f"Replica {engine.url.host or engine.url} unavailable, using the primary: {error}")
+
+    def get_engine(self, read_only=False):
+        """
+        :param read_only: whether or not the work is read-only
+        :return:          a usable replica engine for read-only work, otherwise the primary engine
+        """
+        if read_only:
+            candidates = self.__candidates()
+            if candidates:
+                return candidates[0].engine
+        return self.primary
+
+    def connect(self, read_only=False):
+        """
+        Opens a sqlalchemy connection, failing over from replicas to the primary
+        :param read_only: whether or not the work is read-only
+        :return:          a sqlalchemy connection
+        """
+        return self.__connect(read_only, lambda engine: engine.connect())
+
+    def raw_connection(self, read_only=False):
+        """
+        Opens a DBAPI (cx_Oracle) connection, failing over from replicas to the primary
+        :param read_only: whether or not the work is read-only
+        :return:          a pooled DBAPI connection
+        """
+        return self.__connect(read_only, lambda engine: engine.raw_connection())
+
+    def __connect(self, read_only, opener):
+        if read_only:
+            for state in self.__candidates():
+                try:
+                    return opener(state.engine)
+                except Exception as e:
+                    self.mark_down(state.engine, e)
+        return opener(self.primary)
+
+    def sessionmaker(self, read_only=False, **kwargs):
+        """
+        :param read_only: whether sessions read from replicas, or a function returning that at query time
+        :param kwargs:    any additional sessionmaker arguments
+        :return:          a sessionmaker producing RoutingSessions
+        """
+        return sessionmaker(class_=RoutingSession, router=self, read_only=read_only, **kwargs)
+
+
+class RoutingSession(Session):
+    """
+    A sqlalchemy Session that sends reads to a replica when it is read-only, and always sends flushes and
+    insert/update/delete statements to the primary. Once it has written, it reads from the primary too until it is
+    closed, so it sees its own writes even when the replica hasn't caught up
+    """
+    def __init__(self, router=None, read_only=False, **kwargs):
+        """
+        Constructor
+        :param router:    A ReplicaRouter
+        :param read_only: Whether or not this session reads from replicas, or a function returning that (bool/callable)
+        :param kwargs:    Any additional Session arguments
+        """
+        super().__init__(**kwargs)
+        self.router = router
+        self.read_only = read_only
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.wrote = True
+        read_only = self.read_only() if callable(self.read_only) else self.read_only
+        if not read_only or self.wrote:
+            return self.router.primary
+        return self.router.get_engine(read_only=True)
+
+    def close(self):
+        super().close()
+        self.wrote = False
+
+
+def create_replica_router(login=os.environ.get("full_login"), password=os.environ.get("db_password"),
+                          replica_logins=os.environ.get(_replica_logins_var), replica_password=None,
+                          engine_options=None, **router_options):
+    """
+    Creates a ReplicaRouter for Oracle logins
+    :param login:            the primary's login string
+    :param password:         the database password
+    :param replica_logins:   login strings for the read-only databases, a list or a comma-separated string
+                             (defaults to the "replica_logins" env variable)
+    :param replica_password: the replicas' password, if different from the primary's
+    :param engine_options:   additional create_engine arguments for every engine (dict)
+    :param router_options:   any additional ReplicaRouter arguments (max_lag_seconds, etc.)
+    :return:                 a ReplicaRouter
+    """
+    engine_options = engine_options or {}
+    if isinstance(replica_logins, str):
+        replica_logins = [r.strip() for r in replica_logins.split(",") if r.strip()]
+    primary = OracleConnectionHelper(login, password).get_sql_alchemy_engine(**engine_options)
+    replicas = [
+        OracleConnectionHelper(r, replica_password or password).get_sql_alchemy_engine(**engine_options)
+        for r in replica_logins or []
+    ]
+    return ReplicaRouter(primary, replicas, **router_options)
+
+
+def with_routed_connection(router, read_only=False, auto_commit=False):
+    """
+    Decorator that passes a sqlalchemy connection from a ReplicaRouter to the decorated function
+    :param router:      the ReplicaRouter
+    :param read_only:   whether or not the function only reads, in which case it gets a replica connection
+    :param auto_commit: whether or not to commit the transaction after usage
+    :return:            a decorated function with a sqlalchemy connection passed in as the first argument
+    """
+    def with_routed_connection_(f):
+        @functools.wraps(f)
+        def wrap(*args, **kwargs):
+            connection = router.connect(read_only=read_only)
+            transaction = connection.begin()
+            try:
+                result = f(connection, *args, **kwargs)
+                if auto_commit and not read_only:
+                    transaction.commit()
+                return result
+            finally:
+                if transaction.is_active:
+                    transaction.rollback()
+                connection.close()
+        return wrap
+    return with_routed_connection_
+
+
+def with_routed_session(router, read_only=False, auto_commit=False):
+    """
+    Decorator that passes a RoutingSession to the decorated function
+    :param router:      the ReplicaRouter
+    :param read_only:   whether or not the function only reads, in which case queries go to a replica
+    :param auto_commit: whether or not to commit after usage
+    :return:            a decorated function with a RoutingSession as the first argument
+    """
+    def with_routed_session_(f):
+        @functools.wraps(f)
+        def wrap(*args, **kwargs):
+            session = router.sessionmaker(read_only=read_only)()
+            try:
+                result = f(session, *args, **kwargs)
+                if auto_commit:
+                    session.commit()
+                return result
+            finally:
+                session.rollback()
+                session.close()
+        return wrap
+    return with_routed_session_
@@ -1,3 +1,3 @@
-from .web import SecureFlaskApp
+from .web import SecureFlaskApp, save_metadata_snapshot
 
     
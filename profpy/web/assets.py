@@ -0,0 +1,130 @@
+"""
+Content-hashed static file urls for SecureFlaskApp.
+
+url_for("static", filename="css/site.css") is rewritten to a fingerprinted name like css/site.0123456789ab.css, which
+is served with a one year, immutable Cache-Control: whenever the file changes its url does too, so browsers never need
+to revalidate it. The fingerprints come from a manifest written at build time by fingerprint_static. Files missing
+from the manifest (e.g. bundles Flask-Assets builds at runtime) are hashed once and rehashed only when they change.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from werkzeug.security import safe_join
+
+MANIFEST_NAME = "assets.manifest.json"
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+HASH_LENGTH = 12
+
+_fingerprinted = re.compile(r"^(.+)\.([0-9a-f]{%d})(\.[^./]+)?$" % HASH_LENGTH)
+_skipped_extensions = (".gz", ".br")
+
+
+def file_hash(path):
+    """
+    :param path: A file
+    :return:     the fingerprint of its contents (str)
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as asset:
+        for block in iter(lambda: asset.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(filename, fingerprint):
+    """
+    :return: the filename with the fingerprint before its extension, e.g. css/site.0123456789ab.css
+    """
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{fingerprint}{extension}"
+
+
+def fingerprint_static(directory, manifest_path=None):
+    """
+    Writes a manifest of the fingerprint of every file in a static folder. Run it whenever the static files change,
+    e.g. while building the docker image.
+    :param directory:     The static folder
+    :param manifest_path: Where to write the manifest, defaults to assets.manifest.json in the static folder
+    :return:              the manifest, filename: fingerprinted filename (dict)
+    """
+    manifest_path = manifest_path or os.path.join(directory, MANIFEST_NAME)
+    manifest = {}
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            if file_name.endswith(_skipped_extensions) or os.path.abspath(path) == os.path.abspath(manifest_path):
+                continue
+            filename = os.path.relpath(path, directory).replace(os.sep, "/")
+            manifest[filename] = fingerprinted_name(filename, file_hash(path))
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+    return manifest
+
+
+class StaticAssets(object):
+    """
+    Maps static filenames to and from their fingerprinted names
+    """
+    def __init__(self, directory, manifest_path=None):
+        """
+        Constructor
+        :param directory:     The static folder                                                             (str)
+        :param manifest_path: A manifest from fingerprint_static, defaults to the one in the static folder  (str)
+        """
+        self.directory = directory
+        self.manifest_path = manifest_path or os.path.join(directory or "", MANIFEST_NAME)
+        self.__manifest = {}
+        self.__hashed = {}  # filename -> (mtime, fingerprinted filename), for files missing from the manifest
+        self.__lock = threading.Lock()
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                self.__manifest = json.load(manifest_file)
+
+    def __fingerprint(self, filename):
+        """
+        :return: the fingerprinted name of a file missing from the manifest, None if it doesn't exist
+        """
+        path = safe_join(self.directory, filename) if self.directory else None
+        try:
+            modified = os.path.getmtime(path) if path else None
+        except OSError:
+            modified = None
+        if modified is None:
+            return None
+        hashed = self.__hashed.get(filename)
+        if hashed is not None and hashed[0] == modified:
+            return hashed[1]
+        name = fingerprinted_name(filename, file_hash(path))
+        with self.__lock:
+            self.__hashed[filename] = (modified, name)
+        return name
+
+    def url_name(self, filename):
+        """
+        :param filename: A static file's path within the static folder
+        :return:         its fingerprinted name, or the filename unchanged if it isn't a static file
+        """
+        if filename in self.__manifest:
+            return self.__manifest[filename]
+        if filename.endswith(_skipped_extensions):
+            return filename
+        return self.__fingerprint(filename) or filename
+
+    def resolve(self, name):
+        """
+        :param name: A requested static filename
+        :return:     (the file to send, whether or not it can be cached forever). An outdated fingerprint, e.g. from a
+                     page rendered before a deploy, resolves to the current file, which mustn't be cached forever
+        """
+        match = _fingerprinted.match(name)
+        if match is None:
+            return name, False
+        filename = match.group(1) + (match.group(3) or "")
+        path = safe_join(self.directory, filename) if self.directory else None
+        if path is None or not os.path.isfile(path):
+            return name, False
+        return filename, self.url_name(filename) == name
@@ -0,0 +1,101 @@
+"""
+Small in-process caches used by SecureFlaskApp
+"""
+import time
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache(object):
+    """
+    A thread-safe LRU cache whose entries also expire after a time-to-live
+    """
+    def __init__(self, max_size=1024, ttl=300):
+        """
+        Constructor
+        :param max_size: The most entries to keep, least recently used entries are evicted first (int)
+        :param ttl:      Default seconds an entry lives, None for no expiration                    (float)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_entry(self, key):
+        """
+        :param key: The cache key
+        :return:    (value, seconds since it was set), or None if the key isn't cached. Expired entries are returned
+                    too, use expired() to check them
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            self.__entries.move_to_end(key)
+        value, set_at, _ = entry
+        return value, time.monotonic() - set_at
+
+    def expired(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+        return entry is None or (entry[2] is not None and time.monotonic() >= entry[2])
+
+    def get(self, key, default=None):
+        """
+        :param key:     The cache key
+        :param default: Returned when the key is missing or expired
+        :return:        The cached value
+        """
+        with self.__lock:
+            entry = self.__entries.get(key, _missing)
+            if entry is _missing:
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self.__entries[key]
+                return default
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_missing):
+        """
+        :param key:   The cache key
+        :param value: The value to cache
+        :param ttl:   Seconds this entry lives, defaults to the cache's ttl
+        """
+        ttl = self.ttl if ttl is _missing else ttl
+        now = time.monotonic()
+        with self.__lock:
+            self.__entries[key] = (value, now, now + ttl if ttl is not None else None)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.pop(key, _missing)
+        return default if entry is _missing else entry[0]
+
+    def pop_matching(self, predicate):
+        """
+        Removes every entry whose key matches
+        :param predicate: function(key) returning whether or not to remove the entry
+        :return:          The number of entries removed
+        """
+        with self.__lock:
+            keys = [k for k in self.__entries if predicate(k)]
+            for k in keys:
+                del self.__entries[k]
+        return len(keys)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
@@ -0,0 +1,120 @@
+"""
+CAS ticket validation over a pooled, keep-alive http session.
+
+caslib.SAMLClient posts every validation with requests.post, which opens a new (TLS) connection each time. The
+CasValidator here shares one requests.Session per process, with timeouts and connection retries, and keeps recent
+validation latencies. Every validation is sent to CAS, even concurrent ones of the same ticket, so a replayed ticket
+is always rejected by CAS rather than answered from another request's result.
+"""
+import time
+import logging
+import threading
+from collections import deque
+import caslib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .utils import percentile
+
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 10
+
+_percentiles = (50, 90, 99)
+_logger = logging.getLogger("profpy.web.cas")
+
+
+class PooledSAMLClient(caslib.SAMLClient):
+    """
+    A caslib SAMLClient that sends its requests through a shared requests.Session
+    """
+    def __init__(self, server_url, service_url, http_session, timeout=DEFAULT_TIMEOUT, verify=True, **kwargs):
+        """
+        Constructor
+        :param server_url:   The CAS server url
+        :param service_url:  The url of the service the ticket was issued for
+        :param http_session: The requests.Session to send requests with
+        :param timeout:      Seconds to wait for a response, or (connect, read) seconds (float/tuple)
+        :param verify:       Whether or not to verify the CAS server's certificate, or a CA bundle path
+        :param kwargs:       Any additional SAMLClient arguments
+        """
+        super().__init__(server_url, service_url, **kwargs)
+        self.http_session = http_session
+        self.timeout = timeout
+        self.verify = verify
+
+    def get_saml_response(self, url, envelope):
+        try:
+            response = self.http_session.post(url, data=envelope, timeout=self.timeout, verify=self.verify)
+            return caslib.SAMLResponse(response.text)
+        except Exception:
+            _logger.exception("SAML: Error retrieving a response")
+            raise
+
+
+class CasValidator(object):
+    """
+    Validates CAS tickets with a pooled http session
+    """
+    def __init__(self, cas_url, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE,
+                 verify=True, history=500):
+        """
+        Constructor
+        :param cas_url:   The CAS server url                                                               (str)
+        :param timeout:   Seconds to wait for CAS, or (connect, read) seconds                               (float/tuple)
+        :param retries:   Times to retry connecting to CAS. Requests that reached the server aren't retried,
+                          since a ticket can only be validated once                                        (int)
+        :param pool_size: Keep-alive connections to keep open to the CAS server                            (int)
+        :param verify:    Whether or not to verify the CAS server's certificate, or a CA bundle path
+        :param history:   Number of recent validation latencies to keep for stats()                        (int)
+        """
+        self.cas_url = cas_url.rstrip("/")
+        self.timeout = timeout
+        self.verify = verify
+        self.http_session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=0, redirect=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
+
+        self.__lock = threading.Lock()
+        self.__latencies = deque(maxlen=history)
+        self.__validations = 0
+        self.__failures = 0
+
+    def validate(self, ticket, service_url):
+        """
+        Validates a ticket with CAS
+        :param ticket:      The CAS service ticket
+        :param service_url: The url of the service the ticket was issued for
+        :return:            a caslib.SAMLResponse
+        """
+        client = PooledSAMLClient(self.cas_url, service_url, self.http_session, timeout=self.timeout,
+                                  verify=self.verify)
+        started = time.perf_counter()
+        try:
+            response = client.saml_serviceValidate(ticket)
+        except Exception:
+            self.__record(time.perf_counter() - started, False)
+            raise
+        self.__record(time.perf_counter() - started, response.success)
+        return response
+
+    def __record(self, latency, success):
+        with self.__lock:
+            self.__latencies.append(latency)
+            self.__validations += 1
+            if not success:
+                self.__failures += 1
+
+    def stats(self):
+        """
+        :return: dict with the number of validations and failures, and percentiles of recent validation latencies
+        """
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+            out = dict(validations=self.__validations, failures=self.__failures)
+        for p in _percentiles:
+            value = percentile(latencies, p)
+            out[f"p{p}_ms"] = round(value * 1000, 2) if value is not None else None
+        return out
@@ -0,0 +1,198 @@
+"""
+Response compression for SecureFlaskApp.
+
+Compressible responses (html, css, javascript, json, csv, ...) of at least min_size bytes are gzipped, or compressed
+with brotli when the brotli package is installed and the client accepts it. Static files aren't compressed per request:
+precompress the static folder at build time with precompress_static, and clients that accept it are sent the .br/.gz
+copy next to each asset.
+"""
+import os
+import gzip
+import zlib
+import mimetypes
+from flask import request, send_file, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 500
+DEFAULT_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = frozenset([
+    "text/html", "text/css", "text/plain", "text/csv", "text/xml", "text/javascript", "application/javascript",
+    "application/json", "application/x-ndjson", "application/xml", "application/manifest+json", "image/svg+xml",
+    "image/x-icon", "image/vnd.microsoft.icon", "font/ttf", "font/otf", "application/vnd.ms-fontobject",
+])
+
+# encoding: file extension, in order of preference
+_extensions = {"br": ".br", "gzip": ".gz"}
+
+
+def accepted_encodings():
+    """
+    :return: the encodings the current request accepts and this process can produce, preferred first (list)
+    """
+    accept = request.accept_encodings
+    return [e for e in _extensions if (e != "br" or brotli is not None) and accept[e] > 0]
+
+
+def _compress(data, encoding, level, brotli_quality):
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_chunks(chunks, encoding, level, brotli_quality):
+    """
+    Compresses a streamed body, flushing after every chunk so the client still receives it as it is produced
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotli_quality)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield compress(chunk) + flush()
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class Compressor(object):
+    """
+    Compresses compressible responses to clients that accept gzip or brotli
+    """
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL, brotli_quality=DEFAULT_BROTLI_QUALITY,
+                 compressible=COMPRESSIBLE_MIMETYPES):
+        """
+        Constructor
+        :param min_size:       Smallest body to compress in bytes, smaller ones gain little for the cpu   (int)
+        :param level:          gzip compression level, 1 (fastest) to 9 (smallest)                       (int)
+        :param brotli_quality: brotli quality, 0 (fastest) to 11 (smallest)                               (int)
+        :param compressible:   The mimetypes to compress                                                  (set)
+        """
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.compressible = compressible
+
+    def init_app(self, app):
+        app.after_request(self.__after_request)
+
+    def __after_request(self, response):
+        if response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 206, 304) \
+                or "Content-Encoding" in response.headers or response.mimetype not in self.compressible \
+                or "no-transform" in response.headers.get("Cache-Control", ""):
+            return response
+        response.vary.add("Accept-Encoding")
+        encodings = accepted_encodings()
+        if not encodings:
+            return response
+        encoding = encodings[0]
+
+        if response.is_streamed:
+            response.response = _compress_chunks(response.response, encoding, self.level, self.brotli_quality)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressed = _compress(data, encoding, self.level, self.brotli_quality)
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+
+        response.headers["Content-Encoding"] = encoding
+        # the compressed body is no longer byte-for-byte what a strong ETag describes
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def send_static(directory, filename, max_age=None, compressible=COMPRESSIBLE_MIMETYPES):
+    """
+    Sends a static file, or its up-to-date precompressed copy if the client accepts it
+    :param directory: The static folder
+    :param filename:  The file's path within it
+    :param max_age:   Seconds the browser may cache the file
+    :return:          a Flask response
+    """
+    mimetype = mimetypes.guess_type(filename)[0]
+    if mimetype not in compressible:
+        return send_from_directory(directory, filename, max_age=max_age)
+
+    source = safe_join(directory, filename)
+    if source is not None and os.path.isfile(source):
+        for encoding in accepted_encodings():
+            path = source + _extensions[encoding]
+            if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+                response = send_file(path, mimetype=mimetype, max_age=max_age)
+                response.headers["Content-Encoding"] = encoding
+                response.vary.add("Accept-Encoding")
+                return response
+    response = send_from_directory(directory, filename, max_age=max_age)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _write_if_smaller(path, data, size):
+    """
+    Writes a compressed copy of a file, or removes an old one if compressing no longer pays off
+    :return: whether or not the copy was written
+    """
+    if len(data) >= size:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    with open(path, "wb") as compressed_file:
+        compressed_file.write(data)
+    return True
+
+
+def precompress_static(directory, min_size=DEFAULT_MIN_SIZE, compressible=COMPRESSIBLE_MIMETYPES):
+    """
+    Writes .gz (and .br, if brotli is installed) copies of the compressible files in a static folder, at maximum
+    compression. Copies newer than their file are left alone. Run it whenever the static files change, e.g. while
+    building the docker image.
+    :param directory:    The static folder
+    :param min_size:     Smallest file to compress in bytes
+    :param compressible: The mimetypes to compress
+    :return:             the paths of the copies written (list)
+    """
+    written = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1] in _extensions.values():
+                continue
+            if mimetypes.guess_type(file_name)[0] not in compressible:
+                continue
+            source = os.path.join(root, file_name)
+            size = os.path.getsize(source)
+            if size < min_size:
+                continue
+            modified = os.path.getmtime(source)
+            data = None
+            for encoding, extension in _extensions.items():
+                if encoding == "br" and brotli is None:
+                    continue
+                path = source + extension
+                if os.path.exists(path) and os.path.getmtime(path) >= modified:
+                    continue
+                if data is None:
+                    with open(source, "rb") as source_file:
+                        data = source_file.read()
+                if _write_if_smaller(path, _compress(data, encoding, 9, 11), size):
+                    written.append(path)
+    return written
+
@@ -0,0 +1,105 @@
+"""
+ETags and conditional GETs for SecureFlaskApp.
+
+JSON responses get a strong ETag computed from their body, so a client polling with If-None-Match gets an empty 304
+when nothing changed. Routes decorated with SecureFlaskApp.conditional go further: their ETag comes from a cheap
+database-side version of the tables they read (max of a modified column, or ORA_ROWSCN on Oracle, plus a row count),
+so a 304 is sent before the view runs at all.
+"""
+import hashlib
+from datetime import datetime, date, timezone
+from sqlalchemy import select, func, literal_column
+from flask import request
+
+_json_mimetypes = ("application/json", "application/x-ndjson")
+
+
+def add_json_etag(response):
+    """
+    after_request hook that adds a strong ETag to JSON responses and answers matching conditional requests with a 304
+    :param response: The Flask response
+    :return:         The (possibly 304) response
+    """
+    if request.method not in ("GET", "HEAD") or response.status_code != 200 or response.is_streamed \
+            or response.mimetype not in _json_mimetypes or "ETag" in response.headers:
+        return response
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def version_statement(table, modified_column=None, dialect_name=None):
+    """
+    :param table:           A sqlalchemy Table
+    :param modified_column: A last-modified column of the table
+    :param dialect_name:    The database's sqlalchemy dialect name
+    :return:                A select of the table's version: (max modified value or ORA_ROWSCN, row count). The count
+                            catches deleted rows.
+    """
+    if modified_column:
+        marker = func.max(table.c[modified_column])
+    elif dialect_name == "oracle":
+        marker = func.max(literal_column("ora_rowscn"))
+    else:
+        raise ValueError(f"A modified_column is required to version {table.name} on {dialect_name}.")
+    return select(marker, func.count()).select_from(table)
+
+
+def _http_date(value):
+    """
+    :return: a timezone-aware datetime for a Last-Modified header, None if the value isn't a date
+    """
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return None
+
+
+class Version(object):
+    """
+    The database-side version of the data behind a response
+    """
+    def __init__(self, parts, last_modified=None):
+        """
+        Constructor
+        :param parts:         Values that change whenever the data does (list)
+        :param last_modified: When the data last changed (datetime)
+        """
+        self.parts = parts
+        self.last_modified = last_modified
+
+    def etag(self, *scope):
+        """
+        :param scope: Anything else the response depends on, e.g. the path and the user
+        :return:      A strong ETag value (str)
+        """
+        digest = hashlib.sha1(repr((self.parts, scope)).encode("utf-8"))
+        return digest.hexdigest()
+
+
+def read_version(connection, statements):
+    """
+    Runs version statements
+    :param connection: A sqlalchemy connection or session
+    :param statements: Selects from version_statement
+    :return:           A Version
+    """
+    parts = []
+    last_modified = None
+    for statement in statements:
+        marker, count = connection.execute(statement).one()
+        parts.append((str(marker), count))
+        modified = _http_date(marker)
+        if modified is not None and (last_modified is None or modified > last_modified):
+            last_modified = modified
+    return Version(parts, last_modified)
+
+
+def not_modified(etag):
+    """
+    :return: whether or not the current request's If-None-Match shows the client's copy is current. If-Modified-Since
+             alone never does: deleting a row, or a different user asking, leaves the last-modified date unchanged.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return False
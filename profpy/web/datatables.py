@@ -0,0 +1,167 @@
+"""
+Server-side processing for DataTables (https://datatables.net/manual/server-side)
+
+Paging, sorting and searching are done by the database with bind variables, so only the visible page of rows is sent
+to the browser. Only whitelisted columns can be searched or sorted on.
+"""
+import re
+from sqlalchemy import Table, select, func, or_, and_, String
+from .cache import TTLCache
+from .serialization import row_serializer
+
+DEFAULT_COUNT_TTL = 300
+DEFAULT_MAX_LENGTH = 1000
+
+_order_regex = re.compile(r"^order\[(\d+)\]\[(column|dir)\]$")
+_column_regex = re.compile(r"^columns\[(\d+)\]\[(data|name|searchable|orderable|search\]\[value)\]$")
+_like_escape = "\\"
+
+
+def _contains(column, value):
+    """
+    :return: a case-insensitive "column contains value" clause, with like wildcards in the value escaped
+    """
+    escaped = value.replace(_like_escape, _like_escape * 2).replace("%", f"{_like_escape}%") \
+        .replace("_", f"{_like_escape}_")
+    return column.ilike(f"%{escaped}%", escape=_like_escape)
+
+
+class DataTableRequest(object):
+    """
+    The parameters of a DataTables server-side request
+    """
+    def __init__(self, args):
+        """
+        Constructor
+        :param args: The request's query string (GET) or form (POST) values (dict-like)
+        """
+        self.draw = int(args.get("draw", 0))
+        self.start = max(int(args.get("start", 0)), 0)
+        self.length = int(args.get("length", 10))
+        self.search = (args.get("search[value]") or "").strip()
+
+        order = {}
+        columns = {}
+        for key, value in args.items():
+            match = re.match(_order_regex, key)
+            if match:
+                order.setdefault(int(match.group(1)), {})[match.group(2)] = value
+                continue
+            match = re.match(_column_regex, key)
+            if match:
+                columns.setdefault(int(match.group(1)), {})[match.group(2)] = value
+
+        # columns[i][data] is the client's field name for column i, fall back to columns[i][name]
+        self.columns = [columns[i] for i in sorted(columns)]
+        self.order = []
+        for i in sorted(order):
+            index = int(order[i].get("column", -1))
+            if 0 <= index < len(self.columns) and self.columns[index].get("orderable", "true") == "true":
+                self.order.append((self.column_name(index), order[i].get("dir", "asc").lower() == "desc"))
+        self.column_search = {
+            self.column_name(i): c["search][value"].strip()
+            for i, c in enumerate(self.columns)
+            if c.get("search][value", "").strip() and c.get("searchable", "true") == "true" and self.column_name(i)
+        }
+
+    def column_name(self, index):
+        column = self.columns[index]
+        return column.get("data") or column.get("name")
+
+
+class DataTable(object):
+    """
+    Answers DataTables server-side requests for a table or query
+    """
+    def __init__(self, source, columns=None, searchable=None, count_ttl=DEFAULT_COUNT_TTL,
+                 max_length=DEFAULT_MAX_LENGTH):
+        """
+        Constructor
+        :param source:     A sqlalchemy Table, select() or ORM query
+        :param columns:    The columns to send to the browser, defaults to every column                        (list)
+        :param searchable: The columns the search box looks in, defaults to the string columns                 (list)
+        :param count_ttl:  Seconds to cache the total (and filtered) row counts, 0 to count on every request    (float)
+        :param max_length: The most rows a single request can ask for, -1 ("all") is capped to this too         (int)
+        """
+        if hasattr(source, "statement"):
+            source = source.statement
+        self.source = source if isinstance(source, Table) else source.subquery()
+        available = {c.name.lower(): c for c in self.source.columns}
+        names = [c.lower() for c in columns] if columns else list(available)
+        missing = [c for c in names if c not in available]
+        if missing:
+            raise ValueError(f"Columns not found: {', '.join(missing)}")
+        self.columns = {name: available[name] for name in names}
+        if searchable is None:
+            self.searchable = [n for n, c in self.columns.items() if isinstance(c.type, String)]
+        else:
+            self.searchable = [c.lower() for c in searchable if c.lower() in self.columns]
+        self.max_length = max_length
+        self.__counts = TTLCache(max_size=256, ttl=count_ttl) if count_ttl else None
+        self.__serialize = row_serializer(self.columns)
+
+    def __filters(self, dt_request):
+        filters = []
+        # smart search like DataTables does client-side: every word has to be in one of the searchable columns
+        for word in dt_request.search.split() if self.searchable else []:
+            filters.append(or_(*[_contains(self.columns[c], word) for c in self.searchable]))
+        for name, value in dt_request.column_search.items():
+            name = name.lower() if name else name
+            if name in self.searchable:
+                filters.append(_contains(self.columns[name], value))
+        return filters
+
+    def __count(self, connection, key, filters):
+        if self.__counts is not None:
+            count = self.__counts.get(key)
+            if count is not None:
+                return count
+        statement = select(func.count()).select_from(self.source)
+        if filters:
+            statement = statement.where(and_(*filters))
+        count = connection.execute(statement).scalar()
+        if self.__counts is not None:
+            self.__counts.set(key, count)
+        return count
+
+    def invalidate_counts(self):
+        """
+        Drops the cached row counts, e.g. after inserting or deleting rows
+        """
+        if self.__counts is not None:
+            self.__counts.clear()
+
+    def respond(self, connection, args):
+        """
+        :param connection: A sqlalchemy connection or session
+        :param args:       The request's DataTables parameters (dict-like)
+        :return:           The DataTables response (dict with draw, recordsTotal, recordsFiltered and data)
+        """
+        try:
+            dt_request = DataTableRequest(args)
+        except ValueError:
+            return dict(draw=0, recordsTotal=0, recordsFiltered=0, data=[], error="Invalid request.")
+
+        filters = self.__filters(dt_request)
+        total = self.__count(connection, None, [])
+        if filters:
+            key = (dt_request.search, tuple(sorted(dt_request.column_search.items())))
+            filtered = self.__count(connection, key, filters)
+        else:
+            filtered = total
+
+        statement = select(*[column.label(name) for name, column in self.columns.items()])
+        if filters:
+            statement = statement.where(and_(*filters))
+        order_by = []
+        for name, descending in dt_request.order:
+            column = self.columns.get(name.lower() if name else name)
+            if column is not None:
+                order_by.append(column.desc() if descending else column.asc())
+        # page through a stable order, even if the client didn't ask for one
+        statement = statement.order_by(*(order_by or [next(iter(self.columns.values()))]))
+        length = self.max_length if dt_request.length < 0 else min(dt_request.length, self.max_length)
+        statement = statement.offset(dt_request.start).limit(length)
+
+        data = [self.__serialize(row) for row in connection.execute(statement).mappings()]
+        return dict(draw=dt_request.draw, recordsTotal=total, recordsFiltered=filtered, data=data)
@@ -0,0 +1,183 @@
+"""
+Background health probing for SecureFlaskApp.
+
+A HealthMonitor probes the database (and optionally the CAS server) on an interval from a background thread, so health
+endpoints can answer from the last result instead of querying the database on every request.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from sqlalchemy import text
+from .utils import percentile
+
+DEFAULT_INTERVAL = 15
+DEFAULT_TIMEOUT = 5
+DEFAULT_HISTORY = 120
+
+# probe queries by sqlalchemy dialect name, anything else uses "select 1"
+_probe_queries = dict(oracle="select 1 from dual")
+_percentiles = (50, 90, 99)
+_logger = logging.getLogger("profpy.web.health")
+
+
+class _Check(object):
+    """
+    Recent results of one kind of probe
+    """
+    def __init__(self, name, probe, history):
+        self.name = name
+        self.probe = probe
+        self.results = deque(maxlen=history)   # (time.time(), healthy, latency seconds, error)
+        self.future = None
+        self.timed_out = False
+
+    def record(self, healthy, latency, error=None):
+        self.results.append((time.time(), healthy, latency, error))
+        if not healthy:
+            _logger.warning(f"Health check {self.name} failed: {error}")
+
+    def report(self, stale_after):
+        """
+        :param stale_after: seconds after which the last result no longer counts as healthy
+        :return:            dict describing the check's last result and recent latencies
+        """
+        if not self.results:
+            return dict(healthy=False, starting=True, error="Starting, not checked yet.")
+        checked_at, healthy, latency, error = self.results[-1]
+        age = time.time() - checked_at
+        if healthy and age > stale_after:
+            healthy, error = False, f"Last checked {age:.0f}s ago."
+        latencies = sorted(r[2] for r in self.results if r[2] is not None)
+        report = dict(
+            healthy=healthy,
+            checked_at=checked_at,
+            latency_ms=round(latency * 1000, 2) if latency is not None else None,
+            samples=len(self.results),
+            failures=sum(1 for r in self.results if not r[1]),
+        )
+        for p in _percentiles:
+            value = percentile(latencies, p)
+            report[f"p{p}_ms"] = round(value * 1000, 2) if value is not None else None
+        if error:
+            report["error"] = error
+        return report
+
+
+class HealthMonitor(object):
+    """
+    Probes the database (and optionally CAS) on a background thread and caches the results
+    """
+    def __init__(self, engine, cas_url=None, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT,
+                 history=DEFAULT_HISTORY):
+        """
+        Constructor
+        :param engine:   The sqlalchemy engine to probe
+        :param cas_url:  The CAS server url to probe, None to only probe the database       (str)
+        :param interval: Seconds between probes                                             (float)
+        :param timeout:  Seconds before a probe counts as failed                            (float)
+        :param history:  Number of recent probe results to keep for the latency percentiles (int)
+        """
+        self.engine = engine
+        self.cas_url = cas_url
+        self.interval = interval
+        self.timeout = timeout
+        self.started_at = time.time()
+        self.__checks = [_Check("database", self.__probe_database, history)]
+        if cas_url:
+            self.__checks.append(_Check("cas", self.__probe_cas, history))
+        self.__executor = None
+        self.__thread_pid = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+    def __probe_database(self):
+        sql = _probe_queries.get(self.engine.dialect.name, "select 1")
+        with self.engine.connect() as connection:
+            connection.execute(text(sql)).scalar()
+
+    def __probe_cas(self):
+        import requests
+        response = requests.get(f"{self.cas_url}/cas/login", timeout=self.timeout, allow_redirects=False)
+        if response.status_code >= 500:
+            raise Exception(f"CAS server returned {response.status_code}")
+
+    def __timed(self, check):
+        started = time.perf_counter()
+        error = None
+        try:
+            check.probe()
+        except Exception as e:
+            error = str(e)
+        # a probe that outlived its timeout was already recorded as failed
+        if not check.timed_out:
+            check.record(error is None, time.perf_counter() - started, error)
+
+    def probe(self):
+        """
+        Runs every probe once, waiting at most timeout seconds. A probe that is still running from an earlier round
+        (e.g. hung on the network) is recorded as failed rather than started again.
+        """
+        pending = []
+        for check in self.__checks:
+            if check.future is not None and not check.future.done():
+                check.record(False, None, f"Still running after {self.timeout}s.")
+                continue
+            check.timed_out = False
+            check.future = self.__executor.submit(self.__timed, check)
+            pending.append(check)
+        deadline = time.monotonic() + self.timeout
+        for check in pending:
+            try:
+                check.future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeoutError:
+                check.timed_out = True
+                check.record(False, None, f"Timed out after {self.timeout}s.")
+
+    def start(self):
+        """
+        Starts the background prober, once per process (threads don't survive a fork). It runs the first probe right
+        away, but this doesn't wait for it
+        """
+        if self.__thread_pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__thread_pid == os.getpid():
+                return
+            self.__executor = ThreadPoolExecutor(max_workers=len(self.__checks), thread_name_prefix="profpy-probe")
+            for check in self.__checks:
+                check.future = None
+            self.__stop.clear()
+            threading.Thread(target=self.__probe_loop, name="profpy-health", daemon=True).start()
+            self.__thread_pid = os.getpid()
+
+    def stop(self):
+        """
+        Stops the background prober
+        """
+        self.__stop.set()
+
+    def __probe_loop(self):
+        while True:
+            self.probe()
+            if self.__stop.wait(self.interval):
+                break
+
+    def status(self):
+        """
+        Reports the prober's latest results, starting it in this process if it isn't running yet. It never waits for
+        a probe, so until the first one finishes the checks are unhealthy and "starting"
+        :return: dict with whether every check is healthy, whether any is still starting and a report for each check
+        """
+        self.start()
+        # allow a missed probe or two before calling a healthy result stale
+        stale_after = self.interval * 3 + self.timeout
+        checks = {check.name: check.report(stale_after) for check in self.__checks}
+        return dict(healthy=all(c["healthy"] for c in checks.values()),
+                    starting=any(c.get("starting") for c in checks.values()), checks=checks)
+
+    @property
+    def uptime(self):
+        return time.time() - self.started_at
@@ -0,0 +1,269 @@
+"""
+Background jobs for SecureFlaskApp.
+
+Long-running work (e.g. building a big report) is submitted to a bounded thread or process pool instead of running in
+the request, which would tie up a worker thread and run into gunicorn's worker timeout. Each job's status and result
+are spooled to files in a directory shared by the workers, so any worker can answer a poll for it, and they are
+removed ttl seconds after the job ends.
+"""
+import os
+import re
+import json
+import time
+import socket
+import tempfile
+import secrets
+import logging
+import mimetypes
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .utils import private_directory, pid_alive
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 50
+DEFAULT_TTL = 3600
+DEFAULT_CLEANUP_INTERVAL = 60
+# per user, since a directory another local user created could be used to read results or plant files
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), f"profpy_jobs_{os.getuid() if hasattr(os, 'getuid') else 0}")
+
+_job_id_regex = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_logger = logging.getLogger("profpy.web.jobs")
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while the job queue is full
+    """
+    pass
+
+
+def _path(directory, job_id, extension):
+    return os.path.join(directory, f"{job_id}.{extension}")
+
+
+def _read(directory, job_id):
+    try:
+        with open(_path(directory, job_id, "json"), "r") as job_file:
+            return json.load(job_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(directory, job):
+    path = _path(directory, job["id"], "json")
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as job_file:
+        json.dump(job, job_file)
+    os.replace(temp_path, path)
+
+
+def _update(directory, job_id, **changes):
+    """
+    :return: the updated job record, None if it is gone (e.g. it expired and was cleaned up)
+    """
+    job = _read(directory, job_id)
+    if job is None:
+        return None
+    job.update(changes)
+    _write(directory, job)
+    return job
+
+
+def _spool(result, path):
+    """
+    Writes a job's result to a file
+    :param result: bytes, str, a json-serializable dict/list, or an iterable of bytes/str chunks (e.g. csv lines)
+    :param path:   The result file
+    :return:       the result's default mimetype
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as result_file:
+        if isinstance(result, bytes):
+            mimetype = "application/octet-stream"
+            result_file.write(result)
+        elif isinstance(result, str):
+            mimetype = "text/plain"
+            result_file.write(result.encode("utf-8"))
+        elif isinstance(result, (dict, list)):
+            mimetype = "application/json"
+            result_file.write(json.dumps(result, default=str).encode("utf-8"))
+        else:
+            mimetype = "application/octet-stream"
+            for chunk in result:
+                result_file.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    os.replace(temp_path, path)
+    return mimetype
+
+
+def _run(directory, job_id, ttl, function, args, kwargs, context=None):
+    """
+    Runs a job, recording its status and spooling its result to the job directory
+    :param context: A function returning a context manager to run the job in, e.g. an app context
+    """
+    if _update(directory, job_id, status=RUNNING, started_at=time.time(), pid=os.getpid()) is None:
+        _logger.warning(f"Job {job_id} was removed before it ran")
+        return
+    try:
+        with context() if context is not None else nullcontext():
+            result = function(*args, **kwargs)
+            mimetype = _spool(result, _path(directory, job_id, "result")) if result is not None else None
+    except Exception as e:
+        _logger.exception(f"Job {job_id} failed")
+        finished_at = time.time()
+        _update(directory, job_id, status=FAILED, error=type(e).__name__, finished_at=finished_at,
+                expires_at=finished_at + ttl)
+        return
+    job = _read(directory, job_id)
+    if job is None:
+        return
+    finished_at = time.time()
+    job.update(status=FINISHED, finished_at=finished_at, expires_at=finished_at + ttl, has_result=result is not None,
+               mimetype=job["mimetype"] or mimetype)
+    _write(directory, job)
+
+
+class JobRunner(object):
+    """
+    Runs jobs on a bounded pool, keeping their status and results in a directory shared by the workers
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED,
+                 ttl=DEFAULT_TTL, processes=False, context=None, cleanup_interval=DEFAULT_CLEANUP_INTERVAL):
+        """
+        Constructor
+        :param directory:        The job directory, shared by every worker process. It must belong to the user
+                                 the app runs as, and only they can write to it                                 (str)
+        :param workers:          Jobs to run at once in each worker process                                     (int)
+        :param max_queued:       The most jobs waiting or running in each worker process before submitting more
+                                 raises JobQueueFull                                                            (int)
+        :param ttl:              Seconds to keep a job's status and result after it ends                        (float)
+        :param processes:        Run jobs in child processes rather than threads. Their functions and arguments
+                                 must be picklable, and they don't run in an app context                        (bool)
+        :param context:          For threads, a function returning a context manager to run each job in, e.g.
+                                 app.app_context
+        :param cleanup_interval: Seconds between removing expired jobs                                          (float)
+        """
+        self.directory = directory
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.processes = processes
+        self.context = context
+        self.cleanup_interval = cleanup_interval
+        self.__executor = None
+        self.__executor_pid = None
+        self.__pending = 0
+        self.__cleaned_at = 0.0
+        self.__lock = threading.Lock()
+        private_directory(directory)
+
+    def __get_executor(self):
+        # one pool per worker process, created on first use so it isn't shared across a fork
+        if self.__executor is None or self.__executor_pid != os.getpid():
+            executor_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+            self.__executor = executor_class(max_workers=self.workers)
+            self.__executor_pid = os.getpid()
+            self.__pending = 0
+        return self.__executor
+
+    def __done(self, future):
+        with self.__lock:
+            self.__pending -= 1
+        error = future.exception()
+        if error is not None:
+            _logger.error(f"Job could not be run: {error!r}")
+
+    def submit(self, function, *args, owner=None, filename=None, mimetype=None, **kwargs):
+        """
+        Queues a job
+        :param function: The function to run, its return value is spooled to disk as the job's result
+        :param args:     The function's positional arguments
+        :param owner:    The user the job belongs to, only they can see it
+        :param filename: The result's download filename
+        :param mimetype: The result's mimetype, guessed from the filename or the result's type by default
+        :param kwargs:   The function's keyword arguments
+        :return:         the job id (str)
+        """
+        self.cleanup()
+        with self.__lock:
+            executor = self.__get_executor()
+            if self.__pending >= self.max_queued:
+                raise JobQueueFull(f"There are already {self.__pending} jobs queued.")
+            self.__pending += 1
+
+        job_id = secrets.token_urlsafe(16)
+        _write(self.directory, dict(
+            id=job_id, name=getattr(function, "__name__", "job"), owner=owner, status=QUEUED,
+            submitted_at=time.time(), started_at=None, finished_at=None, expires_at=None, error=None,
+            host=socket.gethostname(), pid=os.getpid(), has_result=False, filename=filename,
+            mimetype=mimetype or (mimetypes.guess_type(filename)[0] if filename else None),
+        ))
+        try:
+            future = executor.submit(_run, self.directory, job_id, self.ttl, function, args, kwargs,
+                                     None if self.processes else self.context)
+        except Exception:
+            with self.__lock:
+                self.__pending -= 1
+            self.delete(job_id)
+            raise
+        future.add_done_callback(self.__done)
+        return job_id
+
+    def status(self, job_id):
+        """
+        :param job_id: A job id
+        :return:       the job's status record (dict), None if there is no such job or it has expired
+        """
+        if not job_id or not _job_id_regex.match(job_id):
+            return None
+        job = _read(self.directory, job_id)
+        if job is None or (job["expires_at"] is not None and job["expires_at"] < time.time()):
+            return None
+        # the worker running the job exited before it ended
+        if job["status"] in (QUEUED, RUNNING) and job["host"] == socket.gethostname() and not pid_alive(job["pid"]):
+            finished_at = time.time()
+            job = _update(self.directory, job_id, status=FAILED, error="WorkerExited", finished_at=finished_at,
+                          expires_at=finished_at + self.ttl)
+        return job
+
+    def result_path(self, job_id):
+        """
+        :param job_id: A job id
+        :return:       the path of the job's result file, None if it has none (yet)
+        """
+        job = self.status(job_id)
+        if job is None or job["status"] != FINISHED or not job["has_result"]:
+            return None
+        return _path(self.directory, job_id, "result")
+
+    def delete(self, job_id):
+        for extension in ("json", "result"):
+            try:
+                os.remove(_path(self.directory, job_id, extension))
+            except OSError:
+                pass
+
+    def cleanup(self):
+        """
+        Removes jobs whose ttl has passed, at most once every cleanup_interval seconds
+        :return: the number of jobs removed
+        """
+        now = time.time()
+        with self.__lock:
+            if now - self.__cleaned_at < self.cleanup_interval:
+                return 0
+            self.__cleaned_at = now
+        removed = 0
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            job_id = file_name[:-len(".json")]
+            job = _read(self.directory, job_id)
+            if job is not None and job["expires_at"] is not None and job["expires_at"] < now:
+                self.delete(job_id)
+                removed += 1
+        return removed
@@ -0,0 +1,316 @@
+"""
+Request metrics for SecureFlaskApp, exposed in the Prometheus text format.
+
+Each request records its latency, status, database time/query count (from sqlalchemy engine events) and auth/CAS time
+into in-process counters and histograms. With gunicorn, every worker periodically writes its totals to a file in a
+shared directory, and the metrics endpoint adds up the files of every worker.
+"""
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from sqlalchemy import event
+from flask import g, request, has_request_context
+from .utils import pid_alive
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_FLUSH_INTERVAL = 5
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_stats_key = "profpy_request_stats"
+_file_prefix = "profpy_metrics_"
+
+# name: (type, help)
+_metrics = {
+    "profpy_http_requests_total": ("counter", "Requests by endpoint, method and status."),
+    "profpy_http_request_duration_seconds": ("histogram", "Request latency by endpoint and method."),
+    "profpy_http_requests_in_flight": ("gauge", "Requests currently being handled."),
+    "profpy_db_queries_total": ("counter", "SQL statements executed by endpoint."),
+    "profpy_db_duration_seconds": ("histogram", "Time per request spent executing SQL, by endpoint."),
+    "profpy_auth_duration_seconds": ("histogram", "Time per request spent on authorization lookups and CAS "
+                                                  "ticket validation, by endpoint and kind."),
+}
+
+
+class RequestStats(object):
+    """
+    Database and auth work done while handling the current request
+    """
+    __slots__ = ("queries", "db_seconds", "auth_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.auth_seconds = {}
+        self.statements = None  # [(sql, seconds), ...] while query profiling is on
+
+
+def request_stats():
+    """
+    :return: the current request's RequestStats, None outside of a request
+    """
+    if not has_request_context():
+        return None
+    stats = g.get(_stats_key)
+    if stats is None:
+        stats = RequestStats()
+        setattr(g, _stats_key, stats)
+    return stats
+
+
+def record_query(seconds, statement=None):
+    """
+    Counts a SQL statement against the current request
+    :param seconds:   How long it took
+    :param statement: The SQL, kept when the request's statements are being collected
+    """
+    stats = request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+        if stats.statements is not None and statement is not None:
+            stats.statements.append((statement, seconds))
+
+
+def record_auth(kind, seconds):
+    """
+    Adds auth time to the current request
+    :param kind:    "authorization" (user/role lookups) or "cas" (ticket validation)
+    :param seconds: How long it took
+    """
+    stats = request_stats()
+    if stats is not None:
+        stats.auth_seconds[kind] = stats.auth_seconds.get(kind, 0.0) + seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is dropped with the statement whether it succeeds or fails
+    if context is not None:
+        context.profpy_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "profpy_query_started", None)
+    if started is not None:
+        record_query(time.perf_counter() - started, statement)
+
+
+def _handle_error(exception_context):
+    # failed statements take time too
+    _after_cursor_execute(None, None, exception_context.statement, None, exception_context.execution_context, False)
+
+
+def instrument_engine(engine):
+    """
+    Times the statements run through a sqlalchemy engine and counts them against the current request
+    :param engine: The sqlalchemy engine
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+
+def _format_float(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe counters, gauges and histograms for one process, which can be saved to and summed across files
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, directory=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Constructor
+        :param buckets:        Histogram bucket upper bounds in seconds                                      (tuple)
+        :param directory:      A directory shared by every worker process, for multi-process aggregation     (str)
+        :param flush_interval: Seconds between writes of this process's metrics to the directory             (float)
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.__counters = {}    # (name, labels) -> value
+        self.__gauges = {}      # (name, labels) -> value
+        self.__histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.__lock = threading.Lock()
+        self.__flush_pid = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name, labels, value=1):
+        with self.__lock:
+            key = (name, labels)
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels, value):
+        with self.__lock:
+            key = (name, labels)
+            self.__gauges[key] = self.__gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.__lock:
+            key = (name, labels)
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        """
+        :return: this process's metrics as a json-serializable dict
+        """
+        with self.__lock:
+            return dict(
+                pid=os.getpid(),
+                counters=[[n, list(map(list, l)), v] for (n, l), v in self.__counters.items()],
+                gauges=[[n, list(map(list, l)), v] for (n, l), v in self.__gauges.items()],
+                histograms=[[n, list(map(list, l)), list(h)] for (n, l), h in self.__histograms.items()],
+            )
+
+    def flush(self):
+        """
+        Writes this process's metrics to the shared directory
+        """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{_file_prefix}{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            json.dump(self.snapshot(), metrics_file)
+        os.replace(temp_path, path)
+
+    def start(self):
+        """
+        Starts writing this process's metrics to the shared directory, once per process
+        """
+        if not self.directory or self.__flush_pid == os.getpid():
+            return
+        self.__flush_pid = os.getpid()
+        threading.Thread(target=self.__flush_loop, name="profpy-metrics", daemon=True).start()
+
+    def __flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def __snapshots(self):
+        """
+        :return: the snapshots of every worker, with this process's taken live
+        """
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        for file_name in os.listdir(self.directory):
+            if not file_name.startswith(_file_prefix) or not file_name.endswith(".json"):
+                continue
+            if file_name == f"{_file_prefix}{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name), "r") as metrics_file:
+                    snapshots.append(json.load(metrics_file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        :return: every worker's metrics, summed, in the Prometheus text format (str)
+        """
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self.__snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            # gauges of workers that have exited no longer apply
+            if snapshot["pid"] == os.getpid() or pid_alive(snapshot["pid"]):
+                for name, labels, value in snapshot["gauges"]:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                current = histograms.get(key)
+                histograms[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+
+        lines = []
+        for name, (kind, help_text) in _metrics.items():
+            source = dict(counter=counters, gauge=gauges, histogram=histograms)[kind]
+            series = sorted((labels, v) for (n, labels), v in source.items() if n == name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_float(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_float(bound)),))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_float(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics(object):
+    """
+    Records request metrics for a Flask app into a MetricsRegistry
+    """
+    def __init__(self, app_name, registry):
+        """
+        Constructor
+        :param app_name: The application name, added as the "app" label
+        :param registry: The MetricsRegistry to record into
+        """
+        self.app_name = app_name
+        self.registry = registry
+
+    def init_app(self, app):
+        app.before_request(self.__before_request)
+        app.after_request(self.__after_request)
+        app.teardown_request(self.__teardown_request)
+
+    def __before_request(self):
+        self.registry.start()
+        g.profpy_request_started = time.perf_counter()
+        g.profpy_request_status = 500
+        self.registry.add_gauge("profpy_http_requests_in_flight", (("app", self.app_name),), 1)
+
+    def __after_request(self, response):
+        g.profpy_request_status = response.status_code
+        return response
+
+    def __teardown_request(self, error=None):
+        started = g.get("profpy_request_started")
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        labels = (("app", self.app_name), ("endpoint", endpoint))
+        registry = self.registry
+        registry.add_gauge("profpy_http_requests_in_flight", (("app", self.app_name),), -1)
+        registry.inc("profpy_http_requests_total",
+                     labels + (("method", request.method), ("status", str(g.profpy_request_status))))
+        registry.observe("profpy_http_request_duration_seconds", labels + (("method", request.method),), elapsed)
+        stats = g.get(_stats_key)
+        if stats is not None:
+            if stats.queries:
+                registry.inc("profpy_db_queries_total", labels, stats.queries)
+                registry.observe("profpy_db_duration_seconds", labels, stats.db_seconds)
+            for kind, seconds in stats.auth_seconds.items():
+                registry.observe("profpy_auth_duration_seconds", labels + (("kind", kind),), seconds)
@@ -0,0 +1,85 @@
+"""
+Per-request query profiling for SecureFlaskApp.
+
+While profiling is on, every SQL statement run for a request is grouped by its normalized fingerprint (see
+profpy.db.sql_fingerprint). A statement that runs many times in one request, usually from querying inside a loop over
+rows, is flagged as a probable N+1. The counts are added to the response headers and logged.
+"""
+import logging
+from profpy.db.general.profiling import sql_fingerprint, normalize_sql
+from flask import request
+from .metrics import request_stats
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+COUNT_HEADER = "X-Query-Count"
+TIME_HEADER = "X-Query-Time-Ms"
+DISTINCT_HEADER = "X-Query-Distinct"
+N_PLUS_ONE_HEADER = "X-Query-N-Plus-One"
+
+_logger = logging.getLogger("profpy.web.queries")
+
+
+class QueryGroup(object):
+    """
+    Every execution of one statement fingerprint during a request
+    """
+    def __init__(self, fingerprint, sql):
+        self.fingerprint = fingerprint
+        self.sql = normalize_sql(sql)
+        self.count = 0
+        self.seconds = 0.0
+
+
+def group_statements(statements):
+    """
+    :param statements: (sql, seconds) tuples
+    :return:           QueryGroups, the most executed first (list)
+    """
+    groups = {}
+    for sql, seconds in statements:
+        fingerprint = sql_fingerprint(sql)
+        group = groups.get(fingerprint)
+        if group is None:
+            group = groups[fingerprint] = QueryGroup(fingerprint, sql)
+        group.count += 1
+        group.seconds += seconds
+    return sorted(groups.values(), key=lambda g: (-g.count, -g.seconds))
+
+
+class QueryProfiler(object):
+    """
+    Collects the statements each request runs and reports probable N+1 query patterns
+    """
+    def __init__(self, threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        """
+        Constructor
+        :param threshold: Flag a statement fingerprint run at least this many times in one request (int)
+        """
+        self.threshold = threshold
+
+    def init_app(self, app):
+        app.before_request(self.__before_request)
+        app.after_request(self.__after_request)
+
+    def __before_request(self):
+        request_stats().statements = []
+
+    def __after_request(self, response):
+        stats = request_stats()
+        if stats is None or stats.statements is None:
+            return response
+        groups = group_statements(stats.statements)
+        suspects = [g for g in groups if g.count >= self.threshold]
+
+        response.headers[COUNT_HEADER] = str(stats.queries)
+        response.headers[TIME_HEADER] = f"{stats.db_seconds * 1000:.1f}"
+        response.headers[DISTINCT_HEADER] = str(len(groups))
+        if suspects:
+            response.headers[N_PLUS_ONE_HEADER] = ", ".join(f"{g.fingerprint}x{g.count}" for g in suspects)
+
+        _logger.info(f"{request.method} {request.path}: {stats.queries} queries ({len(groups)} distinct) in "
+                     f"{stats.db_seconds * 1000:.1f}ms")
+        for group in suspects:
+            _logger.warning(f"Probable N+1 in {request.method} {request.path}: {group.count} executions "
+                            f"({group.seconds * 1000:.1f}ms) of [{group.fingerprint}] {group.sql}")
+        return response
@@ -0,0 +1,195 @@
+"""
+Response caching for SecureFlaskApp routes, see SecureFlaskApp.cached.
+
+Cached responses are keyed by endpoint, path, query string and the user's role set (or the user). Entries are served
+fresh for their ttl, then (optionally) served stale for a while longer while a background thread re-renders them.
+"""
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from .cache import TTLCache
+from .utils import private_directory
+
+DEFAULT_CACHE_SIZE = 512
+CACHE_HEADER = "X-Cache"
+
+_logger = logging.getLogger("profpy.web.response_cache")
+
+
+class CachedResponse(object):
+    """
+    The parts of a response needed to rebuild it
+    """
+    def __init__(self, body, status, headers, stored_at=None):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    @property
+    def age(self):
+        return time.time() - self.stored_at
+
+
+class MemoryBackend(object):
+    """
+    Keeps cached responses in this process
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Constructor
+        :param max_size: The most responses to keep, least recently used ones are evicted first (int)
+        """
+        self.__cache = TTLCache(max_size=max_size, ttl=None)
+
+    def get(self, key):
+        return self.__cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.__cache.set(key, value, ttl=ttl)
+
+    def delete_matching(self, predicate):
+        return self.__cache.pop_matching(predicate)
+
+    def clear(self):
+        self.__cache.clear()
+
+
+class DiskBackend(object):
+    """
+    Keeps cached responses in a directory, which can be shared by every worker process
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE * 4):
+        """
+        Constructor
+        :param directory: The cache directory                                           (str)
+        :param max_size:  The most responses to keep, the oldest are removed first      (int)
+        """
+        # cached responses are unpickled, so the directory must be one nobody else can write to
+        self.directory = private_directory(directory)
+        self.max_size = max_size
+        self.__writes = 0
+
+    def __path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(pickle.dumps(key)).hexdigest() + ".cache")
+
+    def __read(self, path):
+        try:
+            with open(path, "rb") as cache_file:
+                return pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def __files(self):
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".cache")]
+
+    def get(self, key):
+        entry = self.__read(self.__path(key))
+        if entry is None:
+            return None
+        stored_key, expires_at, value = entry
+        if stored_key != key or (expires_at is not None and time.time() >= expires_at):
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        path = self.__path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump((key, time.time() + ttl if ttl is not None else None, value), cache_file)
+        os.replace(temp_path, path)
+        self.__writes += 1
+        if self.__writes % 100 == 0:
+            self.__evict()
+
+    def __evict(self):
+        files = self.__files()
+        if len(files) <= self.max_size:
+            return
+        files.sort(key=lambda f: os.path.getmtime(f) if os.path.exists(f) else 0)
+        for path in files[:len(files) - self.max_size]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete_matching(self, predicate):
+        removed = 0
+        for path in self.__files():
+            entry = self.__read(path)
+            if entry is not None and predicate(entry[0]):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def clear(self):
+        self.delete_matching(lambda key: True)
+
+
+class ResponseCache(object):
+    """
+    Serves and stores cached responses, refreshing stale ones in the background
+    """
+    def __init__(self, backend):
+        """
+        Constructor
+        :param backend: A MemoryBackend or DiskBackend
+        """
+        self.backend = backend
+        self.__refreshing = set()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def store(self, key, response, ttl, stale_ttl):
+        """
+        Caches a response if it can be
+        :param key:       The cache key
+        :param response:  A Flask response
+        :param ttl:       Seconds the response is fresh
+        :param stale_ttl: Seconds after that it can still be served while it is refreshed
+        """
+        if response.status_code != 200 or response.is_streamed or "Set-Cookie" in response.headers:
+            return
+        headers = [(k, v) for k, v in response.headers.items() if k != CACHE_HEADER]
+        self.backend.set(key, CachedResponse(response.get_data(), response.status_code, headers),
+                         ttl + (stale_ttl or 0))
+
+    def refresh(self, key, render, ttl, stale_ttl):
+        """
+        Re-renders a stale response on a background thread, unless it is already being refreshed
+        :param key:    The cache key
+        :param render: A function returning the new response, run in a copy of the request context
+        """
+        with self.__lock:
+            if key in self.__refreshing:
+                return
+            self.__refreshing.add(key)
+
+        def run():
+            try:
+                self.store(key, render(), ttl, stale_ttl)
+            except Exception:
+                _logger.exception(f"Failed to refresh cached response {key}")
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(key)
+        threading.Thread(target=run, name="profpy-cache-refresh", daemon=True).start()
+
+    def invalidate(self, endpoint=None, path=None):
+        """
+        Drops cached responses
+        :param endpoint: Only drop this endpoint's responses
+        :param path:     Only drop responses for this path
+        :return:         The number of responses dropped
+        """
+        return self.backend.delete_matching(
+            lambda key: (endpoint is None or key[0] == endpoint) and (path is None or key[1] == path)
+        )
@@ -0,0 +1,118 @@
+"""
+JSON serialization of query results for Table.as_json and Table.as_json_stream
+
+Column accessors are built once per call rather than once per row, and orjson can be used for encoding when it is
+installed. Either way, Decimals are encoded as strings like Flask's jsonify does, so no precision is lost.
+"""
+import json
+import decimal
+from operator import attrgetter, itemgetter
+from collections.abc import Mapping
+from datetime import datetime, date, time
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+DEFAULT_CHUNK_SIZE = 500
+JSON_MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+_temporal = (datetime, date, time)
+
+
+def _default(value):
+    """
+    Handles the types the json encoders don't know about
+    """
+    if isinstance(value, _temporal):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj, use_orjson=False):
+    """
+    Encodes an object as compact json
+    :param obj:        The object to encode
+    :param use_orjson: Encode with orjson if it is installed
+    :return:           The json (bytes with orjson, otherwise str)
+    """
+    if use_orjson and orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":"))
+
+
+def row_serializer(column_names, iso_dates=True):
+    """
+    Builds a function that turns a result row into a dict of the given columns
+    :param column_names: The column names, in order                        (list)
+    :param iso_dates:    Whether or not to convert dates/times to iso strings (bool)
+    :return:             function(row) -> dict
+    """
+    names = tuple(column_names)
+    by_attribute = attrgetter(*names) if names else (lambda row: ())
+    by_key = itemgetter(*names) if names else (lambda row: ())
+    single = len(names) == 1
+
+    def serialize(row):
+        values = by_key(row) if isinstance(row, Mapping) else by_attribute(row)
+        if single:
+            values = (values,)
+        if iso_dates:
+            values = [v.isoformat() if isinstance(v, _temporal) else v for v in values]
+        return dict(zip(names, values))
+    return serialize
+
+
+def _chunks(rows, serialize, chunk_size, ndjson, use_orjson):
+    """
+    Yields the encoded rows in chunks, as a json array or as newline-delimited json
+    """
+    # orjson encodes to bytes and json to str, the separators have to match
+    use_orjson = use_orjson and orjson is not None
+    empty = b"" if use_orjson else ""
+    separator = (b"\n" if ndjson else b",") if use_orjson else ("\n" if ndjson else ",")
+    buffer = []
+    first = True
+
+    def flush():
+        if ndjson:
+            return separator.join(buffer) + separator
+        return (empty if first else separator) + separator.join(buffer)
+
+    if not ndjson:
+        yield "["
+    for row in rows:
+        buffer.append(dumps(serialize(row), use_orjson))
+        if len(buffer) >= chunk_size:
+            yield flush()
+            buffer = []
+            first = False
+    if buffer:
+        yield flush()
+    if not ndjson:
+        yield "]"
+
+
+def stream_rows(rows, column_names, ndjson=False, chunk_size=DEFAULT_CHUNK_SIZE, iso_dates=True, use_orjson=False):
+    """
+    Streams result rows to the client without building the full list in memory
+    :param rows:         An iterable of result rows, e.g. session.query(table).yield_per(1000) (iterable)
+    :param column_names: The columns to include                                             (list)
+    :param ndjson:       Send newline-delimited json rather than a json array               (bool)
+    :param chunk_size:   Rows per chunk written to the client                               (int)
+    :param iso_dates:    Whether or not to convert dates/times to iso strings               (bool)
+    :param use_orjson:   Encode with orjson if it is installed                              (bool)
+    :return:             A streaming flask Response
+    """
+    serialize = row_serializer(column_names, iso_dates)
+    return Response(
+        stream_with_context(_chunks(rows, serialize, chunk_size, ndjson, use_orjson)),
+        mimetype=NDJSON_MIMETYPE if ndjson else JSON_MIMETYPE
+    )
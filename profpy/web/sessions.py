@@ -0,0 +1,284 @@
+"""
+Server-side sessions for SecureFlaskApp.
+
+Flask keeps the whole session (for SecureFlaskApp, the CAS user and all of their SAML attributes) in a signed cookie
+that is sent with every request. With a session store, the cookie only holds an opaque, random session id; the data is
+kept in a SQLite file or a database table, serialized as compact (and, when large, zlib-compressed) tagged json. A
+session is only read from the store when a route first touches it, and only written back when it changes.
+"""
+import os
+import time
+import zlib
+import secrets
+import sqlite3
+import logging
+import threading
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from sqlalchemy import MetaData, Table, Column, String, LargeBinary, Float, select, update, insert, delete
+from sqlalchemy.exc import IntegrityError
+
+DEFAULT_TABLE_NAME = "profpy_session"
+DEFAULT_CLEANUP_INTERVAL = 300
+_compress_threshold = 512
+_max_sid_length = 64
+_serializer = TaggedJSONSerializer()
+_logger = logging.getLogger("profpy.web.sessions")
+
+
+def dumps(data):
+    """
+    :param data: A session's contents (dict)
+    :return:     the compact serialized session (bytes)
+    """
+    raw = _serializer.dumps(data).encode("utf-8")
+    if len(raw) >= _compress_threshold:
+        return b"z" + zlib.compress(raw)
+    return b"j" + raw
+
+
+def loads(value):
+    """
+    :param value: A session serialized with dumps
+    :return:      its contents (dict)
+    """
+    value = bytes(value)
+    raw = zlib.decompress(value[1:]) if value[:1] == b"z" else value[1:]
+    return _serializer.loads(raw.decode("utf-8"))
+
+
+class SqliteSessionStore(object):
+    """
+    Keeps sessions in a SQLite file, which every worker process on the host can share
+    """
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: The SQLite database file (str)
+        """
+        self.path = path
+        self.__local = threading.local()
+        with self.__connection() as connection:
+            connection.execute("create table if not exists profpy_session "
+                               "(id text primary key, data blob not null, expires_at real not null)")
+            connection.execute("create index if not exists profpy_session_expires on profpy_session (expires_at)")
+
+    def __connection(self):
+        # one connection per thread, reopened in forked workers
+        connection = getattr(self.__local, "connection", None)
+        if connection is None or self.__local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("pragma journal_mode=wal")
+            connection.execute("pragma synchronous=normal")
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return connection
+
+    def get(self, sid):
+        row = self.__connection().execute("select data, expires_at from profpy_session where id = ?",
+                                          (sid,)).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def set(self, sid, data, expires_at):
+        self.__connection().execute("insert or replace into profpy_session (id, data, expires_at) values (?, ?, ?)",
+                                    (sid, data, expires_at))
+
+    def delete(self, sid):
+        self.__connection().execute("delete from profpy_session where id = ?", (sid,))
+
+    def cleanup(self, now):
+        return self.__connection().execute("delete from profpy_session where expires_at < ?", (now,)).rowcount
+
+
+class DatabaseSessionStore(object):
+    """
+    Keeps sessions in a database table, which every worker (and container) of the app can share
+    """
+    def __init__(self, engine, table_name=DEFAULT_TABLE_NAME, schema=None, create_table=True):
+        """
+        Constructor
+        :param engine:       A sqlalchemy engine
+        :param table_name:   The session table
+        :param schema:       The session table's schema
+        :param create_table: Whether or not to create the table if it doesn't exist
+        """
+        self.engine = engine
+        self.table = Table(
+            table_name, MetaData(schema=schema),
+            Column("id", String(_max_sid_length), primary_key=True),
+            Column("data", LargeBinary, nullable=False),
+            Column("expires_at", Float, nullable=False, index=True),
+        )
+        if create_table:
+            self.table.create(engine, checkfirst=True)
+
+    def get(self, sid):
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.data, self.table.c.expires_at).where(self.table.c.id == sid)
+            ).first()
+        return (row[0], row[1]) if row is not None else None
+
+    def set(self, sid, data, expires_at):
+        values = dict(data=data, expires_at=expires_at)
+        with self.engine.begin() as connection:
+            if connection.execute(update(self.table).where(self.table.c.id == sid).values(**values)).rowcount:
+                return
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(self.table).values(id=sid, **values))
+        except IntegrityError:
+            # another request inserted the session first
+            with self.engine.begin() as connection:
+                connection.execute(update(self.table).where(self.table.c.id == sid).values(**values))
+
+    def delete(self, sid):
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def cleanup(self, now):
+        with self.engine.begin() as connection:
+            return connection.execute(delete(self.table).where(self.table.c.expires_at < now)).rowcount
+
+
+class ServerSideSession(SessionMixin):
+    """
+    A session whose contents are only loaded from the store when it is first used
+    """
+    def __init__(self, sid=None, loader=None):
+        """
+        Constructor
+        :param sid:    The session id from the cookie, None for a new session
+        :param loader: Function returning the stored (contents, expires_at), or None if the session doesn't exist
+        """
+        self.sid = sid
+        self.previous_sid = None
+        self.expires_at = None
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.__loader = loader
+        self.__data = None if sid is not None else {}
+
+    @property
+    def loaded(self):
+        return self.__data is not None
+
+    def __contents(self):
+        self.accessed = True
+        if self.__data is None:
+            stored = self.__loader()
+            if stored is None:
+                # unknown or expired, never reuse an id the client chose
+                self.sid, self.new, self.__data = None, True, {}
+            else:
+                self.__data, self.expires_at = stored
+        return self.__data
+
+    def __getitem__(self, key):
+        return self.__contents()[key]
+
+    def __setitem__(self, key, value):
+        self.__contents()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.__contents()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.__contents())
+
+    def __len__(self):
+        return len(self.__contents())
+
+    def __contains__(self, key):
+        return key in self.__contents()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.__data if self.__data is not None else '(not loaded)'}>"
+
+    def regenerate(self):
+        """
+        Moves the session to a new id, e.g. after logging in, so an id known before then is useless
+        """
+        self.__contents()
+        if self.sid is not None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    A Flask session interface that keeps sessions in a store and only their id in the cookie
+    """
+    def __init__(self, store, cleanup_interval=DEFAULT_CLEANUP_INTERVAL):
+        """
+        Constructor
+        :param store:            A SqliteSessionStore or DatabaseSessionStore
+        :param cleanup_interval: Seconds between deleting expired sessions from the store
+        """
+        self.store = store
+        self.cleanup_interval = cleanup_interval
+        self.__cleaned_at = time.time()
+        self.__lock = threading.Lock()
+
+    def __load(self, sid):
+        stored = self.store.get(sid)
+        if stored is None or stored[1] < time.time():
+            return None
+        try:
+            return loads(stored[0]), stored[1]
+        except (ValueError, zlib.error):
+            return None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or len(sid) > _max_sid_length:
+            return ServerSideSession()
+        return ServerSideSession(sid, lambda: self.__load(sid))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.loaded:
+            return
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+        if not session:
+            if session.sid is not None and (session.modified or session.previous_sid is not None):
+                self.store.delete(session.sid)
+            if session.modified or session.previous_sid is not None:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        ttl = app.permanent_session_lifetime.total_seconds()
+        # unchanged sessions are only rewritten once half of their lifetime has passed, to extend it
+        if not session.modified and session.sid is not None and session.expires_at - now > ttl / 2:
+            return
+
+        new_sid = session.sid is None
+        if new_sid:
+            session.sid = secrets.token_urlsafe(32)
+        self.store.set(session.sid, dumps(dict(session)), now + ttl)
+        if new_sid or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        self.__cleanup(now)
+
+    def __cleanup(self, now):
+        with self.__lock:
+            if now - self.__cleaned_at < self.cleanup_interval:
+                return
+            self.__cleaned_at = now
+        try:
+            self.store.cleanup(now)
+        except Exception:
+            _logger.exception("Failed to delete expired sessions")
@@ -0,0 +1,59 @@
+"""
+Compiled template caching for SecureFlaskApp.
+
+Jinja compiles each template to python bytecode the first time it is rendered, in every worker process. A bytecode
+cache directory lets the workers (and restarts of the container) share the compiled templates, and
+precompile_templates fills it ahead of time, so no worker compiles templates at all. Compiled templates are executed
+as code, so the directory must belong to the user the app runs as, and nobody else can write to it; precompile
+templates as that user.
+"""
+import os
+import tempfile
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+from .utils import private_directory
+
+# per user, like jinja's own default, so another local user can't plant compiled templates in it
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 f"profpy_templates_{os.getuid() if hasattr(os, 'getuid') else 0}")
+
+
+def bytecode_cache(directory=DEFAULT_CACHE_DIR):
+    """
+    :param directory: The directory to keep compiled templates in, shared by every worker process. It is created
+                      with mode 0700, and a PermissionError is raised if it belongs to another user or other users
+                      can write to it
+    :return:          a jinja FileSystemBytecodeCache
+    """
+    return FileSystemBytecodeCache(private_directory(directory))
+
+
+def compile_templates(environment):
+    """
+    Compiles every template a jinja environment can load, storing them in its bytecode cache
+    :param environment: The jinja environment, e.g. app.jinja_env
+    :return:            the names of the templates compiled (list)
+    """
+    names = environment.list_templates()
+    for name in names:
+        environment.get_template(name)
+    return names
+
+
+def precompile_templates(template_folder, cache_dir=DEFAULT_CACHE_DIR, extensions=()):
+    """
+    Compiles every template in a folder into a bytecode cache without creating the app (and so without a database),
+    e.g. in a start-up script. Run it as the user the app runs as, since the cache directory must belong to that user.
+    A template with a syntax error raises a jinja TemplateSyntaxError.
+    :param template_folder: The app's template folder
+    :param cache_dir:       The app's template_cache_dir
+    :param extensions:      Any jinja extensions the app adds, e.g. "webassets.ext.jinja2.AssetsExtension" for
+                            Flask-Assets. They must match, since they change how templates compile
+    :return:                the names of the templates compiled (list)
+    """
+    # a bare Flask app's environment compiles templates the same way a SecureFlaskApp's does
+    environment = Flask(__name__, template_folder=os.path.abspath(template_folder)).jinja_env
+    for extension in extensions:
+        environment.add_extension(extension)
+    environment.bytecode_cache = bytecode_cache(cache_dir)
+    return compile_templates(environment)
@@ -0,0 +1,263 @@
+"""
+In-memory typeahead index for select2 lookups.
+
+A TypeaheadIndex loads an id and display text (plus any other searchable columns) for every row of a table or query,
+and answers searches from a word-prefix index, falling back to trigram matching for substrings and near misses. The
+database is only queried to refresh the index.
+"""
+import os
+import re
+import time
+import heapq
+import logging
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy import Table, select
+
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_PAGE_SIZE = 20
+
+_word_regex = re.compile(r"\w+")
+_logger = logging.getLogger("profpy.web.typeahead")
+
+
+def _normalize(value):
+    """
+    :return: lower-cased text with accents removed, so "José" matches "jose"
+    """
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _trigrams(normalized):
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Index(object):
+    """
+    An immutable snapshot of the index. Refreshes build a new one and swap it in, so searches never need a lock.
+    """
+    def __init__(self, entries):
+        """
+        :param entries: (id, text, normalized search text) tuples
+        """
+        self.entries = entries
+        postings = {}
+        trigrams = {}
+        for position, (_, _, search_text) in enumerate(entries):
+            for word in set(re.findall(_word_regex, search_text)):
+                postings.setdefault(word, []).append(position)
+            for trigram in _trigrams(search_text):
+                trigrams.setdefault(trigram, []).append(position)
+        self.words = sorted(postings)
+        self.postings = postings
+        self.trigrams = trigrams
+
+    def prefix(self, prefix):
+        """
+        :return: positions of the entries with a word starting with prefix (set)
+        """
+        matches = set()
+        for i in range(bisect_left(self.words, prefix), len(self.words)):
+            word = self.words[i]
+            if not word.startswith(prefix):
+                break
+            matches.update(self.postings[word])
+        return matches
+
+    def similar(self, normalized, threshold):
+        """
+        :return: {position: share of the search's trigrams the entry has} for entries at or above the threshold
+        """
+        wanted = _trigrams(normalized)
+        counts = Counter()
+        for trigram in wanted:
+            counts.update(self.trigrams.get(trigram, ()))
+        return {p: n / len(wanted) for p, n in counts.items() if n / len(wanted) >= threshold}
+
+
+class TypeaheadIndex(object):
+    """
+    Serves select2 searches for a table or query from memory
+    """
+    def __init__(self, engine, source, id_column, text_column, search_columns=None, modified_column=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, full_refresh_interval=None, background=True,
+                 page_size=DEFAULT_PAGE_SIZE, min_length=1, fuzzy_threshold=0.5):
+        """
+        Constructor
+        :param engine:                The sqlalchemy engine to load from
+        :param source:                A sqlalchemy Table, select() or ORM query
+        :param id_column:             The column sent back as the select2 option's id                         (str)
+        :param text_column:           The column shown as the option's text, or a function(row) building it  (str/callable)
+        :param search_columns:        The columns searches look in, defaults to the text column              (list)
+        :param modified_column:       A last-modified column, to refresh incrementally instead of reloading  (str)
+        :param refresh_interval:      Seconds between refreshes                                              (float)
+        :param full_refresh_interval: Seconds between full reloads when refreshing incrementally, which picks up
+                                      deleted rows                                                           (float)
+        :param background:            Refresh on a background thread rather than on the first stale search   (bool)
+        :param page_size:             Results per page                                                       (int)
+        :param min_length:            Shortest search term that is looked up                                 (int)
+        :param fuzzy_threshold:       Share of a term's trigrams an entry needs when no word starts with the term
+        """
+        if hasattr(source, "statement"):
+            source = source.statement
+        self.source = source if isinstance(source, Table) else source.subquery()
+        if search_columns is None:
+            if callable(text_column):
+                raise ValueError("search_columns are required when text_column is a function.")
+            search_columns = [text_column]
+        self.engine = engine
+        self.id_column = id_column
+        self.text_column = text_column
+        self.search_columns = list(search_columns)
+        self.modified_column = modified_column
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.background = background
+        self.page_size = page_size
+        self.min_length = min_length
+        self.fuzzy_threshold = fuzzy_threshold
+
+        self.__index = None
+        self.__rows = {}
+        self.__high_water = None
+        self.__refreshed_at = None
+        self.__full_at = 0.0
+        self.__lock = threading.Lock()
+        self.__thread_pid = None
+        self.__stop = threading.Event()
+
+    def __columns(self):
+        # a text function may use any column, otherwise only the needed ones are loaded
+        if callable(self.text_column):
+            return list(self.source.columns)
+        names = {self.id_column, self.text_column, *self.search_columns}
+        if self.modified_column:
+            names.add(self.modified_column)
+        return [self.source.c[n] for n in names]
+
+    def refresh(self, full=False):
+        """
+        Reloads the index, or just the rows modified since the last refresh when a modified_column is configured
+        :param full: Reload every row even if the index can be refreshed incrementally
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if not self.modified_column or self.__high_water is None:
+                full = True
+            elif self.full_refresh_interval and now - self.__full_at >= self.full_refresh_interval:
+                full = True
+
+            statement = select(*self.__columns())
+            if not full:
+                statement = statement.where(self.source.c[self.modified_column] >= self.__high_water)
+            with self.engine.connect() as connection:
+                rows = connection.execute(statement).mappings().all()
+
+            loaded = {} if full else dict(self.__rows)
+            for row in rows:
+                text = self.text_column(row) if callable(self.text_column) else row[self.text_column]
+                search_text = " ".join(re.findall(_word_regex, _normalize(
+                    " ".join(str(row[c]) for c in self.search_columns if row[c] is not None)
+                )))
+                loaded[row[self.id_column]] = (row[self.id_column], "" if text is None else str(text), search_text)
+            if self.modified_column:
+                modified = [r[self.modified_column] for r in rows if r[self.modified_column] is not None]
+                if modified:
+                    newest = max(modified)
+                    self.__high_water = newest if full or self.__high_water is None else max(self.__high_water, newest)
+
+            self.__rows = loaded
+            self.__index = _Index(list(loaded.values()))
+            self.__refreshed_at = now
+            if full:
+                self.__full_at = now
+        _logger.debug(f"Refreshed typeahead index ({'full' if full else 'incremental'}, {len(rows)} rows)")
+
+    def start(self):
+        """
+        Loads the index and starts the background refresher (if enabled). Called automatically on the first search.
+        """
+        if self.__index is None:
+            self.refresh(full=True)
+        # threads don't survive a fork, so start one per process (e.g. per gunicorn worker)
+        if self.background and self.__thread_pid != os.getpid():
+            self.__stop.clear()
+            self.__thread_pid = os.getpid()
+            threading.Thread(target=self.__refresh_loop, name="profpy-typeahead", daemon=True).start()
+
+    def stop(self):
+        """
+        Stops the background refresher
+        """
+        self.__stop.set()
+
+    def __refresh_loop(self):
+        while not self.__stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                _logger.exception("Failed to refresh typeahead index")
+
+    def search(self, term, page=1):
+        """
+        Ranks the entries matching a search term: exact matches first, then entries starting with the term, then
+        entries with a word starting with each word of the term, then trigram (substring/near miss) matches
+        :param term: The search term
+        :param page: The 1-based page of results
+        :return:     (list of (id, text) tuples, whether or not there are more pages)
+        """
+        if self.__index is None or (self.background and self.__thread_pid != os.getpid()):
+            self.start()
+        elif not self.background and time.monotonic() - self.__refreshed_at >= self.refresh_interval:
+            self.refresh()
+        index = self.__index
+
+        normalized = " ".join(re.findall(_word_regex, _normalize(term or "")))
+        if len(normalized) < self.min_length:
+            return [], False
+        words = normalized.split()
+
+        candidates = None
+        for word in words:
+            matches = index.prefix(word)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                break
+
+        if candidates:
+            def rank(position):
+                _, text, search_text = index.entries[position]
+                if search_text == normalized:
+                    tier = 0
+                elif search_text.startswith(normalized):
+                    tier = 1
+                else:
+                    tier = 2
+                return tier, 0.0, len(text), text
+            ranked = candidates
+        else:
+            similarity = index.similar(normalized, self.fuzzy_threshold)
+
+            def rank(position):
+                text = index.entries[position][1]
+                return 3, -similarity[position], len(text), text
+            ranked = similarity
+
+        page = max(int(page), 1)
+        wanted = page * self.page_size
+        best = heapq.nsmallest(wanted + 1, ranked, key=rank)
+        results = [index.entries[p][:2] for p in best[wanted - self.page_size:wanted]]
+        return results, len(best) > wanted
+
+    def select2(self, term, page=1):
+        """
+        :param term: The search term
+        :param page: The 1-based page of results
+        :return:     A select2 ajax response (dict with results and pagination)
+        """
+        results, more = self.search(term, page)
+        return dict(results=[dict(id=i, text=text) for i, text in results], pagination=dict(more=more))
@@ -0,0 +1,72 @@
+"""
+Helpers shared by the SecureFlaskApp modules
+"""
+import os
+import stat
+
+
+def private_directory(path):
+    """
+    Creates a directory only the current user can use, or checks that an existing one can't be written to by anyone
+    else, since the files in it are trusted
+    :param path: The directory
+    :return:     the directory
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return path
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} must be a directory owned by the current user.")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} can be written to by other users, so its files can't be trusted. Remove it or "
+                              f"make it private (chmod 700).")
+    return path
+
+
+def trusted_file(path):
+    """
+    Checks that a file (e.g. a pickle, which runs code when loaded) can only have been written by the current user or
+    root: it must be owned by one of them, and neither it nor its directory can be writable by other users (a sticky
+    directory such as /tmp is fine, since other users can't replace files in it)
+    :param path: The file
+    :return:     the file
+    """
+    if not hasattr(os, "getuid"):
+        return path
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid not in (os.getuid(), 0):
+        raise PermissionError(f"{path} must be a file owned by the current user or root.")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} can be written to by other users, so it can't be trusted (chmod 644).")
+    directory = os.stat(os.path.dirname(os.path.abspath(path)))
+    if directory.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not directory.st_mode & stat.S_ISVTX:
+        raise PermissionError(f"The directory of {path} can be written to by other users, so the file can't be "
+                              f"trusted.")
+    return path
+
+
+def percentile(ordered, percent):
+    """
+    :param ordered: sorted values
+    :param percent: the percentile, 0-100
+    :return:        the nearest-rank percentile, None without values
+    """
+    if not ordered:
+        return None
+    rank = max(int(round(percent / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def pid_alive(pid):
+    """
+    :param pid: A process id on this host
+    :return:    whether or not the process is still running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
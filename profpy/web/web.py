@@ -5,14 +5,46 @@ Easy-to-use Flask extension for CAS and role-based security with database-backed
 """
 import os
 import re
+import time as _time
+import pickle
+import hmac
 import functools
+import itertools
+import threading
 import caslib
-from flask import Flask, jsonify, session, request, redirect, url_for, render_template
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, jsonify, session, request, redirect, url_for, render_template, has_request_context, \
+    has_app_context, g, Response, copy_current_request_context, send_from_directory, \
+    send_file
 from urllib.parse import quote
 from uuid import uuid1
 from sqlalchemy import MetaData, Table
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import scoped_session, sessionmaker
-from datetime import datetime, date, time, timedelta
+from sqlalchemy.pool import QueuePool
+from datetime import datetime, timedelta, timezone
+from profpy.db import execute_query
+from profpy.db.general.routing import ReplicaRouter
+from .cache import TTLCache
+from . import serialization
+from .serialization import row_serializer, stream_rows
+from .datatables import DataTable, DEFAULT_COUNT_TTL, DEFAULT_MAX_LENGTH
+from .typeahead import TypeaheadIndex
+from .cas import CasValidator
+from .metrics import MetricsRegistry, RequestMetrics, METRICS_CONTENT_TYPE, instrument_engine, record_query, \
+    record_auth
+from .queries import QueryProfiler, DEFAULT_N_PLUS_ONE_THRESHOLD
+from .response_cache import ResponseCache, MemoryBackend, DiskBackend, DEFAULT_CACHE_SIZE, CACHE_HEADER
+from .conditional import add_json_etag, version_statement, read_version, not_modified
+from .compression import Compressor, send_static, DEFAULT_MIN_SIZE as DEFAULT_COMPRESS_MIN_SIZE, \
+    DEFAULT_LEVEL as DEFAULT_COMPRESS_LEVEL
+from .assets import StaticAssets, IMMUTABLE_MAX_AGE
+from .sessions import ServerSideSessionInterface
+from .jobs import JobRunner, JobQueueFull, FINISHED, DEFAULT_WORKERS as DEFAULT_JOB_WORKERS, \
+    DEFAULT_TTL as DEFAULT_JOB_TTL, DEFAULT_DIRECTORY as DEFAULT_JOB_DIR
+from .templates import bytecode_cache, compile_templates, DEFAULT_CACHE_DIR as DEFAULT_TEMPLATE_CACHE_DIR
+from .utils import trusted_file
+from .health import HealthMonitor, DEFAULT_INTERVAL as DEFAULT_HEALTH_INTERVAL, DEFAULT_TIMEOUT as DEFAULT_HEALTH_TIMEOUT
 
 
 # some constants
@@ -22,27 +54,39 @@ _schema_var = "security_schema"
 _role_var = "security_role_table"
 _user_var = "security_user_table"
 _user_role_var = "security_user_role_table"
+_read_only_methods = ("GET", "HEAD", "OPTIONS")
+_snapshot_var = "metadata_snapshot"
+_dev_instances = ("PPRD", "DEV")
+REFLECT_EAGER = "eager"
+REFLECT_LAZY = "lazy"
+REFLECT_PARALLEL = "parallel"
+_reflection_modes = (REFLECT_EAGER, REFLECT_LAZY, REFLECT_PARALLEL)
+_session_scope_attribute = "_profpy_db_scope"
+_session_scopes = itertools.count()
 
 
 class CasUser(object):
     """
     Helper class that simply makes accessing CAS attributes more straight forward
     """
-    def __init__(self, cas_user, cas_attributes, db_session=None, user_table=None):
+    def __init__(self, cas_user, cas_attributes, db_session=None, user_table=None, db_fields=None):
         """
         Constructor
         :param cas_user:       A validated CAS user
         :param cas_attributes: A validated CAS user's attribute dictionary
+        :param db_session:     A session used to look up the user's fields in the user table
+        :param user_table:     The security user table
+        :param db_fields:      Already looked up user table fields, skips the database lookup
         """
 
         self.__attributes = cas_attributes
         self.__user = cas_user
         self.roles = []
 
-        if db_session is not None and user_table is not None:
-            db_user = db_session.query(user_table).filter_by(username=self.__user).first()
-            for field in db_user.keys():
-                setattr(self, field, getattr(db_user, field))
+        if db_fields is None and db_session is not None and user_table is not None:
+            db_fields = _get_user_fields(db_session, user_table, self.__user)
+        for field, value in (db_fields or {}).items():
+            setattr(self, field, value)
 
     def __getattr__(self, item):
         if item == "user":
@@ -68,11 +112,45 @@ class CasUser(object):
 
 class Schema(object):
     """
-    Helper class for simply storing Table objects with their appropriate schema
+    Helper class for simply storing Table objects with their appropriate schema. When created with a loader, tables
+    are only reflected the first time they are accessed.
     """
-    def __init__(self, in_tables):
-        for table_str, table_obj in in_tables.items():
+    def __init__(self, in_tables=None, loader=None, table_names=None):
+        """
+        Constructor
+        :param in_tables:   Already reflected tables, keyed by name           (dict)
+        :param loader:      Function(table name) returning a reflected table  (callable)
+        :param table_names: Names of the tables the loader can reflect       (list)
+        """
+        for table_str, table_obj in (in_tables or {}).items():
+            setattr(self, table_obj.name, table_obj)
+        self.__loader = loader
+        self.__lazy_names = {t.lower() for t in table_names or []}
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, item):
+        # only called for tables that haven't been reflected yet
+        if item.startswith("_") or item.lower() not in self.__lazy_names:
+            raise AttributeError(item)
+        with self.__lock:
+            if item in self.__dict__:
+                return self.__dict__[item]
+            table_obj = self.__loader(item.lower())
+            if table_obj is None:
+                raise AttributeError(f"Table {item} could not be reflected.")
             setattr(self, table_obj.name, table_obj)
+            if table_obj.name != item:
+                setattr(self, item, table_obj)
+            return table_obj
+
+    def _all_tables(self):
+        """
+        :return: Every table in the schema, reflecting any that haven't been yet (list). Underscored so it can't
+                 collide with a table's name
+        """
+        for name in self.__lazy_names:
+            getattr(self, name)
+        return [v for v in vars(self).values() if isinstance(v, Table)]
 
 
 class SecureFlaskApp(Flask):
@@ -83,7 +161,21 @@ class SecureFlaskApp(Flask):
                  cas_url=os.environ.get(_default_cas_url_var), logout_endpoint="logout",
                  post_logout_view_function=None, custom_403_template=None, security_schema=os.environ.get(_schema_var),
                  role_table=os.environ.get(_role_var), user_table=os.environ.get(_user_var),
-                 user_role_table=os.environ.get(_user_role_var), app_url=os.getenv("app_url"), app_port=os.getenv("app_port"), dev_server="http://asa-dev", **configs):
+                 user_role_table=os.environ.get(_user_role_var), app_url=os.getenv("app_url"), app_port=os.getenv("app_port"), dev_server="http://asa-dev",
+                 replica_engines=None, max_replica_lag=None, auth_cache_ttl=0, auth_cache_size=1024,
+                 worker_threads=os.getenv("worker_threads"), reflection=REFLECT_EAGER,
+                 reflection_workers=8, metadata_snapshot=os.getenv(_snapshot_var),
+                 health_interval=DEFAULT_HEALTH_INTERVAL, health_timeout=DEFAULT_HEALTH_TIMEOUT, health_check_cas=False,
+                 health_probes=False,
+                 cas_validator=None, metrics_endpoint=None, metrics_dir=os.getenv("metrics_dir"),
+                 query_profiling=os.getenv("query_profiling", "").lower() in ("1", "true", "yes"),
+                 n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD, response_cache_size=DEFAULT_CACHE_SIZE,
+                 response_cache_dir=os.getenv("response_cache_dir"), json_etags=True, compress=True,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE, compress_level=DEFAULT_COMPRESS_LEVEL,
+                 static_fingerprints=True, asset_manifest=os.getenv("asset_manifest"), session_store=None,
+                 jobs_endpoint=None, job_dir=os.getenv("job_dir"), job_workers=DEFAULT_JOB_WORKERS, job_ttl=DEFAULT_JOB_TTL,
+                 job_processes=False, template_reload=None,
+                 template_cache_dir=os.getenv("template_cache_dir", DEFAULT_TEMPLATE_CACHE_DIR), **configs):
         """
         Constructor
         :param context:                    WSGI object name (__name__)
@@ -98,8 +190,55 @@ class SecureFlaskApp(Flask):
         :param role_table                  Table containing security roles
         :param user_table                  Table containing security users
         :param user_role_table             Crosswalk table for security roles and users
+        :param replica_engines:            Read-only sqlalchemy engines (e.g. a Data Guard standby) for GET requests
+        :param max_replica_lag:            Read from the primary when a replica is more than this many seconds behind
+        :param auth_cache_ttl:             Seconds to cache a user's fields/roles, 0 (the default) to look them up on
+                                           every request. invalidate_authorization only reaches the current process
+        :param auth_cache_size:            The most users to keep in the in-process authorization cache
+        :param worker_threads:             Threads per worker process, the engines' pools are enlarged to at least this
+        :param reflection:                 "eager", "lazy" (on first access) or "parallel" (on a thread pool)
+        :param reflection_workers:         Threads to use for parallel reflection
+        :param metadata_snapshot:          A file from save_metadata_snapshot to load tables from instead of the db
+        :param health_interval:            Seconds between the background health probes
+        :param health_timeout:             Seconds before a health probe counts as failed
+        :param health_check_cas:           Whether or not the health probes also check the CAS server
+        :param health_probes:              Serve /health/live and /health/ready
+        :param cas_validator:              A CasValidator for CAS tickets, e.g. with custom timeouts. One is created
+                                           for the cas_url by default
+        :param metrics_endpoint:           The endpoint to serve Prometheus metrics at (e.g. "metrics"), None (the
+                                           default) for no metrics
+        :param metrics_dir:                A directory shared by the gunicorn workers, so the metrics cover all of them
+        :param query_profiling:            Count each request's statements by fingerprint and flag probable N+1s in the
+                                           response headers and log (for development/profiling)
+        :param n_plus_one_threshold:       Executions of one statement fingerprint in a request to flag as an N+1
+        :param response_cache_size:        The most responses @app.cached keeps
+        :param response_cache_dir:         Keep @app.cached responses in this directory (shared by the workers) rather
+                                           than in memory. Only the current user may be able to write to it
+        :param json_etags:                 Add ETags to JSON responses and answer matching If-None-Match with a 304
+        :param compress:                   Gzip (or brotli) compressible responses, and serve precompressed static files
+        :param compress_min_size:          Smallest response body to compress, in bytes
+        :param compress_level:             gzip compression level, 1 (fastest) to 9 (smallest)
+        :param static_fingerprints:        Give static files content-hashed urls, cached by browsers for a year
+        :param asset_manifest:             A manifest from profpy.web.assets.fingerprint_static, defaults to the one in
+                                           the static folder
+        :param session_store:              A SqliteSessionStore or DatabaseSessionStore (profpy.web.sessions) to keep
+                                           sessions in, leaving only their id in the cookie
+        :param jobs_endpoint:              The endpoint serving background job statuses/results, e.g. "jobs". None
+                                           (the default) turns jobs off
+        :param job_dir:                    A directory shared by the workers for job statuses and results. Only the
+                                           user the app runs as can write to it, a private temp directory by default
+        :param job_workers:                Background jobs to run at once in each worker process
+        :param job_ttl:                    Seconds to keep a job's status and result after it ends
+        :param job_processes:              Run background jobs in child processes rather than threads
+        :param template_reload:            Check templates for changes on every render. By default, only on a dev
+                                           instance (the instance environment variable is PPRD/DEV, or isn't set)
+        :param template_cache_dir:         A directory for compiled templates, shared by the workers. Only the user
+                                           the app runs as can write to it, a private temp directory by default.
+                                           None to turn the cache off
         :param configs                     Any additional Flask configs to set/override.
         """
+        # rules of the optional built-in routes, which the app's own routes mustn't shadow, see add_url_rule
+        self.__builtin_rules = {}
         super().__init__(context)
         secret_key = os.getenv("secret_key")
         if cas_url is None:
@@ -124,20 +263,89 @@ class SecureFlaskApp(Flask):
                 raise ValueError("Invalid table entered. Must be a schema-qualified name: <schema>.<table>")
             schema_to_table = _explode_full_table_names(in_tables)
 
-        # connect to db
-        self.db = scoped_session(sessionmaker(bind=engine))()
+        # connect to db, reads from GET requests go to a replica if any were given. app.db is a registry that hands
+        # each app context (request) its own session, which is removed when the context is torn down
+        self.engine = engine
+        self.router = None
+        if replica_engines:
+            self.router = ReplicaRouter(engine, replica_engines, max_lag_seconds=max_replica_lag)
+            session_factory = self.router.sessionmaker(read_only=_is_read_only_request)
+        else:
+            session_factory = sessionmaker(bind=engine)
+        self.db = scoped_session(session_factory, scopefunc=_session_scope)
+        self.teardown_appcontext(self.__remove_db_session)
+        if worker_threads:
+            for sized_engine in [engine] + list(replica_engines or []):
+                _size_pool(self, sized_engine, int(worker_threads))
         self.__service = os.getenv("service")
         self.__custom_403 = custom_403_template
 
-        # bake in a healthcheck route
+        # server-side sessions, see profpy.web.sessions
+        if session_store is not None:
+            self.session_interface = ServerSideSessionInterface(session_store)
+
+        # compress responses. registered first, so it runs after every other after_request function
+        self.__compress = compress
+        if compress:
+            Compressor(min_size=compress_min_size, level=compress_level).init_app(self)
+
+        # content-hashed static file urls, see send_static_file
+        self.static_assets = None
+        if static_fingerprints and self.has_static_folder:
+            self.static_assets = StaticAssets(self.static_folder, asset_manifest)
+            self.url_defaults(self.__fingerprint_static_url)
+
+        # bake in healthcheck routes, answered from probes run on a background thread
+        self.health = HealthMonitor(engine, cas_url=cas_url.rstrip("/") if health_check_cas else None,
+                                    interval=health_interval, timeout=health_timeout)
+        # start probing as soon as each worker process serves anything, rather than on the first health request
+        self.before_request(self.__start_health)
         for rule in ["healthcheck", "health", "ping"]:
             self.add_url_rule(f"/{rule}", view_func=self.__healthcheck)
+        if health_probes:
+            self.__add_builtin_rule("/health/live", "health_probes", view_func=self.__liveness)
+            self.__add_builtin_rule("/health/ready", "health_probes", view_func=self.__readiness)
+
+        # request, database and auth metrics, served in the Prometheus format
+        self.metrics = None
+        if metrics_endpoint:
+            self.metrics = MetricsRegistry(directory=metrics_dir)
+            RequestMetrics(name, self.metrics).init_app(self)
+            self.__add_builtin_rule(f"/{metrics_endpoint}", "metrics_endpoint", view_func=self.__metrics)
+        if query_profiling:
+            QueryProfiler(n_plus_one_threshold).init_app(self)
+        if metrics_endpoint or query_profiling:
+            for metered_engine in [engine] + list(replica_engines or []):
+                instrument_engine(metered_engine)
         self.add_url_rule(f"/{logout_endpoint}", view_func=self.__logout)
 
+        # background jobs, see submit_job
+        self.jobs = None
+        if jobs_endpoint:
+            self.jobs = JobRunner(job_dir or DEFAULT_JOB_DIR, workers=job_workers, ttl=job_ttl, processes=job_processes,
+                                  context=self.app_context)
+            self.__add_builtin_rule(f"/{jobs_endpoint}/<job_id>", "jobs_endpoint", "job_status",
+                                    self.secured()(self.__job_status))
+            self.__add_builtin_rule(f"/{jobs_endpoint}/<job_id>/result", "jobs_endpoint", "job_result",
+                                    self.secured()(self.__job_result))
+            self.register_error_handler(JobQueueFull, self.__job_queue_full)
+
         # create table object attributes of the app (e.g. app.query(app.schema.table).all())
+        if reflection not in _reflection_modes:
+            raise ValueError(f"Invalid reflection mode: {reflection}. Must be one of: {', '.join(_reflection_modes)}")
+        reflector = _TableReflector(engine, metadata_snapshot,
+                                    workers=reflection_workers if reflection != REFLECT_EAGER else 1)
+        self.schemas = []
         if in_tables:
-            for schema, tables in schema_to_table.items():
-                setattr(self, schema, Schema(_create_table_objects(engine, schema, tables)))
+            if reflection == REFLECT_LAZY:
+                for schema, tables in schema_to_table.items():
+                    loader = functools.partial(reflector.reflect_one, schema)
+                    setattr(self, schema, Schema(loader=loader, table_names=tables))
+            else:
+                reflected = reflector.reflect(schema_to_table)
+                for schema, tables in schema_to_table.items():
+                    setattr(self, schema, Schema(reflected[schema]))
+            self.schemas = list(schema_to_table)
 
         # configure the optional role-based security
         self.roles = None
@@ -145,8 +353,22 @@ class SecureFlaskApp(Flask):
         self.user_roles = None
         self.__after_logout = post_logout_view_function
         self.__cas_server_url = cas_url
+        self.cas_validator = cas_validator or CasValidator(cas_url)
         self.__role_security_configured = False
 
+        # conditional GETs for JSON responses, see also conditional
+        if json_etags:
+            self.after_request(add_json_etag)
+
+        # response caching, see cached
+        self.response_cache = ResponseCache(
+            DiskBackend(response_cache_dir, max_size=response_cache_size) if response_cache_dir
+            else MemoryBackend(max_size=response_cache_size)
+        )
+
+        # authorization caching, see secured
+        self.__auth_cache = TTLCache(max_size=auth_cache_size, ttl=auth_cache_ttl) if auth_cache_ttl else None
+
         required_security = [role_table, user_table, user_role_table, security_schema]
 
         # set up role-based security if the user configured it
@@ -155,9 +377,20 @@ class SecureFlaskApp(Flask):
             # if valid, create sqlalchemy table objects for role security
             if all(required_security):
                 # shown above, the order of the the security config list is role, user, user_role (0, 1, 2 indexes)
-                self.roles = _get_single_table(engine, security_schema, role_table)
-                self.users = _get_single_table(engine, security_schema, user_table)
-                self.user_roles = _get_single_table(engine, security_schema, user_role_table)
+                try:
+                    security_tables = reflector.reflect(
+                        {security_schema: [role_table, user_table, user_role_table]}
+                    )[security_schema]
+                except InvalidRequestError as e:
+                    raise ValueError(f"Security tables could not be reflected from {security_schema}: {e}") from e
+                self.roles = security_tables.get(_table_key(security_schema, role_table))
+                self.users = security_tables.get(_table_key(security_schema, user_table))
+                self.user_roles = security_tables.get(_table_key(security_schema, user_role_table))
+                for table_name, table_obj in ((role_table, self.roles), (user_table, self.users),
+                                              (user_role_table, self.user_roles)):
+                    if table_obj is None:
+                        raise ValueError(f"Security table {security_schema}.{table_name} does not exist, or the "
+                                         f"database user can't see it.")
 
                 # validate the required columns
                 missing = {}
@@ -193,26 +426,302 @@ class SecureFlaskApp(Flask):
         self.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
         self.secret_key = secret_key
         self.config["SECRET_KEY"] = self.secret_key
-        self.config["TEMPLATES_AUTO_RELOAD"] = True
+        if template_reload is None:
+            instance = os.getenv("instance")
+            template_reload = not instance or instance.upper() in _dev_instances
+        self.config["TEMPLATES_AUTO_RELOAD"] = template_reload
         self.config['PERMANENT_SESSION_LIFETIME'] =  timedelta(days=1)
-        self.jinja_env.auto_reload = True
 
         # set any user-provided configs
         for key, value in configs.items():
             self.config[key] = value
+        self.jinja_env.auto_reload = self.config["TEMPLATES_AUTO_RELOAD"]
+        if template_cache_dir:
+            try:
+                self.jinja_env.bytecode_cache = bytecode_cache(template_cache_dir)
+            except OSError as e:
+                self.logger.warning(f"Template cache directory {template_cache_dir} unavailable: {e}")
+
+    def __fingerprint_static_url(self, endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = self.static_assets.url_name(values["filename"])
+
+    def send_static_file(self, filename):
+        """
+        Serves a static file, or its precompressed .br/.gz copy to clients that accept it. See
+        profpy.web.compression.precompress_static. Fingerprinted urls are cached by browsers for a year.
+        :param filename: The file's path within the static folder
+        :return:         a Flask response
+        """
+        if not self.has_static_folder:
+            return super().send_static_file(filename)
+        immutable = False
+        if self.static_assets is not None:
+            filename, immutable = self.static_assets.resolve(filename)
+        max_age = IMMUTABLE_MAX_AGE if immutable else self.get_send_file_max_age(filename)
+        if self.__compress:
+            response = send_static(self.static_folder, filename, max_age=max_age)
+        else:
+            response = send_from_directory(self.static_folder, filename, max_age=max_age)
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    def precompile_templates(self):
+        """
+        Compiles every template into the template cache, so no request has to. See also
+        profpy.web.templates.precompile_templates, which does this at build time without creating the app
+        :return: the names of the templates compiled (list)
+        """
+        return compile_templates(self.jinja_env)
+
+    def save_metadata_snapshot(self, path):
+        """
+        Pickles every table the app uses (reflecting any lazy ones) so later starts can skip reflection, see the
+        metadata_snapshot constructor argument
+        :param path: The snapshot file to write
+        """
+        tables = [t for t in (self.roles, self.users, self.user_roles) if t is not None]
+        for schema in self.schemas:
+            tables.extend(getattr(self, schema)._all_tables())
+        _write_snapshot(path, tables)
+
+    def __add_builtin_rule(self, rule, option, endpoint=None, view_func=None):
+        """
+        Adds one of the optional built-in routes, making sure no route of the app already uses its url
+        :param rule:   The url rule
+        :param option: The constructor argument that turns the route off or moves it, for the error message
+        """
+        key = _rule_key(rule)
+        for existing in self.url_map.iter_rules():
+            if _rule_key(existing.rule) == key:
+                raise ValueError(f"{rule} is served by SecureFlaskApp, but the app already has a route at "
+                                 f"{existing.rule} ({existing.endpoint}). Set {option} to turn it off or move it.")
+        self.add_url_rule(rule, endpoint, view_func)
+        self.__builtin_rules[key] = (rule, option)
+
+    def add_url_rule(self, rule, endpoint=None, view_func=None, provide_automatic_options=None, **options):
+        """
+        Flask's add_url_rule, raising a ValueError if the rule would be shadowed by one of the built-in routes
+        """
+        builtin = self.__builtin_rules.get(_rule_key(rule))
+        if builtin is not None:
+            raise ValueError(f"{rule} is already served by SecureFlaskApp at {builtin[0]}. Set {builtin[1]} to turn "
+                             f"the built-in route off or move it.")
+        return super().add_url_rule(rule, endpoint, view_func, provide_automatic_options, **options)
+
+    def __remove_db_session(self, response_or_error):
+        """
+        Closes the current app context's database session, returning its connection to the pool
+        """
+        self.db.remove()
+        return response_or_error
+
+    def __start_health(self):
+        """
+        Starts the health prober in this process if it isn't running yet, without waiting for its first probe
+        """
+        self.health.start()
 
     def __healthcheck(self):
         """
         Baked in app health check
         :return: a json response
         """
-        try:
-            self.db.execute("select 1 from dual")
+        status = self.health.status()
+        if status["healthy"]:
             response = jsonify(dict(message="Healthy", instance=self.__service, application=self.application_name, status=200)), 200
-        except Exception as e:
-            response = jsonify(dict(message=f"Unhealthy: {str(e)}", instance=self.__service, application=self.application_name, status=500)), 500
+        else:
+            errors = "; ".join(f"{name}: {c.get('error')}" for name, c in status["checks"].items() if not c["healthy"])
+            response = jsonify(dict(message=f"Unhealthy: {errors}", instance=self.__service, application=self.application_name, status=500)), 500
         return response
 
+    def __liveness(self):
+        """
+        Liveness check, the process is up and answering requests whatever the state of the database. It never waits
+        on a probe, so it answers within the docker HEALTHCHECK timeout even while the database hangs
+        :return: a json response with the recent probe latencies, if the background prober has any
+        """
+        return jsonify(dict(status="alive", instance=self.__service, application=self.application_name,
+                            uptime=round(self.health.uptime, 1), checks=self.health.status()["checks"])), 200
+
+    def __readiness(self):
+        """
+        Readiness check, the database (and CAS, if probed) answered the latest probe in time. Until the first probe
+        finishes it is "starting"
+        :return: a json response with the recent probe latencies
+        """
+        status = self.health.status()
+        code = 200 if status["healthy"] else 503
+        label = "ready" if status["healthy"] else "starting" if status["starting"] else "not ready"
+        return jsonify(dict(status=label, instance=self.__service,
+                            application=self.application_name, checks=status["checks"])), code
+
+    def __metrics(self):
+        """
+        Prometheus metrics, protected by http basic auth with the metrics_user/metrics_password (or
+        http_basic_auth_user/http_basic_auth_password) environment variables
+        :return: the metrics in the Prometheus text format
+        """
+        user = os.getenv("metrics_user", os.getenv("http_basic_auth_user"))
+        password = os.getenv("metrics_password", os.getenv("http_basic_auth_password"))
+        if not user or not password:
+            return jsonify(dict(message="Metrics credentials not configured.")), 403
+        credentials = request.authorization
+        if not credentials:
+            return jsonify(dict(message="Missing credentials.")), 401, {"WWW-Authenticate": 'Basic realm="metrics"'}
+        if not (hmac.compare_digest(str(credentials.username), user)
+                and hmac.compare_digest(str(credentials.password), password)):
+            return jsonify(dict(message="Invalid credentials")), 403
+        return Response(self.metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+    def execute_query(self, sql, params=None, read_only=None, **kwargs):
+        """
+        Runs profpy.db.execute_query on a connection from the app's engine. When replicas are configured, queries made
+        while handling GET requests are sent to a replica, unless the request has already written through app.db.
+        :param sql:       a sql query
+        :param params:    parameters for the query
+        :param read_only: force (or prevent) replica routing, defaults to whether the current request is a read
+        :param kwargs:    any additional execute_query arguments (use_generator isn't supported here)
+        :return:          a list of dictionaries for the results of the query
+        """
+        if read_only is None:
+            read_only = _is_read_only_request() and not (self.db.registry.has() and getattr(self.db(), "wrote", False))
+        connection = self.router.raw_connection(read_only) if self.router else self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            started = _time.perf_counter()
+            try:
+                return execute_query(cursor, sql, params, **dict(kwargs, use_generator=False))
+            finally:
+                # raw DBAPI cursors bypass the engine events, so count the query here
+                record_query(_time.perf_counter() - started, sql)
+                cursor.close()
+        finally:
+            connection.close()
+
+    def datatable(self, rule, source, columns=None, searchable=None, endpoint=None, count_ttl=DEFAULT_COUNT_TTL,
+                  max_length=DEFAULT_MAX_LENGTH, secured=True, any_roles=None, not_roles=None, all_roles=None,
+                  use_orjson=False):
+        """
+        Registers an endpoint that feeds a DataTables table using server-side processing, so paging, sorting,
+        searching and counting happen in the database instead of the browser
+        :param rule:       The url rule, e.g. "/data/people"
+        :param source:     A sqlalchemy Table (e.g. app.general.people), select() or ORM query
+        :param columns:    The columns to send to the browser, defaults to every column
+        :param searchable: The columns the search box looks in, defaults to the string columns
+        :param endpoint:   The endpoint name, defaults to one derived from the rule
+        :param count_ttl:  Seconds to cache the total and filtered row counts, 0 to count on every request
+        :param max_length: The most rows a single request can ask for
+        :param secured:    Whether or not to CAS-protect the endpoint (the role arguments work like they do in secured)
+        :param use_orjson: Encode the responses with orjson, if it is installed
+        :return:           The DataTable, e.g. to call invalidate_counts() after changing rows
+        """
+        data_table = DataTable(source, columns=columns, searchable=searchable, count_ttl=count_ttl,
+                               max_length=max_length)
+
+        def view():
+            args = request.form if request.method == "POST" else request.args
+            return Response(serialization.dumps(data_table.respond(self.db, args), use_orjson),
+                            mimetype=serialization.JSON_MIMETYPE)
+
+        if secured:
+            view = self.secured(any_roles=any_roles, not_roles=not_roles, all_roles=all_roles)(view)
+        endpoint = endpoint or "datatable" + re.sub(r"\W", "_", rule)
+        self.add_url_rule(rule, endpoint=endpoint, view_func=view, methods=["GET", "POST"])
+        return data_table
+
+    def typeahead(self, rule, source, id_column, text_column, endpoint=None, secured=True, any_roles=None,
+                  not_roles=None, all_roles=None, use_orjson=False, **index_options):
+        """
+        Registers a select2 ajax endpoint answered from an in-memory TypeaheadIndex, rather than running a like query
+        on every keystroke. The endpoint reads the search from the "term" (or "q") and "page" query string values.
+        :param rule:          The url rule, e.g. "/lookup/people"
+        :param source:        A sqlalchemy Table (e.g. app.general.people), select() or ORM query
+        :param id_column:     The column used as each option's id
+        :param text_column:   The column shown as each option's text, or a function(row) building it
+        :param endpoint:      The endpoint name, defaults to one derived from the rule
+        :param secured:       Whether or not to CAS-protect the endpoint (the role arguments work like they do in secured)
+        :param use_orjson:    Encode the responses with orjson, if it is installed
+        :param index_options: Any additional TypeaheadIndex arguments (search_columns, modified_column, etc.)
+        :return:              The TypeaheadIndex, e.g. to refresh() it after changing rows
+        """
+        index = TypeaheadIndex(self.engine, source, id_column, text_column, **index_options)
+
+        def view():
+            term = request.args.get("term", request.args.get("q", ""))
+            page = request.args.get("page", "1")
+            return Response(serialization.dumps(index.select2(term, int(page) if page.isdigit() else 1), use_orjson),
+                            mimetype=serialization.JSON_MIMETYPE)
+
+        if secured:
+            view = self.secured(any_roles=any_roles, not_roles=not_roles, all_roles=all_roles)(view)
+        endpoint = endpoint or "typeahead" + re.sub(r"\W", "_", rule)
+        self.add_url_rule(rule, endpoint=endpoint, view_func=view)
+        return index
+
+    def submit_job(self, function, *args, filename=None, mimetype=None, **kwargs):
+        """
+        Runs a function in the background instead of in the request. The job belongs to the current CAS user, and its
+        status can be polled at url_for("job_status", job_id=...)
+        :param function: The function to run. Whatever it returns (bytes, str, a dict/list, or an iterable of
+                         chunks) is spooled to disk and downloadable at url_for("job_result", job_id=...)
+        :param args:     The function's positional arguments
+        :param filename: The result's download filename, e.g. "enrollment.csv"
+        :param mimetype: The result's mimetype, guessed from the filename by default
+        :param kwargs:   The function's keyword arguments
+        :return:         the job id (str)
+        """
+        if self.jobs is None:
+            raise Exception("Background jobs are not configured.")
+        cas = g.get("cas_user") if has_app_context() else None
+        return self.jobs.submit(function, *args, owner=str(cas) if cas else None, filename=filename,
+                                mimetype=mimetype, **kwargs)
+
+    def __visible_job(self, job_id):
+        """
+        :return: the job's status record, None if it doesn't exist or belongs to another user
+        """
+        job = self.jobs.status(job_id)
+        cas = g.get("cas_user")
+        if job is None or (job["owner"] is not None and job["owner"] != str(cas)):
+            return None
+        return job
+
+    def __job_status(self, job_id):
+        """
+        :return: a json response with the job's status
+        """
+        job = self.__visible_job(job_id)
+        if job is None:
+            return jsonify(dict(message="Job not found")), 404
+        out = dict(id=job["id"], name=job["name"], status=job["status"], error=job["error"], result_url=None)
+        for field in ("submitted_at", "started_at", "finished_at", "expires_at"):
+            out[field] = datetime.fromtimestamp(job[field], timezone.utc).isoformat() if job[field] else None
+        if job["status"] == FINISHED and job["has_result"]:
+            out["result_url"] = url_for("job_result", job_id=job["id"])
+        return jsonify(out)
+
+    def __job_result(self, job_id):
+        """
+        :return: the job's result file
+        """
+        job = self.__visible_job(job_id)
+        path = self.jobs.result_path(job_id) if job is not None else None
+        if path is None:
+            return jsonify(dict(message="Job result not found")), 404
+        return send_file(path, mimetype=job["mimetype"], as_attachment=bool(job["filename"]),
+                         download_name=job["filename"] or f"{job['name']}-{job['id']}", max_age=0)
+
+    def __job_queue_full(self, error):
+        """
+        :return: a 503 json response, for when too many background jobs are queued
+        """
+        response = jsonify(dict(message=str(error)))
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
     def __logout(self):
         """
         :return: A redirect for a CAS logout
@@ -265,6 +774,52 @@ class SecureFlaskApp(Flask):
             return wrap
         return _requires_cookie
 
+    def invalidate_authorization(self, username=None):
+        """
+        Drops cached user fields/roles so they are looked up again on the user's next request. Call this after
+        changing a user's roles. Only this process's cache is cleared, other workers keep their cached roles for up to
+        auth_cache_ttl seconds.
+        :param username: The user to invalidate, all users if not specified
+        """
+        if self.__auth_cache is None:
+            return
+        if username is None:
+            self.__auth_cache.clear()
+        else:
+            self.__auth_cache.pop(username)
+
+    def __load_authorization(self, username):
+        """
+        Looks up a user's security table fields and roles in the database
+        :param username: The CAS username
+        :return:         (dict of user fields, frozenset of role names)
+        """
+        fields = _get_user_fields(self.db, self.users, username) if self.users is not None else {}
+        roles = frozenset()
+        if self.__role_security_configured:
+            auths = self.db.query(self.user_roles, self.roles.c.authority).filter(
+                self.user_roles.c.app_user_id == fields.get("id")
+            ).outerjoin(
+                self.roles, self.user_roles.c.app_role_id == self.roles.c.id
+            ).all()
+            roles = frozenset(a.authority for a in auths)
+        return fields, roles
+
+    def __get_authorization(self, username):
+        """
+        Returns a user's fields and roles from the in-process cache, or the database
+        :param username: The CAS username
+        :return:         (dict of user fields, frozenset of role names)
+        """
+        if self.__auth_cache is None:
+            return self.__load_authorization(username)
+
+        authorization = self.__auth_cache.get(username)
+        if authorization is None:
+            authorization = self.__load_authorization(username)
+            self.__auth_cache.set(username, authorization)
+        return authorization
+
     def secured(self, any_roles=None, not_roles=None, all_roles=None, get_cas_user=False):
         """
         Use CAS to secure an endpoint, alternatively specify any roles to restrict access to the endpoint to as well
@@ -274,6 +829,11 @@ class SecureFlaskApp(Flask):
         :param all_roles:    User must be in ALL of these roles to see page
         :return:             the decorated function
         """
+        # compile the role checks into set operations once, rather than on every request
+        any_set = frozenset(any_roles) if any_roles else None
+        not_set = frozenset(not_roles) if not_roles else None
+        all_set = frozenset(all_roles) if all_roles else None
+
         def _secured(f):
             @functools.wraps(f)
             def wrap(*args, **kwargs):
@@ -285,28 +845,27 @@ class SecureFlaskApp(Flask):
                 if "cas-object" not in session:
                     after_login = f"{request.path}{_parse_query_string(quoted=False)}"
                     session["cas-after-login"] = after_login
-                    response = _login(self.__cas_server_url, self.app_url)
+                    response = _login(self.__cas_server_url, self.app_url, validator=self.cas_validator)
                 else:
                     raw_cas = session.get("cas-object")
-                    cas = CasUser(raw_cas["user"], raw_cas["attributes"], db_session=self.db, user_table=self.users)
+                    started = _time.perf_counter()
+                    fields, roles = self.__get_authorization(raw_cas["user"])
+                    record_auth("authorization", _time.perf_counter() - started)
+                    cas = CasUser(raw_cas["user"], raw_cas["attributes"], db_fields=fields)
+                    g.cas_user = cas
 
                     # do role-based security, if it was configured
                     if self.__role_security_configured:
-                        auths = self.db.query(self.user_roles, self.roles.c.authority).filter(
-                            self.user_roles.c.app_user_id == cas.id
-                        ).outerjoin(
-                            self.roles, self.user_roles.c.app_role_id == self.roles.c.id
-                        ).all()
-                        cas.roles = [a.authority for a in auths]
+                        cas.roles = sorted(roles)
 
                         # all_roles was set, and the authenticated user doesn't have all of the roles in the
                         # in the list, block their access
                         valid = True
-                        if all_roles and not all(role in cas.roles for role in all_roles):
+                        if all_set and not all_set <= roles:
                             valid = False
-                        if not_roles and any(role in not_roles for role in cas.roles):
+                        if not_set and not not_set.isdisjoint(roles):
                             valid = False
-                        if any_roles and not any(role in any_roles for role in cas.roles):
+                        if any_set and any_set.isdisjoint(roles):
                             valid = False
                         if valid:
                             response = f(cas, *args, **kwargs) if get_cas_user else f(*args, **kwargs)
@@ -315,9 +874,116 @@ class SecureFlaskApp(Flask):
                     else:
                         response = f(cas, *args, **kwargs) if get_cas_user else f(*args, **kwargs)
                 return response
+            wrap.profpy_secured = True
             return wrap
         return _secured
 
+    def cached(self, ttl=60, stale_ttl=0, per_role=False, query_string=True):
+        """
+        Caches the decorated route's responses. Place it below @app.secured, so responses are keyed by the user and
+        users without access never reach the cache.
+        :param ttl:          Seconds a cached response is served
+        :param stale_ttl:    Seconds after that to keep serving it while it is re-rendered in the background
+        :param per_role:     Share cached responses between users with the same role set. Only for routes whose
+                             response depends on nothing about the user but their roles. Ignored (responses are cached
+                             per user) when role-based security isn't configured or the route gets the CAS user
+        :param query_string: Whether or not the query string is part of the cache key
+        :return:             the decorated function
+        """
+        def _cached(f):
+            if getattr(f, "profpy_secured", False):
+                raise ValueError("@app.cached must be placed below @app.secured.")
+
+            @functools.wraps(f)
+            def wrap(*args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return f(*args, **kwargs)
+                cas = g.get("cas_user")
+                if cas is None:
+                    scope = ("anonymous",)
+                elif per_role and self.__role_security_configured and not (args and args[0] is cas):
+                    scope = ("roles",) + tuple(sorted(cas.roles or []))
+                else:
+                    # @app.secured(get_cas_user=True) passes the user in as the first argument
+                    scope = ("user", cas.user)
+                query = tuple(sorted(request.args.items(multi=True))) if query_string else ()
+                key = (request.endpoint, request.path, query, scope)
+
+                entry = self.response_cache.get(key)
+                if entry is not None and entry.age < ttl + stale_ttl:
+                    state = "HIT"
+                    if entry.age >= ttl:
+                        state = "STALE"
+                        # the copied request context gets a new app context, so bring g (e.g. g.cas_user) along
+                        request_globals = _request_globals()
+
+                        def render():
+                            for name, value in request_globals.items():
+                                setattr(g, name, value)
+                            return self.make_response(f(*args, **kwargs))
+                        self.response_cache.refresh(key, copy_current_request_context(render), ttl, stale_ttl)
+                    response = Response(entry.body, entry.status, entry.headers)
+                    response.headers[CACHE_HEADER] = state
+                    return response
+
+                response = self.make_response(f(*args, **kwargs))
+                self.response_cache.store(key, response, ttl, stale_ttl)
+                response.headers[CACHE_HEADER] = "MISS"
+                return response
+            return wrap
+        return _cached
+
+    def conditional(self, *tables, modified_column=None, version=None):
+        """
+        Answers conditional GETs for the decorated route from a cheap database-side version of the tables it reads,
+        so a 304 Not Modified is sent without running the route. The version is the max of each table's
+        modified_column (or its ORA_ROWSCN on Oracle) and its row count. Place it below @app.secured.
+        :param tables:          The tables the route reads, e.g. app.general.people
+        :param modified_column: The tables' last-modified column, or a dict of table name to column. Also sets the
+                                Last-Modified header
+        :param version:         A function returning a profpy.web.conditional.Version, instead of tables
+        :return:                the decorated function
+        """
+        statements = [
+            version_statement(t, modified_column.get(t.name) if isinstance(modified_column, dict) else modified_column,
+                              self.engine.dialect.name)
+            for t in tables
+        ]
+
+        def _conditional(f):
+            if getattr(f, "profpy_secured", False):
+                raise ValueError("@app.conditional must be placed below @app.secured.")
+
+            @functools.wraps(f)
+            def wrap(*args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return f(*args, **kwargs)
+                current = version() if version else read_version(self.db, statements)
+                cas = g.get("cas_user")
+                etag = current.etag(request.full_path, str(cas) if cas else None,
+                                    tuple(sorted(cas.roles or [])) if cas else None)
+                if not_modified(etag):
+                    response = self.response_class(status=304)
+                else:
+                    response = self.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                if current.last_modified is not None:
+                    response.last_modified = current.last_modified
+                return response
+            return wrap
+        return _conditional
+
+    def invalidate_cache(self, endpoint=None, path=None):
+        """
+        Drops responses cached by @app.cached, e.g. after changing the data they show
+        :param endpoint: Only drop this endpoint's responses (the route function's name)
+        :param path:     Only drop responses for this path
+        :return:         The number of responses dropped
+        """
+        return self.response_cache.invalidate(endpoint, path)
+
 
 def _explode_full_table_names(in_tables):
     """
@@ -347,7 +1013,16 @@ def _get_single_table(engine, in_schema, in_table):
     """
     md = MetaData()
     md.reflect(engine, schema=in_schema, only=[in_table], views=True)
-    return md.tables[f"{in_schema}.{in_table}"] if md.tables else None
+    # reflected names are normalized (e.g. lowercase for Oracle), so don't rely on the case of the name asked for
+    tables = {_table_key(t.schema, t.name): t for t in md.tables.values()}
+    return tables.get(_table_key(in_schema, in_table))
+
+
+def _table_key(schema, table):
+    """
+    :return: the case-insensitive key of a schema-qualified table, used for metadata snapshots
+    """
+    return f"{schema}.{table}".lower()
 
 
 def _create_table_objects(engine, schema, tables):
@@ -363,29 +1038,130 @@ def _create_table_objects(engine, schema, tables):
     return md.tables
 
 
-def _serialize_table_object(self, result_set, as_http_response=False, iso_dates=True):
+class _TableReflector(object):
+    """
+    Reflects tables for the app, from a metadata snapshot when possible and otherwise from the database, optionally
+    on a thread pool
+    """
+    def __init__(self, engine, snapshot_path=None, workers=1):
+        self.engine = engine
+        self.workers = max(int(workers), 1)
+        self.snapshot = {}
+        if snapshot_path and os.path.isfile(snapshot_path):
+            # unpickling runs code, so only load a snapshot nobody else could have written
+            with open(trusted_file(snapshot_path), "rb") as snapshot_file:
+                self.snapshot = {k.lower(): t for k, t in pickle.load(snapshot_file).items()}
+
+    def reflect_one(self, schema, table):
+        """
+        :return: a single table object, None if it doesn't exist
+        """
+        key = _table_key(schema, table)
+        if key in self.snapshot:
+            return self.snapshot[key]
+        return _get_single_table(self.engine, schema, table)
+
+    def reflect(self, schema_to_table, split=None):
+        """
+        :param schema_to_table: schema-key, table_list-value dict
+        :param split:           reflect each table separately (so they can run in parallel), defaults to whether
+                                there's more than one worker
+        :return:                schema-key, dict of tables (keyed by lowercase schema-qualified name) values
+        """
+        split = self.workers > 1 if split is None else split
+        out = {schema: {} for schema in schema_to_table}
+        jobs = []
+        for schema, tables in schema_to_table.items():
+            remaining = []
+            for table in tables:
+                key = _table_key(schema, table)
+                if key in self.snapshot:
+                    out[schema][key] = self.snapshot[key]
+                else:
+                    remaining.append(table)
+            if not remaining:
+                continue
+            if split:
+                jobs.extend((schema, [t]) for t in remaining)
+            else:
+                jobs.append((schema, remaining))
+
+        def run(job):
+            schema, tables = job
+            return schema, _create_table_objects(self.engine, schema, tables)
+
+        if self.workers > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+                results = list(pool.map(run, jobs))
+        else:
+            results = [run(job) for job in jobs]
+
+        for schema, tables in results:
+            out[schema].update({_table_key(t.schema, t.name): t for t in tables.values()})
+        return out
+
+
+def save_metadata_snapshot(engine, in_tables, path, workers=8):
+    """
+    Reflects tables and pickles them to a file that SecureFlaskApp can load with its metadata_snapshot argument,
+    e.g. while building a docker image. Include the security tables if role-based security is used.
+    :param engine:    sqlalchemy engine
+    :param in_tables: schema-qualified table/view names
+    :param path:      the snapshot file to write
+    :param workers:   threads to reflect with
+    """
+    reflected = _TableReflector(engine, workers=workers).reflect(_explode_full_table_names(in_tables))
+    _write_snapshot(path, [t for tables in reflected.values() for t in tables.values()])
+
+
+def _write_snapshot(path, tables):
+    """
+    :param path:   the snapshot file to write
+    :param tables: sqlalchemy table objects
+    """
+    with open(path, "wb") as snapshot_file:
+        pickle.dump({_table_key(t.schema, t.name): t for t in tables}, snapshot_file)
+
+
+def _serialize_table_object(self, result_set, as_http_response=False, iso_dates=True, use_orjson=False):
     """
     Serializer for results of a sqlalchemy query from Table object
     :param self:              the object
     :param result_set:        the result
     :param as_http_response:  whether or not to return an actual json "response" or just a dict
     :param iso_dates:         whether or not to use iso dates
+    :param use_orjson:        encode the response with orjson, if it is installed, rather than jsonify. Faster for
+                              large results, but the json is compact and its keys aren't sorted
     :return:                  json for a sqlalchemy query result
     """
-    out_results = []
-    return_one = type(result_set).__name__ == "result"
+    return_one = type(result_set).__name__ in ("result", "Row")
     if return_one:
         result_set = [result_set]
-    for in_result in result_set:
-        this_result = dict()
-        for column in self.columns:
-            value = getattr(in_result, column.name)
-            if isinstance(value, (datetime, date, time)) and iso_dates:
-                value = value.isoformat()
-            this_result[column.name] = value
-        out_results.append(this_result)
+    serialize = row_serializer([column.name for column in self.columns], iso_dates)
+    out_results = [serialize(in_result) for in_result in result_set]
     out_results = (out_results[0] if out_results else []) if return_one else out_results
-    return jsonify(out_results) if as_http_response else out_results
+    if not as_http_response:
+        return out_results
+    if use_orjson and serialization.orjson is not None and iso_dates:
+        return Response(serialization.dumps(out_results, use_orjson), mimetype=serialization.JSON_MIMETYPE)
+    return jsonify(out_results)
+
+
+def _stream_table_object(self, result_set, ndjson=False, chunk_size=serialization.DEFAULT_CHUNK_SIZE, iso_dates=True,
+                         use_orjson=False):
+    """
+    Streaming serializer for results of a sqlalchemy query from Table object. Rows are encoded and sent in chunks as
+    they are fetched, so pair it with a lazy result, e.g. app.db.query(table).yield_per(1000)
+    :param self:        the object
+    :param result_set:  the result
+    :param ndjson:      whether to send newline-delimited json rather than a json array
+    :param chunk_size:  rows per chunk sent to the client
+    :param iso_dates:   whether or not to use iso dates
+    :param use_orjson:  encode with orjson, if it is installed
+    :return:            a streaming json response
+    """
+    return stream_rows(result_set, [column.name for column in self.columns], ndjson=ndjson, chunk_size=chunk_size,
+                       iso_dates=iso_dates, use_orjson=use_orjson)
 
 
 def _parse_query_string(quoted=False):
@@ -404,10 +1180,11 @@ def _parse_query_string(quoted=False):
     return (quote(qs) if quoted else qs) if qs != "?" else ""
 
 
-def _login(in_cas_url, in_app_url, db_session=None, security_user_table=None):
+def _login(in_cas_url, in_app_url, db_session=None, security_user_table=None, validator=None):
     """
     Business logic for CAS login
     :param in_cas_url:      The CAS server url
+    :param validator:       A CasValidator to validate the ticket with, otherwise a new caslib client is used
     :return:                An appropriate redirect url
     """
     app_url = f"{in_app_url}{request.path}{_parse_query_string(quoted=True)}"
@@ -416,9 +1193,17 @@ def _login(in_cas_url, in_app_url, db_session=None, security_user_table=None):
         session["cas-ticket"] = request.args["ticket"]
 
     if "cas-ticket" in session:
-        client = caslib.SAMLClient(in_cas_url, app_url)
-        cas_response = client.saml_serviceValidate(session["cas-ticket"])
+        started = _time.perf_counter()
+        if validator is not None:
+            cas_response = validator.validate(session["cas-ticket"], app_url)
+        else:
+            cas_response = caslib.SAMLClient(in_cas_url, app_url).saml_serviceValidate(session["cas-ticket"])
+        record_auth("cas", _time.perf_counter() - started)
         if cas_response.success:
+            # a server-side session gets a new id once the user has logged in
+            regenerate = getattr(session, "regenerate", None)
+            if regenerate is not None:
+                regenerate()
             session["cas-object"] = CasUser(cas_response.user, cas_response.attributes, db_session,
                                             security_user_table).serialize()
             redirect_url = session.get("cas-after-login")
@@ -427,9 +1212,83 @@ def _login(in_cas_url, in_app_url, db_session=None, security_user_table=None):
     return redirect(redirect_url)
 
 
+def _get_user_fields(db_session, user_table, username):
+    """
+    Looks up a user's row in the security user table
+    :param db_session: A sqlalchemy session
+    :param user_table: The security user table
+    :param username:   The CAS username
+    :return:           The user's fields as a dict (empty if the user isn't in the table)
+    """
+    db_user = db_session.query(user_table).filter_by(username=username).first()
+    return dict(db_user._mapping) if db_user is not None else {}
+
+
+def _request_globals():
+    """
+    :return: the current request's g values, without profpy's own per-request state (its db session scope and
+             metrics), which a background re-render of the request must not share
+    """
+    return {name: value for name, value in vars(g._get_current_object()).items()
+            if not name.lstrip("_").startswith("profpy")}
+
+
+def _session_scope():
+    """
+    Scope function for the app's session registry: one session per app context (each request gets its own), or per
+    thread when used outside of an app context
+    :return: a hashable scope identifier
+    """
+    if has_app_context():
+        # a token rather than id(g), since ids are reused once an app context is garbage collected
+        if _session_scope_attribute not in g:
+            setattr(g, _session_scope_attribute, next(_session_scopes))
+        return getattr(g, _session_scope_attribute)
+    return threading.get_ident()
+
+
+def _size_pool(app, engine, worker_threads):
+    """
+    Replaces the engine's connection pool with a larger one if it can't give every worker thread its own connection
+    :param app:            the flask app, for logging
+    :param engine:         the sqlalchemy engine
+    :param worker_threads: the number of threads per worker process
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+
+    # a negative max_overflow means the pool can always open more connections
+    max_overflow = pool._max_overflow
+    if max_overflow >= 0 and pool.size() + max_overflow < worker_threads:
+        app.logger.info(f"Enlarging the database pool from {pool.size()} to {worker_threads} connections for "
+                        f"{worker_threads} worker threads.")
+        # recreate keeps every other option and the pool's event listeners, its queue's maxsize is the pool_size
+        resized = pool.recreate()
+        resized._pool.maxsize = worker_threads
+        pool.dispose()
+        engine.pool = resized
+
+
+def _rule_key(rule):
+    """
+    :return: a url rule without its variable names/converters or trailing slash, so rules that match the same urls
+             compare equal
+    """
+    return re.sub(r"<[^>]*>", "<>", rule).rstrip("/")
+
+
+def _is_read_only_request():
+    """
+    :return: whether or not the current request (if there is one) is a read-only http method
+    """
+    return has_request_context() and request.method in _read_only_methods
+
+
 def _raw_columns(table_obj):
     return [str(col).replace(f"{table_obj.name}.", "") for col in table_obj.columns]
 
 
 # implement serializer
 Table.as_json = _serialize_table_object
+Table.as_json_stream = _stream_table_object
@@ -0,0 +1,56 @@
+import os
+
+# SecureFlaskApp reads these when profpy.web is imported
+os.environ.setdefault("secret_key", "test")
+os.environ.setdefault("app_port", "8080")
+os.environ.setdefault("cas_url", "https://cas.example.edu/cas")
+
+import pytest
+from sqlalchemy import create_engine, text
+
+
+def people_engine(path, name):
+    """
+    :return: a SQLite engine with a people table holding one person with the given name
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("create table people (id integer primary key, name text)"))
+        connection.execute(text("insert into people values (1, :name)"), dict(name=name))
+    return engine
+
+
+def add_security_tables(engine, users):
+    """
+    Adds app_user, app_role and app_user_app_role tables to a SQLite engine
+    :param users: username: [role, ...]
+    """
+    roles = sorted({role for user_roles in users.values() for role in user_roles})
+    with engine.begin() as connection:
+        connection.execute(text("create table app_user (id integer primary key, username text, display_name text)"))
+        connection.execute(text("create table app_role (id integer primary key, authority text)"))
+        connection.execute(text("create table app_user_app_role (app_user_id integer, app_role_id integer, "
+                                "primary key (app_user_id, app_role_id))"))
+        for role_id, role in enumerate(roles, 1):
+            connection.execute(text("insert into app_role values (:id, :authority)"), dict(id=role_id, authority=role))
+        for user_id, (user, user_roles) in enumerate(users.items(), 1):
+            connection.execute(text("insert into app_user values (:id, :username, :username)"),
+                               dict(id=user_id, username=user))
+            for role in user_roles:
+                connection.execute(text("insert into app_user_app_role values (:user_id, :role_id)"),
+                                   dict(user_id=user_id, role_id=roles.index(role) + 1))
+
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session["cas-object"] = dict(user=user, attributes={"displayName": [user]})
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return people_engine(tmp_path / "primary.db", "primary")
+
+
+@pytest.fixture
+def replica(tmp_path):
+    return people_engine(tmp_path / "replica.db", "replica")
@@ -0,0 +1,88 @@
+from decimal import Decimal
+from datetime import date, datetime
+import pytest
+from profpy.db import BatchJob, FileCheckpoint
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def close(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def _work():
+    return [dict(term="202410", pidm=pidm) for pidm in range(10)] + \
+           [dict(term="202420", pidm=pidm) for pidm in range(10)]
+
+
+def _composite_key(item):
+    return item["term"], item["pidm"]
+
+
+def _crash_after(count, processed):
+    def process(cursor, chunk):
+        if len(processed) >= count:
+            raise RuntimeError("crash")
+        processed.extend(chunk)
+    return process
+
+
+def test_composite_key_resumes(tmp_path):
+    checkpoint = FileCheckpoint(str(tmp_path / "state.json"))
+    processed = []
+    job = BatchJob(FakeConnection(), "job", _work(), _crash_after(12, processed), key=_composite_key,
+                   commit_every=4, checkpoint=checkpoint)
+    with pytest.raises(RuntimeError):
+        job.run()
+    assert checkpoint.load(None, "job") == (("202420", 1), 12)
+
+    resumed = []
+    summary = BatchJob(FakeConnection(), "job", _work(), lambda cursor, chunk: resumed.extend(chunk),
+                       key=_composite_key, commit_every=4, checkpoint=checkpoint).run()
+    assert resumed == _work()[12:]
+    assert summary["rows"] == 20
+    assert checkpoint.load(None, "job") == (None, 0)
+
+
+@pytest.mark.parametrize("key", [date(2024, 1, 2), datetime(2024, 1, 2, 3, 4, 5), Decimal("1.50"),
+                                 ("a", date(2024, 1, 2), 3), "abc", 12, None])
+def test_key_types_round_trip(tmp_path, key):
+    checkpoint = FileCheckpoint(str(tmp_path / "state.json"))
+    checkpoint.save(None, "job", key, 1)
+    loaded, rows = checkpoint.load(None, "job")
+    assert loaded == key and type(loaded) is type(key)
+
+
+def test_date_keys_passed_to_work_function(tmp_path):
+    checkpoint = FileCheckpoint(str(tmp_path / "state.json"))
+    checkpoint.save(None, "job", date(2024, 1, 2), 5)
+    seen = []
+
+    def work(last_key):
+        seen.append(last_key)
+        return [date(2024, 1, 3)]
+
+    BatchJob(FakeConnection(), "job", work, lambda cursor, chunk: None, checkpoint=checkpoint).run()
+    assert seen == [date(2024, 1, 2)]
+
+
+def test_unsupported_key_fails_before_processing(tmp_path):
+    connection = FakeConnection()
+    processed = []
+    job = BatchJob(connection, "job", [object()], lambda cursor, chunk: processed.extend(chunk),
+                   checkpoint=FileCheckpoint(str(tmp_path / "state.json")))
+    with pytest.raises(TypeError, match="Checkpoint keys"):
+        job.run()
+    assert processed == [] and connection.commits == 0
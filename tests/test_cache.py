@@ -0,0 +1,101 @@
+import os
+import threading
+from unittest.mock import patch
+import pytest
+from flask import g
+from profpy.web import SecureFlaskApp
+from profpy.web.response_cache import DiskBackend
+from conftest import add_security_tables, login
+
+_security = dict(security_schema="main", role_table="app_role", user_table="app_user",
+                 user_role_table="app_user_app_role")
+
+
+@pytest.fixture
+def security_engine(primary):
+    add_security_tables(primary, dict(nedry=["ROLE_ADMIN"], hammond=["ROLE_ADMIN"], muldoon=[], arnold=[]))
+    return primary
+
+
+def _app(engine, role_security=True, **cached):
+    app = SecureFlaskApp(__name__, "test", engine, metrics_endpoint=None,
+                         **(_security if role_security else {}))
+
+    @app.route("/greeting")
+    @app.secured()
+    @app.cached(**cached)
+    def greeting():
+        return f"Hello {g.cas_user.user}"
+
+    @app.route("/profile")
+    @app.secured(get_cas_user=True)
+    @app.cached(**cached)
+    def profile(cas):
+        return f"Profile of {cas.user}"
+
+    return app
+
+
+def _get(app, user, path):
+    client = app.test_client()
+    login(client, user)
+    return client.get(path)
+
+
+@pytest.mark.parametrize("users", [("nedry", "hammond"), ("muldoon", "arnold")])
+def test_users_dont_share_pages_by_default(security_engine, users):
+    app = _app(security_engine)
+    for user in users:
+        response = _get(app, user, "/greeting")
+        assert response.get_data(as_text=True) == f"Hello {user}"
+        assert response.headers["X-Cache"] == "MISS"
+    assert _get(app, users[0], "/greeting").headers["X-Cache"] == "HIT"
+
+
+def test_per_role_shares_pages_between_users_with_the_same_roles(security_engine):
+    app = _app(security_engine, per_role=True)
+    assert _get(app, "nedry", "/greeting").get_data(as_text=True) == "Hello nedry"
+    response = _get(app, "hammond", "/greeting")
+    assert response.get_data(as_text=True) == "Hello nedry" and response.headers["X-Cache"] == "HIT"
+    assert _get(app, "muldoon", "/greeting").headers["X-Cache"] == "MISS"
+
+
+def test_per_role_is_per_user_without_role_security(security_engine):
+    app = _app(security_engine, role_security=False, per_role=True)
+    assert _get(app, "muldoon", "/greeting").get_data(as_text=True) == "Hello muldoon"
+    assert _get(app, "arnold", "/greeting").get_data(as_text=True) == "Hello arnold"
+
+
+@pytest.mark.parametrize("users", [("nedry", "hammond"), ("muldoon", "arnold")])
+def test_per_role_is_per_user_for_routes_getting_the_cas_user(security_engine, users):
+    app = _app(security_engine, per_role=True)
+    for user in users:
+        assert _get(app, user, "/profile").get_data(as_text=True) == f"Profile of {user}"
+
+
+def test_stale_refresh_of_secured_route_keeps_the_user(security_engine):
+    app = _app(security_engine, ttl=0, stale_ttl=60)
+    refreshed = threading.Event()
+    stored = app.response_cache.store
+
+    def store(*args, **kwargs):
+        stored(*args, **kwargs)
+        refreshed.set()
+
+    assert _get(app, "nedry", "/greeting").headers["X-Cache"] == "MISS"
+    app.response_cache.store = store
+    with patch("profpy.web.response_cache._logger") as logger:
+        response = _get(app, "nedry", "/greeting")
+        assert response.headers["X-Cache"] == "STALE"
+        assert refreshed.wait(5)
+    logger.exception.assert_not_called()
+    assert _get(app, "nedry", "/greeting").get_data(as_text=True) == "Hello nedry"
+
+
+def test_disk_cache_directory_must_be_private(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError):
+        DiskBackend(str(shared))
+    assert oct(os.stat(DiskBackend(str(tmp_path / "private")).directory).st_mode & 0o777) == "0o700"
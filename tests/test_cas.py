@@ -0,0 +1,45 @@
+import time
+import threading
+import types
+import pytest
+from profpy.web import cas
+from profpy.web.cas import CasValidator
+
+
+@pytest.fixture
+def cas_server(monkeypatch):
+    server = types.SimpleNamespace(calls=[], release=threading.Event())
+    server.release.set()
+
+    def saml_serviceValidate(client, ticket):
+        server.calls.append(ticket)
+        server.release.wait(5)
+        return types.SimpleNamespace(success=True, user="nedry")
+
+    monkeypatch.setattr(cas.PooledSAMLClient, "saml_serviceValidate", saml_serviceValidate)
+    return server
+
+
+def test_concurrent_validations_each_go_to_cas(cas_server):
+    validator = CasValidator("https://cas.example.edu")
+    cas_server.release.clear()
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(validator.validate("ST-1", "https://app")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # every thread reaches CAS while the first call is still waiting, none is answered from another's result
+    time.sleep(0.2)
+    assert cas_server.calls == ["ST-1"] * 4
+    cas_server.release.set()
+    for thread in threads:
+        thread.join()
+    assert len(responses) == 4
+
+
+def test_completed_validation_is_not_reused(cas_server):
+    validator = CasValidator("https://cas.example.edu")
+    validator.validate("ST-1", "https://app")
+    validator.validate("ST-1", "https://app")
+    assert cas_server.calls == ["ST-1", "ST-1"]
+    assert validator.stats()["validations"] == 2
@@ -0,0 +1,50 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import Table, Column, Integer, DateTime, MetaData, text
+from profpy.web import SecureFlaskApp
+
+_runs = []
+
+
+@pytest.fixture
+def engine(primary):
+    with primary.begin() as connection:
+        connection.execute(text("create table visits (id integer primary key, activity_date timestamp)"))
+        connection.execute(text("insert into visits values (1, :first), (2, :second)"),
+                           dict(first=datetime(2024, 1, 1), second=datetime(2024, 1, 2)))
+    return primary
+
+
+def _app(engine):
+    visits = Table("visits", MetaData(), Column("id", Integer), Column("activity_date", DateTime))
+    app = SecureFlaskApp(__name__, "test", engine, metrics_endpoint=None)
+
+    @app.route("/visits")
+    @app.conditional(visits, modified_column="activity_date")
+    def list_visits():
+        _runs.append(1)
+        return dict(count=app.db.execute(text("select count(*) from visits")).scalar())
+
+    return app
+
+
+def test_if_none_match_skips_the_route_until_a_row_is_deleted(engine):
+    client = _app(engine).test_client()
+    first = client.get("/visits")
+    assert first.status_code == 200 and first.headers["Last-Modified"] == "Tue, 02 Jan 2024 00:00:00 GMT"
+    _runs.clear()
+    assert client.get("/visits", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert not _runs
+    with engine.begin() as connection:
+        connection.execute(text("delete from visits where id = 1"))
+    response = client.get("/visits", headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 200 and response.json == dict(count=1)
+
+
+def test_if_modified_since_alone_doesnt_hide_deleted_rows(engine):
+    client = _app(engine).test_client()
+    first = client.get("/visits")
+    with engine.begin() as connection:
+        connection.execute(text("delete from visits where id = 1"))
+    response = client.get("/visits", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 200 and response.json == dict(count=1)
@@ -0,0 +1,76 @@
+import types
+import pytest
+from profpy.db.general import connections
+
+
+class FakePool(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def acquire(self):
+        raise AssertionError("not connecting in tests")
+
+
+@pytest.fixture
+def oracledb(monkeypatch):
+    calls = []
+    fake = types.SimpleNamespace(
+        PURITY_SELF="self", PURITY_NEW="new", PURITY_DEFAULT="default",
+        init_oracle_client=lambda lib_dir=None: None,
+        makedsn=lambda host, port, service_name=None: f"(DESCRIPTION={host}:{port}/{service_name})",
+        connect=lambda **kwargs: calls.append(("connect", kwargs)) or kwargs,
+        create_pool=lambda **kwargs: calls.append(("create_pool", kwargs)) or FakePool(**kwargs),
+    )
+    fake.calls = calls
+    monkeypatch.setattr(connections, "cx_Oracle", fake)
+    monkeypatch.delenv("db_cclass", raising=False)
+    return fake
+
+
+def test_easy_connect_pooled_login(oracledb):
+    helper = connections.OracleConnectionHelper("user@//host:1521/service:pooled", "pw", cclass="APP", purity="self")
+    assert helper.drcp
+    helper.get_cx_oracle_connection()
+    assert oracledb.calls == [("connect", dict(user="user", password="pw", dsn="host:1521/service:pooled",
+                                               cclass="APP", purity="self"))]
+
+
+def test_easy_connect_without_drcp(oracledb):
+    helper = connections.OracleConnectionHelper("user@//host:1521/service", "pw")
+    assert not helper.drcp
+    helper.get_cx_oracle_connection()
+    assert oracledb.calls == [("connect", dict(user="user", password="pw", dsn="(DESCRIPTION=host:1521/service)"))]
+
+
+def test_alias_pooled_login_raises(oracledb):
+    with pytest.raises(ValueError, match="SERVER=POOLED"):
+        connections.OracleConnectionHelper("user@ALIAS:pooled", "pw")
+
+
+def test_alias_with_drcp_uses_alias(oracledb, monkeypatch):
+    monkeypatch.setenv("db_cclass", "APP")
+    helper = connections.OracleConnectionHelper("user@ALIAS", "pw", drcp=True)
+    helper.get_cx_oracle_connection()
+    assert oracledb.calls == [("connect", dict(user="user", password="pw", dsn="ALIAS", cclass="APP"))]
+
+
+@pytest.mark.parametrize("login", ["user@//host:1521/service:pooled", "user@ALIAS"])
+def test_drcp_engine_sizes_oracledb_pool_from_queue_pool_options(oracledb, login):
+    helper = connections.OracleConnectionHelper(login, "pw", drcp=True)
+    engine = helper.get_sql_alchemy_engine(pool_size=6, max_overflow=2, pool_timeout=5, pool_recycle=600)
+    assert type(engine.pool).__name__ == "NullPool"
+    assert engine.pool._recycle == 600
+    (call, kwargs), = oracledb.calls
+    assert call == "create_pool" and kwargs["max"] == 8
+
+
+def test_drcp_engine_keeps_larger_pool_max(oracledb):
+    helper = connections.OracleConnectionHelper("user@//host:1521/service:pooled", "pw", pool_max=10)
+    helper.get_sql_alchemy_engine(pool_size=4)
+    assert oracledb.calls[0][1]["max"] == 10
+
+
+def test_dedicated_engine_keeps_queue_pool_options(oracledb):
+    engine = connections.OracleConnectionHelper("user@ALIAS", "pw").get_sql_alchemy_engine(pool_size=6)
+    assert engine.pool.size() == 6
+    assert oracledb.calls == []
@@ -0,0 +1,58 @@
+import pytest
+from profpy.db import execute_query, ColumnEncoder
+
+
+class FakeCursor(object):
+    def __init__(self, columns, rows):
+        self.description = [(c,) for c in columns]
+        self.__rows = rows
+
+    def execute(self, sql, params):
+        self.__position = 0
+
+    def fetchall(self):
+        return list(self.__rows)
+
+    def fetchmany(self, size):
+        rows = self.__rows[self.__position:self.__position + size]
+        self.__position += len(rows)
+        return rows
+
+
+def _rows():
+    return [(i, "".join(["20", "24", "10"]), "RE") for i in range(200)]
+
+
+def test_encoder_instance_reports_savings():
+    encoder = ColumnEncoder()
+    rows = execute_query(FakeCursor(["ID", "TERM", "STATUS"], _rows()), "select", column_encoder=encoder)
+    assert len(rows) == 200
+    assert rows[0]["term"] is rows[1]["term"]
+    assert set(encoder.encoded_columns) == {"term", "status"}
+    assert encoder.report()["total"]["bytes_saved"] > 0
+
+
+def test_encoder_codes_decode_with_generator():
+    encoder = ColumnEncoder(columns=["term"], codes=True)
+    rows = list(execute_query(FakeCursor(["ID", "TERM"], [r[:2] for r in _rows()]), "select",
+                              use_generator=True, column_encoder=encoder))
+    assert rows[0]["term"] == 0
+    assert encoder.decode("term", rows[0]["term"]) == "202410"
+
+
+def test_encoder_must_be_an_instance():
+    with pytest.raises(ValueError, match="ColumnEncoder"):
+        execute_query(FakeCursor(["ID", "TERM", "STATUS"], _rows()), "select", column_encoder=True)
+
+
+def test_list_path_encodes_each_chunk():
+    cursor = FakeCursor(["ID", "TERM", "STATUS"], _rows())
+    cursor.arraysize = 30
+    encoder = ColumnEncoder()
+    rows = execute_query(cursor, "select", column_encoder=encoder)
+    assert [row["id"] for row in rows] == list(range(200))
+    assert rows[0]["term"] is rows[-1]["term"]
+    assert set(encoder.encoded_columns) == {"term", "status"}
+
+    limited = execute_query(cursor, "select", limit=45, column_encoder=ColumnEncoder())
+    assert [row["id"] for row in limited] == list(range(45))
@@ -0,0 +1,51 @@
+import time
+from sqlalchemy import event
+from profpy.web import SecureFlaskApp
+
+
+def _slow_connections(engine, seconds):
+    checkouts = []
+
+    @event.listens_for(engine, "checkout")
+    def checkout(*args):
+        checkouts.append(1)
+        time.sleep(seconds)
+
+    return checkouts
+
+
+def _wait_for_probe(app):
+    deadline = time.monotonic() + 5
+    while app.health.status()["starting"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_health_endpoints_do_not_wait_for_the_first_probe(primary):
+    app = SecureFlaskApp(__name__, "test", primary, health_probes=True, health_timeout=2)
+    checkouts = _slow_connections(primary, 1)
+    client = app.test_client()
+    for url, code in (("/health/live", 200), ("/health/ready", 503), ("/health", 500)):
+        started = time.monotonic()
+        response = client.get(url)
+        assert response.status_code == code
+        assert time.monotonic() - started < 0.5
+    assert client.get("/health/ready").json["status"] == "starting"
+    assert client.get("/health/live").json["checks"]["database"]["starting"]
+
+    # the prober started with the first request, and answers once its probe is done
+    _wait_for_probe(app)
+    assert checkouts
+    assert client.get("/health/ready").json["status"] == "ready"
+    app.health.stop()
+
+
+def test_readiness_reports_the_probe(primary):
+    app = SecureFlaskApp(__name__, "test", primary, health_probes=True)
+    client = app.test_client()
+    client.get("/")
+    _wait_for_probe(app)
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json["checks"]["database"]["healthy"]
+    assert client.get("/health/live").json["checks"]["database"]["healthy"]
+    app.health.stop()
@@ -0,0 +1,49 @@
+import os
+import stat
+import time
+import pytest
+from profpy.web import jobs
+from profpy.web.jobs import JobRunner, FINISHED
+
+
+def _wait(runner, job_id):
+    for _ in range(100):
+        job = runner.status(job_id)
+        if job["status"] not in (jobs.QUEUED, jobs.RUNNING):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job didn't finish")
+
+
+def test_job_directory_is_private(tmp_path):
+    directory = tmp_path / "jobs"
+    runner = JobRunner(str(directory))
+    assert stat.S_IMODE(os.stat(directory).st_mode) & 0o077 == 0
+    job_id = runner.submit(lambda: "report", owner="nedry", filename="report.txt")
+    assert _wait(runner, job_id)["status"] == FINISHED
+    with open(runner.result_path(job_id)) as result:
+        assert result.read() == "report"
+
+
+def test_default_directory_is_per_user():
+    assert jobs.DEFAULT_DIRECTORY.endswith(f"_{os.getuid()}")
+
+
+def test_directory_writable_by_others_is_rejected(tmp_path):
+    directory = tmp_path / "jobs"
+    directory.mkdir()
+    directory.chmod(0o777)
+    with pytest.raises(PermissionError, match="other users"):
+        JobRunner(str(directory))
+
+
+def test_directory_owned_by_someone_else_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+    with pytest.raises(PermissionError, match="owned by the current user"):
+        JobRunner(str(tmp_path))
+
+
+def test_job_removed_before_it_runs_is_skipped(tmp_path):
+    ran = []
+    jobs._run(str(tmp_path), "gone", 60, ran.append, (1,), {})
+    assert not ran and jobs._update(str(tmp_path), "gone", status=FINISHED) is None
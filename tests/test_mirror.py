@@ -0,0 +1,91 @@
+import time
+import threading
+from datetime import datetime
+from profpy.db import ReferenceMirror, MirrorTable
+
+
+class FakeResult(object):
+    def __init__(self, columns, rows):
+        self.__columns = columns
+        self.__rows = rows
+
+    def keys(self):
+        return self.__columns
+
+    def __iter__(self):
+        return iter(self.__rows)
+
+
+class FakeSource(object):
+    """
+    An engine whose reads can be held after the rows have been read, like a slow network
+    """
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.reads = []
+        self.read = threading.Event()
+        self.release = None
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params):
+        self.reads.append((str(sql), dict(params)))
+        rows = [r for r in self.rows if "since" not in params or r[-1] >= params["since"]]
+        release, self.release = self.release, None
+        self.read.set()
+        if release:
+            release.wait(5)
+        return FakeResult(self.columns, rows)
+
+
+def _refresh_while_held(mirror, source, change):
+    """
+    Starts a refresh that is held after reading the source, changes the source, and refreshes again
+    """
+    release = source.release = threading.Event()
+    source.read.clear()
+    held = threading.Thread(target=mirror.refresh, args=("terms",))
+    held.start()
+    source.read.wait(5)
+    change()
+    newer = threading.Thread(target=mirror.refresh, args=("terms",))
+    newer.start()
+    time.sleep(0.2)
+    release.set()
+    held.join(5)
+    newer.join(5)
+
+
+def test_older_read_does_not_overwrite_newer_rows():
+    source = FakeSource(["CODE", "DESCR"], [("202410", "Old")])
+    mirror = ReferenceMirror(source, [MirrorTable("terms", key_columns=["code"])], background=False)
+    assert mirror.get("terms", code="202410")[0]["descr"] == "Old"
+
+    _refresh_while_held(mirror, source, lambda: setattr(source, "rows", [("202410", "New")]))
+    assert mirror.get("terms", code="202410")[0]["descr"] == "New"
+
+
+def test_incremental_refreshes_read_from_the_latest_high_water_mark():
+    source = FakeSource(["CODE", "DESCR", "MODIFIED"], [("202410", "Old", datetime(2024, 1, 1))])
+    mirror = ReferenceMirror(source, [MirrorTable("terms", key_columns=["code"], modified_column="modified")],
+                             background=False)
+    assert mirror.get("terms", code="202410")[0]["descr"] == "Old"
+
+    def change():
+        source.rows = [("202410", "New", datetime(2024, 2, 1))]
+
+    _refresh_while_held(mirror, source, change)
+    assert mirror.get("terms", code="202410")[0]["descr"] == "New"
+    # the second refresh asked for rows since the first one's rows, after they were applied
+    assert [params.get("since") for sql, params in source.reads] == [None, datetime(2024, 1, 1),
+                                                                      datetime(2024, 1, 1)]
+    mirror.refresh("terms")
+    assert source.reads[-1][1]["since"] == datetime(2024, 2, 1)
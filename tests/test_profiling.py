@@ -0,0 +1,64 @@
+import warnings
+import tracemalloc
+import pytest
+from profpy.db.general import profiling
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.MemoryProfiler()
+    yield profiler
+    profiler.disable()
+
+
+def test_measures_fresh_peak_per_query(profiler):
+    profiler.enable()
+    big = bytearray(5_000_000)
+    del big
+    probe = profiler.start("select 1 from dual")
+    probe.finish(1)
+    report = profiler.report()[0]
+    assert report["max_bytes"] < 5_000_000
+    assert report["measurement"] == profiling.MEASUREMENT_PEAK
+
+
+def test_warns_once_without_reset_peak(profiler, monkeypatch):
+    monkeypatch.setattr(profiling, "_can_reset_peak", False)
+    with pytest.warns(RuntimeWarning, match="reset_peak"):
+        profiler.enable()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        profiler.enable()
+
+    big = bytearray(5_000_000)
+    del big
+    probe = profiler.start("select 1 from dual")
+    probe.finish(1)
+    # without reset_peak the earlier peak must not be attributed to the query, and it isn't reported as a peak
+    report = profiler.report()[0]
+    assert report["max_bytes"] < 5_000_000
+    assert report["measurement"] == profiling.MEASUREMENT_GROWTH
+    assert tracemalloc.is_tracing()
+
+
+def test_overlapping_probes_are_not_measured(profiler):
+    profiler.enable(budget_bytes=1)
+    first = profiler.start("select * from terms")
+    second = profiler.start("select * from courses")
+    big = bytearray(5_000_000)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        second.finish(1)
+        first.finish(2)
+    del big
+
+    # a peak that either query could have caused isn't given to both of them
+    report = {r["sql"]: r for r in profiler.report()}
+    assert report["select * from terms"]["overlapped"] == report["select * from courses"]["overlapped"] == 1
+    assert report["select * from terms"]["rows"] == 2
+    assert report["select * from terms"]["max_bytes"] == report["select * from courses"]["max_bytes"] == 0
+
+    # once they're done, the next query is measured on its own again
+    profiler.start("select * from rooms").finish(1)
+    report = {r["sql"]: r for r in profiler.report()}
+    assert report["select * from rooms"]["overlapped"] == 0
@@ -0,0 +1,63 @@
+import pytest
+from flask import Blueprint
+from profpy.web import SecureFlaskApp
+from profpy.web.queries import COUNT_HEADER
+
+
+_builtins = dict(metrics_endpoint="metrics", health_probes=True, jobs_endpoint="jobs")
+
+
+def _app(engine, **options):
+    return SecureFlaskApp(__name__, "test", engine, **options)
+
+
+@pytest.mark.parametrize("rule", ["/metrics", "/health/live", "/health/ready/", "/jobs/<int:job_id>",
+                                  "/jobs/<report>/result"])
+def test_shadowing_builtin_route_raises(primary, rule):
+    app = _app(primary, **_builtins)
+    with pytest.raises(ValueError, match="SecureFlaskApp"):
+        app.add_url_rule(rule, "mine", lambda **kwargs: "mine")
+
+
+def test_blueprint_shadowing_builtin_route_raises(primary):
+    app = _app(primary, **_builtins)
+    blueprint = Blueprint("reports", __name__)
+    blueprint.add_url_rule("/metrics", "metrics", lambda: "mine")
+    with pytest.raises(ValueError, match="metrics_endpoint"):
+        app.register_blueprint(blueprint)
+
+
+def test_builtin_routes_are_opt_in(primary):
+    app = _app(primary)
+    for rule in ("/metrics", "/health/live", "/jobs/<job_id>"):
+        app.add_url_rule(rule, rule, lambda **kwargs: "mine")
+    client = app.test_client()
+    assert client.get("/metrics").get_data() == b"mine"
+    assert client.get("/health/live").get_data() == b"mine"
+
+
+def test_builtin_routes_can_be_moved(primary):
+    app = _app(primary, metrics_endpoint="internal/metrics", health_probes=True, jobs_endpoint="background")
+    app.add_url_rule("/metrics", "metrics_page", lambda: "mine")
+    app.add_url_rule("/jobs/<job_id>", "job_page", lambda job_id: job_id)
+    assert app.test_client().get("/jobs/1").get_data() == b"1"
+
+
+def test_failed_statements_are_timed_without_leaking(primary):
+    app = _app(primary, metrics_endpoint="metrics", query_profiling=True)
+
+    @app.route("/queries")
+    def queries():
+        with primary.connect() as connection:
+            for _ in range(3):
+                try:
+                    connection.exec_driver_sql("select * from missing")
+                except Exception:
+                    connection.rollback()
+            connection.exec_driver_sql("select name from people").all()
+            assert not any(key.startswith("profpy") for key in connection.info)
+        return "ok"
+
+    response = app.test_client().get("/queries")
+    assert response.get_data() == b"ok"
+    assert response.headers[COUNT_HEADER] == "4"
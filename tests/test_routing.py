@@ -0,0 +1,151 @@
+from flask import jsonify
+from sqlalchemy import create_engine, MetaData, Table, select, insert
+from profpy.db import ReplicaRouter
+from profpy.web import SecureFlaskApp
+from profpy.web.web import _session_scope
+from conftest import people_engine
+
+
+def _people(engine):
+    return Table("people", MetaData(), autoload_with=engine)
+
+
+def _name(session_or_connection, people):
+    return session_or_connection.execute(select(people.c.name)).scalar()
+
+
+def test_read_only_session_reads_from_replica(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    people = _people(primary)
+    with router.sessionmaker(read_only=True)() as session:
+        assert session.get_bind() is replica
+        assert _name(session, people) == "replica"
+
+
+def test_read_write_session_uses_primary(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    people = _people(primary)
+    with router.sessionmaker()() as session:
+        assert session.get_bind() is primary
+        assert _name(session, people) == "primary"
+
+
+def test_writes_go_to_primary_in_read_only_session(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    people = _people(primary)
+    with router.sessionmaker(read_only=True)() as session:
+        assert session.get_bind(clause=insert(people)) is primary
+        session.execute(insert(people).values(id=2, name="new"))
+        session.commit()
+    with primary.connect() as connection:
+        assert connection.execute(select(people.c.name).where(people.c.id == 2)).scalar() == "new"
+    with replica.connect() as connection:
+        assert connection.execute(select(people.c.name).where(people.c.id == 2)).scalar() is None
+
+
+def test_read_only_can_be_decided_at_query_time(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    people = _people(primary)
+    read_only = [True]
+    with router.sessionmaker(read_only=lambda: read_only[0])() as session:
+        assert _name(session, people) == "replica"
+        read_only[0] = False
+        assert session.get_bind() is primary
+
+
+def test_lagging_replica_falls_back_to_primary(primary, replica):
+    lag = [100.0]
+    router = ReplicaRouter(primary, [replica], max_lag_seconds=10, lag_check=lambda connection: lag[0],
+                           lag_check_interval=0)
+    assert router.get_engine(read_only=True) is primary
+    lag[0] = 1.0
+    assert router.get_engine(read_only=True) is replica
+
+
+def test_lag_check_is_cached(primary, replica):
+    checks = []
+    router = ReplicaRouter(primary, [replica], max_lag_seconds=10, lag_check_interval=60,
+                           lag_check=lambda connection: checks.append(1) or 0.0)
+    for _ in range(3):
+        assert router.get_engine(read_only=True) is replica
+    assert len(checks) == 1
+
+
+def test_unavailable_replica_fails_over(tmp_path, primary):
+    missing = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = ReplicaRouter(primary, [missing], retry_after=60)
+    people = _people(primary)
+    with router.connect(read_only=True) as connection:
+        assert _name(connection, people) == "primary"
+    # marked down, so it isn't tried again until retry_after passes
+    assert router.get_engine(read_only=True) is primary
+
+
+def test_replicas_round_robin(tmp_path, primary, replica):
+    other = people_engine(tmp_path / "other.db", "other")
+    router = ReplicaRouter(primary, [replica, other])
+    assert {router.get_engine(read_only=True) for _ in range(4)} == {replica, other}
+
+
+def test_app_routes_get_requests_to_replica(primary, replica):
+    app = SecureFlaskApp(__name__, "test", primary, ["main.people"], replica_engines=[replica],
+                         metrics_endpoint=None)
+
+    @app.route("/name", methods=["GET", "POST"])
+    def name():
+        return jsonify(name=_name(app.db, app.main.people), query=app.execute_query("select name from people")[0])
+
+    client = app.test_client()
+    assert client.get("/name").json == dict(name="replica", query=dict(name="replica"))
+    assert client.post("/name").json == dict(name="primary", query=dict(name="primary"))
+
+
+def test_session_reads_its_own_writes(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    people = _people(primary)
+    with router.sessionmaker(read_only=True)() as session:
+        assert _name(session, people) == "replica"
+        session.execute(insert(people).values(id=2, name="new"))
+        session.commit()
+        # the replica hasn't seen the insert, so reads stay on the primary
+        assert session.get_bind() is primary
+        assert session.execute(select(people.c.name).where(people.c.id == 2)).scalar() == "new"
+        session.close()
+        assert session.get_bind() is replica
+
+
+def test_app_reads_its_own_writes_in_a_get_request(primary, replica):
+    app = SecureFlaskApp(__name__, "test", primary, ["main.people"], replica_engines=[replica],
+                         metrics_endpoint=None)
+    people = app.main.people
+
+    @app.route("/add")
+    def add():
+        app.db.execute(insert(people).values(id=2, name="new"))
+        app.db.commit()
+        return jsonify(count=len(app.execute_query("select name from people")),
+                       name=app.db.execute(select(people.c.name).where(people.c.id == 2)).scalar())
+
+    assert app.test_client().get("/add").json == dict(count=2, name="new")
+
+
+def test_app_enlarges_small_pools(tmp_path):
+    people_engine(tmp_path / "small.db", "primary").dispose()
+    people_engine(tmp_path / "small_replica.db", "replica").dispose()
+    engine = create_engine(f"sqlite:///{tmp_path / 'small.db'}", pool_size=1, max_overflow=0)
+    small_replica = create_engine(f"sqlite:///{tmp_path / 'small_replica.db'}", pool_size=2, max_overflow=1)
+    app = SecureFlaskApp(__name__, "test", engine, ["main.people"], replica_engines=[small_replica],
+                         worker_threads="6", metrics_endpoint=None)
+    assert engine.pool.size() == small_replica.pool.size() == 6
+    with app.app_context():
+        assert _name(app.db, app.main.people) == "primary"
+
+
+def test_each_app_context_gets_its_own_session_scope(primary):
+    app = SecureFlaskApp(__name__, "test", primary, ["main.people"], metrics_endpoint=None)
+    scopes = []
+    for _ in range(3):
+        with app.app_context():
+            scopes.append(_session_scope())
+            assert _session_scope() == scopes[-1]
+    assert len(set(scopes)) == 3
@@ -0,0 +1,91 @@
+import pytest
+from flask import jsonify
+from sqlalchemy import create_engine, text
+from profpy.web import SecureFlaskApp
+from conftest import add_security_tables, login
+
+_security = dict(security_schema="main", role_table="app_role", user_table="app_user",
+                 user_role_table="app_user_app_role")
+
+
+@pytest.fixture
+def security_engine(primary):
+    add_security_tables(primary, dict(nedry=["ROLE_ADMIN"], hammond=["ROLE_ADMIN"], muldoon=[], arnold=[]))
+    return primary
+
+
+def _app(engine, **options):
+    app = SecureFlaskApp(__name__, "test", engine, ["main.people"], metrics_endpoint=None,
+                         **dict(_security, **options))
+
+    @app.route("/admin")
+    @app.secured(any_roles=["ROLE_ADMIN"])
+    def admin():
+        return jsonify(message="ok")
+
+    return app
+
+
+def _revoke(engine, user):
+    with engine.begin() as connection:
+        connection.execute(text("delete from app_user_app_role where app_user_id = "
+                                "(select id from app_user where username = :user)"), dict(user=user))
+
+
+def test_revoked_role_applies_immediately_by_default(security_engine):
+    client = _app(security_engine).test_client()
+    login(client, "nedry")
+    assert client.get("/admin").status_code == 200
+    _revoke(security_engine, "nedry")
+    assert client.get("/admin").status_code == 403
+
+
+def test_cached_roles_need_invalidation(security_engine):
+    app = _app(security_engine, auth_cache_ttl=60)
+    client = app.test_client()
+    login(client, "nedry")
+    assert client.get("/admin").status_code == 200
+    # the cache is server-side, the session cookie only holds the CAS user
+    with client.session_transaction() as session:
+        assert set(session) <= {"cas-object", "_fresh", "_permanent"}
+    _revoke(security_engine, "nedry")
+    assert client.get("/admin").status_code == 200
+    app.invalidate_authorization("nedry")
+    assert client.get("/admin").status_code == 403
+
+
+def test_missing_security_table_raises(primary):
+    with pytest.raises(ValueError, match="Security tables could not be reflected"):
+        _app(primary)
+
+
+def test_uppercase_names_load_from_snapshot(tmp_path, security_engine):
+    snapshot = str(tmp_path / "metadata.pickle")
+    _app(security_engine).save_metadata_snapshot(snapshot)
+
+    # nothing to reflect from, so every table has to come from the snapshot
+    empty = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+    app = SecureFlaskApp(__name__, "test", empty, ["MAIN.PEOPLE"], metrics_endpoint=None,
+                         security_schema="MAIN", role_table="APP_ROLE", user_table="APP_USER",
+                         user_role_table="APP_USER_APP_ROLE", metadata_snapshot=snapshot)
+    assert app.MAIN.people.name == "people"
+    assert app.roles.name == "app_role" and app.user_roles.name == "app_user_app_role"
+
+
+def test_snapshot_writable_by_others_is_refused(tmp_path, security_engine):
+    snapshot = tmp_path / "metadata.pickle"
+    _app(security_engine).save_metadata_snapshot(str(snapshot))
+    snapshot.chmod(0o666)
+    with pytest.raises(PermissionError, match="other users"):
+        _app(security_engine, metadata_snapshot=str(snapshot))
+
+
+def test_table_named_tables_is_reachable(tmp_path, security_engine):
+    with security_engine.begin() as connection:
+        connection.execute(text("create table tables (id integer primary key)"))
+    snapshot = str(tmp_path / "metadata.pickle")
+    for reflection in ("eager", "lazy"):
+        app = SecureFlaskApp(__name__, "test", security_engine, ["main.people", "main.tables"],
+                             metrics_endpoint=None, reflection=reflection)
+        assert app.main.tables.name == "tables"
+        app.save_metadata_snapshot(snapshot)
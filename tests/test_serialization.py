@@ -0,0 +1,43 @@
+import json
+import pytest
+from decimal import Decimal
+from flask import jsonify
+from sqlalchemy import text
+from profpy.web import SecureFlaskApp
+from profpy.web import serialization
+
+
+@pytest.fixture
+def app(primary):
+    with primary.begin() as connection:
+        connection.execute(text("create table grades (id integer primary key, term text, gpa numeric(4, 2), "
+                                "graded date)"))
+        connection.execute(text("insert into grades values (1, '202410', 3.25, '2024-05-01')"))
+    return SecureFlaskApp(__name__, "test", primary, ["main.grades"], metrics_endpoint=None)
+
+
+def test_as_json_matches_jsonify(app):
+    grades = app.main.grades
+    with app.test_request_context():
+        rows = app.db.query(grades).all()
+        response = grades.as_json(rows, as_http_response=True)
+        expected = jsonify([dict(id=1, term="202410", gpa=Decimal("3.25"), graded="2024-05-01")])
+        assert response.get_data() == expected.get_data()
+        assert json.loads(response.get_data())[0]["gpa"] == "3.25"
+
+
+@pytest.mark.skipif(serialization.orjson is None, reason="orjson isn't installed")
+def test_as_json_orjson_is_opt_in(app):
+    grades = app.main.grades
+    with app.test_request_context():
+        response = grades.as_json(app.db.query(grades).all(), as_http_response=True, use_orjson=True)
+        assert response.get_data() == b'[{"id":1,"term":"202410","gpa":"3.25","graded":"2024-05-01"}]'
+
+
+def test_stream_keeps_decimals_exact(app):
+    grades = app.main.grades
+    with app.test_request_context():
+        response = grades.as_json_stream(app.db.query(grades).all())
+        assert json.loads(b"".join(part.encode() if isinstance(part, str) else part for part in response.response)) \
+            == [dict(id=1, term="202410", gpa="3.25", graded="2024-05-01")]
+    assert serialization.dumps(dict(gpa=Decimal("0.1"))) == '{"gpa":"0.1"}'
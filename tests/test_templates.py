@@ -0,0 +1,42 @@
+import os
+import stat
+import pytest
+from profpy.web import templates
+from profpy.web import SecureFlaskApp
+
+
+@pytest.fixture
+def template_folder(tmp_path):
+    folder = tmp_path / "templates"
+    folder.mkdir()
+    (folder / "hello.html").write_text("Hello {{ name }}")
+    return folder
+
+
+def test_precompiled_templates_are_private(tmp_path, template_folder):
+    cache_dir = tmp_path / "cache"
+    assert templates.precompile_templates(str(template_folder), str(cache_dir)) == ["hello.html"]
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) & 0o077 == 0
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_default_cache_dir_is_per_user():
+    assert templates.DEFAULT_CACHE_DIR.endswith(f"_{os.getuid()}")
+
+
+def test_shared_cache_dir_is_refused(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        templates.bytecode_cache(str(cache_dir))
+
+
+def test_app_runs_without_an_unsafe_cache_dir(tmp_path, primary, caplog):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+    app = SecureFlaskApp(__name__, "test", primary, metrics_endpoint=None,
+                         template_cache_dir=str(cache_dir))
+    assert app.jinja_env.bytecode_cache is None
+    assert "Template cache directory" in caplog.text